@@ -1,11 +1,12 @@
 from logging.config import fileConfig
-import os
+import asyncio
 
 from alembic import context
-from sqlalchemy import create_engine, pool
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import create_async_engine
 
 # Import your models' MetaData object here
-from services.database import Base
+from services.database import Base, DATABASE_URL
 
 # Alembic Config
 config = context.config
@@ -17,8 +18,8 @@ if config.config_file_name is not None:
 # Metadata for 'autogenerate'
 target_metadata = Base.metadata
 
-# Use DATABASE_URL env var for Alembic autogenerate to work (sync engine)
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./data/bot_dev.db")
+# Same DATABASE_URL (async driver) as the bot; online migrations run through run_sync
+DB_URL = DATABASE_URL
 config.set_main_option("sqlalchemy.url", DB_URL)
 
 
@@ -33,54 +34,22 @@ def run_migrations_offline():
         context.run_migrations()
 
 
-def run_migrations_online():
-    connectable = create_engine(DB_URL, poolclass=pool.NullPool)
-    with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
-        with context.begin_transaction():
-            context.run_migrations()
-
-
-if context.is_offline_mode():
-    run_migrations_offline()
-else:
-    run_migrations_online()
-
-*** Begin Patch
-@@
-from sqlalchemy import pool
-from sqlalchemy.engine import create_engine
-from sqlalchemy import engine_from_config
-from sqlalchemy import pool
-from sqlalchemy import pool
-from sqlalchemy.engine import create_engine
-from sqlalchemy import engine_from_config
-from sqlalchemy import pool
-@@
-from services.database import Base
-from services.database import Base
-*** End Patchle for Python logging.
-fileConfig(config.config_file_name)
+def do_run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
 
-# Import your models' MetaData object here
-from services.database import Base
-target_metadata = Base.metadata
 
-# Use DATABASE_URL env var (sync engine) for Alembic autogenerate to work.
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./data/bot_dev.db")
-config.set_main_option("sqlalchemy.url", DB_URL)
+async def run_async_migrations():
+    connectable = create_async_engine(DB_URL, poolclass=pool.NullPool)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
 
-def run_migrations_offline():
-    context.configure(url=DB_URL, target_metadata=target_metadata, literal_binds=True)
-    with context.begin_transaction():
-        context.run_migrations()
 
 def run_migrations_online():
-    connectable = create_engine(DB_URL)
-    with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
-        with context.begin_transaction():
-            context.run_migrations()
+    asyncio.run(run_async_migrations())
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,27 @@
+"""users.search_started_at for wait-ordered matching
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tables may already have been created by init_db()'s create_all
+    insp = sa.inspect(op.get_bind())
+    if 'search_started_at' not in {c['name'] for c in insp.get_columns('users')}:
+        op.add_column('users', sa.Column('search_started_at', sa.DateTime(timezone=True), nullable=True))
+    if 'ix_users_status_search_started' not in {i['name'] for i in insp.get_indexes('users')}:
+        op.create_index('ix_users_status_search_started', 'users', ['status', 'search_started_at'])
+
+
+def downgrade():
+    op.drop_index('ix_users_status_search_started', table_name='users')
+    op.drop_column('users', 'search_started_at')
@@ -0,0 +1,44 @@
+"""indexes for the hot access paths in services/database.py
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, partial WHERE per dialect or None)
+INDEXES = [
+    ('ix_users_status_gender_province_city', 'users', ['status', 'gender', 'province', 'city'], None),
+    ('ix_chat_sessions_status_user_a', 'chat_sessions', ['status', 'user_a'], None),
+    ('ix_chat_sessions_status_user_b', 'chat_sessions', ['status', 'user_b'], None),
+    ('ix_chat_sessions_status_last_activity', 'chat_sessions', ['status', 'last_activity'], None),
+    ('ix_reports_created_at', 'reports', ['created_at'], None),
+    ('ix_invites_inviter_id', 'invites', ['inviter_id'], None),
+    ('ix_blocks_blocked_id', 'blocks', ['blocked_id'], None),
+    ('ix_proxies_usable', 'proxies', ['proxy'], {
+        'sqlite_where': sa.text('active = 1 AND quarantine = 0'),
+        'postgresql_where': sa.text('active = true AND quarantine = false'),
+    }),
+]
+
+
+def upgrade():
+    # tables and indexes may already have been created by init_db()'s create_all
+    insp = sa.inspect(op.get_bind())
+    existing = {}
+    for name, table, columns, where in INDEXES:
+        if table not in existing:
+            existing[table] = {i['name'] for i in insp.get_indexes(table)}
+        if name not in existing[table]:
+            op.create_index(name, table, columns, **(where or {}))
+
+
+def downgrade():
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
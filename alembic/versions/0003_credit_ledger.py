@@ -0,0 +1,41 @@
+"""append-only credit ledger
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table may already have been created by init_db()'s create_all
+    insp = sa.inspect(op.get_bind())
+    if 'credit_ledger' not in insp.get_table_names():
+        op.create_table(
+            'credit_ledger',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('user_id', sa.BigInteger(), nullable=False),
+            sa.Column('delta', sa.Integer(), nullable=False),
+            sa.Column('balance', sa.Integer(), nullable=False),
+            sa.Column('reason', sa.String(32), nullable=False),
+            sa.Column('ref', sa.String(128), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index('ix_credit_ledger_user_id', 'credit_ledger', ['user_id', 'id'])
+    # opening balances, so sum(delta) per user matches users.credits from here on
+    op.execute(
+        "INSERT INTO credit_ledger (user_id, delta, balance, reason) "
+        "SELECT id, credits, credits, 'opening' FROM users "
+        "WHERE credits <> 0 AND NOT EXISTS (SELECT 1 FROM credit_ledger l WHERE l.user_id = users.id)"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_credit_ledger_user_id', table_name='credit_ledger')
+    op.drop_table('credit_ledger')
@@ -0,0 +1,69 @@
+"""archive tables and checkpoints for the retention worker
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+TABLES = {
+    'chat_sessions_archive': [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('user_a', sa.BigInteger(), nullable=False),
+        sa.Column('user_b', sa.BigInteger(), nullable=False),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_activity', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('ended_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('status', sa.String(32), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    ],
+    'reports_archive': [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('reporter_id', sa.BigInteger(), nullable=False),
+        sa.Column('reported_id', sa.BigInteger(), nullable=False),
+        sa.Column('reason', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    ],
+    'orders_archive': [
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('provider', sa.String(32), nullable=False),
+        sa.Column('ref', sa.String(128), nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('paid_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    ],
+    'archive_checkpoints': [
+        sa.Column('name', sa.String(32), primary_key=True),
+        sa.Column('last_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rows', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('last_file', sa.String(512), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    ],
+}
+
+
+def upgrade():
+    # tables and indexes may already have been created by init_db()'s create_all
+    insp = sa.inspect(op.get_bind())
+    existing = set(insp.get_table_names())
+    for name, columns in TABLES.items():
+        if name not in existing:
+            op.create_table(name, *columns)
+    if 'ix_orders_status_created_at' not in {i['name'] for i in insp.get_indexes('orders')}:
+        op.create_index('ix_orders_status_created_at', 'orders', ['status', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_orders_status_created_at', table_name='orders')
+    for name in reversed(list(TABLES)):
+        op.drop_table(name)
@@ -0,0 +1,141 @@
+# bench/import_bench.py
+"""
+Cold-start import benchmark.
+
+Imports each entry module (bot, the match worker, the archiver) in a fresh interpreter under
+`python -X importtime`, several times, and reports the median import time of the module,
+wall time of the whole process and peak RSS. Fails when a heavy optional dependency
+(yt-dlp, pydub, shazamio, stripe, aioboto3, requests, cryptography's Fernet) is imported at
+startup instead of on first use, or when numbers regress against a saved baseline.
+
+    python bench/import_bench.py
+    python bench/import_bench.py --top 15                     # biggest imports per module
+    python bench/import_bench.py --save-baseline bench/import_baseline.json
+    python bench/import_bench.py --baseline bench/import_baseline.json   # exit 1 on regression
+
+Baselines are machine-specific; save one on the machine that runs the check.
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = ["bot", "services.worker.match_worker", "services.worker.archiver"]
+# must only ever be imported inside the functions that use them
+HEAVY = ["yt_dlp", "pydub", "shazamio", "stripe", "aioboto3", "boto3", "botocore", "requests", "cryptography.fernet"]
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+_PROBE = "import {mod}, resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--module", action="append", help="entry module to import (repeatable; default: %s)" % ", ".join(MODULES))
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per module; medians are reported")
+    ap.add_argument("--top", type=int, default=0, help="print the N slowest imports (cumulative) per module")
+    ap.add_argument("--json", action="store_true", help="print the report as JSON only")
+    ap.add_argument("--baseline", default="", help="compare against a saved report")
+    ap.add_argument("--save-baseline", default="", help="write this run's report to a file")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression vs baseline")
+    return ap.parse_args()
+
+
+def parse_importtime(stderr: str):
+    """
+    [(cumulative_us, depth, module)] in the order -X importtime printed them.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((int(m.group(2)), len(m.group(3)), m.group(4)))
+    return rows
+
+
+def profile(module: str) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(mod=module)],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+    rows = parse_importtime(proc.stderr)
+    own = min((r for r in rows if r[2] == module), key=lambda r: r[1])
+    return {
+        "import_ms": own[0] / 1000,
+        "wall_ms": wall * 1000,
+        "rss_mb": int(proc.stdout.split()[-1]) / 1024,  # ru_maxrss is KiB on Linux
+        "modules": {name for _, _, name in rows},
+        "rows": rows,
+    }
+
+
+def run(args) -> dict:
+    report = {}
+    for module in args.module or MODULES:
+        profile(module)  # warm the bytecode cache so every counted run is comparable
+        runs = [profile(module) for _ in range(args.runs)]
+        heavy = sorted(h for h in HEAVY if any(m == h or m.startswith(h + ".") for r in runs for m in r["modules"]))
+        report[module] = {
+            "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+            "wall_ms": round(statistics.median(r["wall_ms"] for r in runs), 1),
+            "rss_mb": round(statistics.median(r["rss_mb"] for r in runs), 1),
+            "modules_imported": len(runs[-1]["modules"]),
+            "heavy_imports": heavy,
+        }
+        if args.top:
+            report[module]["top"] = [
+                f"{us / 1000:8.1f} ms  {name}" for us, _, name in sorted(runs[-1]["rows"], reverse=True)[:args.top]
+            ]
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    problems = []
+    for module, now in report.items():
+        for name in now["heavy_imports"]:
+            problems.append(f"{module} imports {name} at startup")
+        base = baseline.get(module)
+        if not base:
+            continue
+        for key in ("import_ms", "wall_ms", "rss_mb"):
+            if now[key] > base[key] * (1 + tolerance):
+                problems.append(f"{module} {key} {now[key]} > baseline {base[key]}")
+    return problems
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for module, r in report.items():
+            print(f"{module}:")
+            for k, v in r.items():
+                if k == "top":
+                    print("  top imports:")
+                    for line in v:
+                        print("    " + line)
+                else:
+                    print(f"  {k:>16}: {v}")
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({m: {k: v for k, v in r.items() if k != "top"} for m, r in report.items()}, indent=2)
+        )
+    problems = compare(report, json.loads(Path(args.baseline).read_text()) if args.baseline else {}, args.tolerance)
+    for p in problems:
+        print("REGRESSION:", p, file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# bench/webhook_replay.py
+"""
+Webhook replay.
+
+Posts recorded updates (a JSON lines file, one Telegram Update per line, or a JSON array)
+to a running webhook server, `concurrency` requests at a time (re-posting the ones answered
+503, as Telegram does), optionally re-sending a share of them to exercise update_id
+deduplication, and reports the status codes, p50/p99 response
+time and requests/s. Without --updates it generates plain text messages from --users users.
+
+    BOT_MODE=webhook WEBHOOK_URL= python bot.py                  # local server, not registered
+    python bench/webhook_replay.py --updates recorded.jsonl
+    python bench/webhook_replay.py --synthetic 5000 --duplicate-rate 0.1 --concurrency 128
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    port = os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080"))
+    ap.add_argument("--url", default=f"http://127.0.0.1:{port}{os.getenv('WEBHOOK_PATH', '/webhook')}")
+    ap.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    ap.add_argument("--updates", default="", help="recorded updates (.jsonl or JSON array)")
+    ap.add_argument("--synthetic", type=int, default=1000, help="generated updates when --updates is not given")
+    ap.add_argument("--users", type=int, default=200, help="distinct senders for generated updates")
+    ap.add_argument("--duplicate-rate", type=float, default=0.0, help="share of updates posted a second time")
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--retries", type=int, default=5, help="re-posts of an update answered with 503")
+    return ap.parse_args()
+
+
+def load_updates(path: str):
+    text = Path(path).read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_updates(n: int, users: int):
+    now = int(time.time())
+    updates = []
+    for i in range(n):
+        uid = random.randint(1, users)
+        updates.append({
+            "update_id": 10_000_000 + i,
+            "message": {
+                "message_id": i + 1, "date": now,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"},
+                "text": random.choice(["سلام", "hi", "/balance", "/online", "?"]),
+            },
+        })
+    return updates
+
+
+async def replay(args, updates):
+    statuses = Counter()
+    latencies = []
+    sem = asyncio.Semaphore(args.concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+
+    async def post(session, update):
+        for _ in range(args.retries + 1):
+            async with sem:
+                started = time.perf_counter()
+                try:
+                    async with session.post(args.url, json=update, headers=headers) as resp:
+                        await resp.read()
+                        status = resp.status
+                        retry_after = float(resp.headers.get("Retry-After", 1))
+                except aiohttp.ClientError as e:
+                    status, retry_after = type(e).__name__, 1.0
+                latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+            if status != 503:
+                return
+            # like Telegram: a busy server gets the update again later
+            await asyncio.sleep(retry_after)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, u) for u in updates))
+    return statuses, latencies, time.perf_counter() - started
+
+
+def main():
+    args = parse_args()
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.synthetic, args.users)
+    dupes = random.sample(updates, int(len(updates) * args.duplicate_rate))
+    statuses, latencies, wall = asyncio.run(replay(args, updates + dupes))
+    latencies.sort()
+    print(json.dumps({
+        "requests": len(latencies),
+        "duplicates_sent": len(dupes),
+        "status": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "requests_per_s": round(len(latencies) / wall, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,110 @@
+import time
+_STARTED = time.perf_counter()
+
+import argparse
 import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import TOKEN, PROXY_HEALTH_INTERVAL
+from config import TOKEN, PROXY_HEALTH_INTERVAL, ARCHIVE_BACKEND, BOT_MODE, UPDATE_PARTITIONS, FSM_STORAGE, MATCH_BACKEND
 from handlers import start, download, music, admin, admin_panel, anonymous_chat
 from services.proxy_service import proxy_health_worker
-from services.database import init_db
+from services.schema import ensure_schema, migrate
+from services.session_activity import activity_tracker
+from services.send_scheduler import send_scheduler
+from services.rate_limit import throttle
+from services.relay import relay_pipeline
+from services.worker.archiver import archive_loop
+from services.worker.match_worker import scan_and_match_loop
 
-async def main():
-    await init_db()
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def parse_args():
+    ap = argparse.ArgumentParser(description="Run the bot")
+    ap.add_argument("--migrate", action="store_true",
+                    help="bring the database schema up to date (alembic upgrade head) before starting")
+    ap.add_argument("--migrate-only", action="store_true", help="migrate and exit (release step)")
+    ap.add_argument("--mode", choices=["polling", "webhook"], default=BOT_MODE,
+                    help="how updates arrive (default: BOT_MODE)")
+    return ap.parse_args()
 
+def build_dispatcher() -> Dispatcher:
+    """
+    The dispatcher with every router; used by this process, or by each update worker
+    (services/worker/update_worker.py) when updates are partitioned.
+    """
+    if FSM_STORAGE == "redis":
+        # FSM state must be shared once a user's updates can land on another process
+        from aiogram.fsm.storage.redis import RedisStorage
+        from services.cache import get_redis
+        storage = RedisStorage(get_redis())
+    else:
+        storage = MemoryStorage()
+    # FSM is registered by hand so the relay slot can be reserved ahead of it: the storage
+    # read (a Redis round trip with RedisStorage) and the throttle both await, and updates
+    # handled concurrently would otherwise reach the relay queue out of order
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.update.outer_middleware(relay_pipeline.order_middleware)
+    dp.update.outer_middleware(dp.fsm)
+    # anti-flood before any router; a dropped update releases its relay slot
+    dp.message.outer_middleware(throttle)
+    dp.callback_query.outer_middleware(throttle)
+    # a message routed to anything but the relay handler frees its relay slot right away
+    dp.message.middleware(relay_pipeline.handler_middleware)
+
+    # chat first: while chatting, messages go to the partner instead of the catch-all
+    # download/music/admin handlers (commands still reach their routers)
+    dp.include_router(anonymous_chat.router)
     dp.include_router(start.router)
     dp.include_router(download.router)
     dp.include_router(music.router)
     dp.include_router(admin.router)
     dp.include_router(admin_panel.router)
-    dp.include_router(anonymous_chat.router)
+    return dp
+
+async def main(args):
+    imported = time.perf_counter()
+    if args.migrate_only:
+        await migrate()
+        print("schema is up to date")
+        return
+    schema = await ensure_schema(migrate_if_needed=args.migrate)
+    checked = time.perf_counter()
+    bot = Bot(token=TOKEN)
+    send_scheduler.install(bot)  # every send goes through the flood-limit scheduler
+    dp = build_dispatcher()
+    partitioned = UPDATE_PARTITIONS > 1
+    if partitioned:
+        from services.update_stream import check_partitioned_config
+        check_partitioned_config()
 
     asyncio.create_task(proxy_health_worker())
+    if not partitioned:
+        asyncio.create_task(activity_tracker.run())  # update workers run their own
+    if MATCH_BACKEND == "memory":
+        # the searcher pool lives in this process, so its batch pass (filter relaxation, lost
+        # searchers) runs here too, woken by enqueue_search; the Redis pool has its own
+        # process (python -m services.worker.match_worker)
+        asyncio.create_task(scan_and_match_loop())
+    if ARCHIVE_BACKEND != "off":
+        asyncio.create_task(archive_loop())
+
+    print(f"bot is running in {args.mode} mode"
+          + (f", {UPDATE_PARTITIONS} update partitions" if partitioned else "")
+          + f" (startup {time.perf_counter() - _STARTED:.2f}s: "
+          f"imports {imported - _STARTED:.2f}s, schema {schema} in {checked - imported:.2f}s)")
+    # partitioned: this process only receives updates; update workers handle them
+    sink = None
+    if partitioned:
+        from services.update_stream import update_stream
+        sink = update_stream.publish
+    if args.mode == "webhook":
+        from services.webhook import WebhookServer
+        await WebhookServer(bot, dp, sink=sink).run()
+    else:
+        await bot.delete_webhook()  # getUpdates is refused while a webhook is registered
+        if partitioned:
+            from services.update_stream import poll_into
+            await poll_into(bot, update_stream, dp.resolve_used_update_types())
+        else:
+            await dp.start_polling(bot)
 
-    print("bot is running")
-    await dp.start_polling(bot)
-    
 if __name__=="__main__":
-   asyncio.run(main())
+   asyncio.run(main(parse_args()))
@@ -25,5 +25,83 @@ DATA_DIR.mkdir(parents=True, exist_ok=True)
 CREDIT_COST_RANDOM = int(os.getenv("CREDIT_COST_RANDOM", 1))
 CREDIT_COST_ADVANCED = int(os.getenv("CREDIT_COST_ADVANCED", 2))
 
+# Matching: "memory" (single process; bot.py runs the match loop) or "redis" (searcher pool
+# shared by all replicas; run `python -m services.worker.match_worker` as its own process,
+# e.g. a Procfile entry `matcher: python -m services.worker.match_worker`)
+MATCH_BACKEND = os.getenv("MATCH_BACKEND", "memory").lower()
+# Number of match worker processes / Redis pools (needs MATCH_BACKEND=redis when > 1)
+MATCH_SHARDS = int(os.getenv("MATCH_SHARDS", 1))
+# Seconds of waiting after which a filtered search drops its city filter, and twice that
+# its province filter (gender is never relaxed). 0 disables relaxation. Applied by the
+# match loop's batch pass (in bot.py with the memory backend, else the match worker).
+MATCH_RELAX_AFTER = int(os.getenv("MATCH_RELAX_AFTER", 0))
 
+# User (status, partner_id) cache for the chat relay: "memory", "redis" or "off".
+# Defaults to the match backend, since a Redis match pool implies several replicas.
+STATE_CACHE_BACKEND = os.getenv("STATE_CACHE_BACKEND", MATCH_BACKEND).lower()
+STATE_CACHE_TTL = int(os.getenv("STATE_CACHE_TTL", 30))
+STATE_CACHE_MAX_USERS = int(os.getenv("STATE_CACHE_MAX_USERS", 200_000))
 
+# Block index: cached peer sets expire after TTL (bounds staleness across replicas);
+# BLOCK_BLOOM_BITS > 0 enables a bloom filter of users that have any block at all
+BLOCK_INDEX_TTL = int(os.getenv("BLOCK_INDEX_TTL", 300))
+BLOCK_INDEX_MAX_USERS = int(os.getenv("BLOCK_INDEX_MAX_USERS", 100_000))
+BLOCK_BLOOM_BITS = int(os.getenv("BLOCK_BLOOM_BITS", 0))
+
+# Retention: ended chat sessions, reports and settled (paid/failed) orders older than these
+# many days are moved out of the hot tables by the archiver, ARCHIVE_BATCH rows at a time.
+# ARCHIVE_BACKEND: "off" (default), "table" (<name>_archive tables) or "jsonl" (gzipped JSON
+# lines under DATA_DIR/archive). Set it to table or jsonl to have bot.py archive every
+# ARCHIVE_INTERVAL seconds, or leave it off and run `python -m services.worker.archiver --once
+# --backend table` from cron. 0 days leaves that table alone.
+ARCHIVE_BACKEND = os.getenv("ARCHIVE_BACKEND", "off").lower()
+ARCHIVE_SESSIONS_DAYS = int(os.getenv("ARCHIVE_SESSIONS_DAYS", 30))
+ARCHIVE_REPORTS_DAYS = int(os.getenv("ARCHIVE_REPORTS_DAYS", 180))
+ARCHIVE_ORDERS_DAYS = int(os.getenv("ARCHIVE_ORDERS_DAYS", 365))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 500))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 3600))
+# pause between batches, so a large backlog never hogs the database
+ARCHIVE_PAUSE_SECONDS = float(os.getenv("ARCHIVE_PAUSE_SECONDS", 0.5))
+
+# Chat relay: per-sender limit of messages waiting for delivery (more are refused), and
+# attempts per message on network/server errors (flood waits are retried by the send scheduler)
+RELAY_QUEUE_MAX = int(os.getenv("RELAY_QUEUE_MAX", 50))
+RELAY_MAX_ATTEMPTS = int(os.getenv("RELAY_MAX_ATTEMPTS", 5))
+
+# Outbound send scheduler (Telegram flood limits): messages per second overall, per
+# private chat (with a short burst) and per group per minute; 429s are retried this often
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", 3))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", 20))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# Anti-flood limits per user (policies in services/rate_limit.py): "memory" (bounded LRU,
+# RATE_LIMIT_MAX_KEYS entries), "redis" (shared by all replicas) or "off"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", MATCH_BACKEND).lower()
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 200_000))
+
+# Update delivery: "polling" or "webhook" (aiohttp server on WEBHOOK_HOST:WEBHOOK_PORT).
+# WEBHOOK_URL is the public base URL registered with Telegram (empty: don't register, e.g.
+# when replaying recorded updates locally); WEBHOOK_SECRET is checked on every request.
+# Updates are deduplicated by update_id for WEBHOOK_DEDUP_TTL seconds, per process
+# ("memory") or across workers ("redis"), and at most WEBHOOK_MAX_INFLIGHT run at once.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", 8080)))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_INFLIGHT = int(os.getenv("WEBHOOK_MAX_INFLIGHT", 100))
+WEBHOOK_DEDUP_BACKEND = os.getenv("WEBHOOK_DEDUP_BACKEND", MATCH_BACKEND).lower()
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", 3600))
+
+# Multi-process update handling. With UPDATE_PARTITIONS > 1, bot.py only receives updates
+# and appends them to the Redis stream updates:<from_user.id % UPDATE_PARTITIONS>; one
+# `python -m services.worker.update_worker` process per partition handles them (in order
+# per user, up to UPDATE_WORKER_CONCURRENCY users at once). Streams keep ~MAXLEN entries.
+UPDATE_PARTITIONS = int(os.getenv("UPDATE_PARTITIONS", 1))
+UPDATE_STREAM_MAXLEN = int(os.getenv("UPDATE_STREAM_MAXLEN", 100_000))
+UPDATE_WORKER_CONCURRENCY = int(os.getenv("UPDATE_WORKER_CONCURRENCY", 64))
+# FSM state: "memory" (single process) or "redis" (shared; required with several partitions)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "redis" if UPDATE_PARTITIONS > 1 else "memory").lower()
@@ -1,14 +1,23 @@
-from aiogram import Router, types
+from aiogram import Router, types, F
 from aiogram.filters import Command
-from services.proxy_service import add_proxy, remove_proxy, list_proxies, extract_proxies_from_text, quarantine_proxy
+from services.proxy_service import add_proxy, remove_proxy, list_proxies_page, extract_proxies_from_text, quarantine_proxy
 from config import ADMINS
 from services.database import mark_order_paid, get_order_by_ref
+from handlers.paging import load_page, pager_kb
 
 router = Router()
+PROXIES_PAGE_SIZE = 25
 
 def is_admin(user_id: int) -> bool:
     return user_id in ADMINS
 
+def _proxy_id(r) -> int:
+    return r[0]
+
+def _proxies_text(rows) -> str:
+    text = "آیدی | پروکسی | فعال | شکست‌ها\n"
+    return text + "\n".join([f"{r[0]} | {r[1][:100]} | {r[4]} | {r[5]}" for r in rows])
+
 @router.message(Command("addproxy"))
 async def cmd_addproxy(message: types.Message):
     if not is_admin(message.from_user.id):
@@ -38,12 +47,20 @@ async def cmd_delproxy(message: types.Message):
 async def cmd_listproxies(message: types.Message):
     if not is_admin(message.from_user.id):
         return await message.reply("❌ شما ادمین نیستید.")
-    rows = await list_proxies()
+    rows, has_prev, has_next = await load_page(list_proxies_page, PROXIES_PAGE_SIZE)
     if not rows:
         return await message.reply("لیست پروکسی خالی است.")
-    text = "آیدی | پروکسی | فعال | شکست‌ها\n"
-    text += "\n".join([f"{r[0]} | {r[1]} | {r[4]} | {r[5]}" for r in rows])  # indexها اصلاح شد
-    await message.reply(text)
+    await message.reply(_proxies_text(rows), reply_markup=pager_kb("proxies", rows, _proxy_id, has_prev, has_next))
+
+@router.callback_query(F.data.startswith("proxies:"))
+async def cb_listproxies_page(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ شما ادمین نیستید.")
+    rows, has_prev, has_next = await load_page(list_proxies_page, PROXIES_PAGE_SIZE, callback.data)
+    await callback.answer()
+    if not rows:
+        return
+    await callback.message.edit_text(_proxies_text(rows), reply_markup=pager_kb("proxies", rows, _proxy_id, has_prev, has_next))
 
 
 @router.message(Command("markpaid"))
@@ -1,8 +1,18 @@
-from aiogram import Router, types
+from aiogram import Router, types, F
 from config import ADMINS
-from services.database import list_reports
+from services.database import reports_page
+from handlers.paging import load_page, pager_kb
 
 router = Router()
+REPORTS_PAGE_SIZE = 20
+
+
+def _report_id(r) -> int:
+    return r["id"]
+
+def _reports_text(rows) -> str:
+    # reasons are clipped so a full page stays under Telegram's 4096-char message limit
+    return "\n".join([f"#{r['id']} {r['reporter_id']} -> {r['reported_id']} : {(r['reason'] or '')[:150]}" for r in rows])
 
 @router.message(lambda msg: msg.text == "admin_panel")
 async def admin_panel(message: types.Message):
@@ -16,8 +26,17 @@ async def admin_panel(message: types.Message):
 async def admin_reports(message: types.Message):
     if message.from_user.id not in ADMINS:
         return await message.answer("شما ادمین نیستید.")
-    rows = await list_reports(limit=30)
+    rows, has_prev, has_next = await load_page(reports_page, REPORTS_PAGE_SIZE)
     if not rows:
         return await message.answer("هیچ گزارشی نیست.")
-    text = "\n".join([f"#{r['id']} {r['reporter_id']} -> {r['reported_id']} : {r['reason'] or ''}" for r in rows])
-    await message.answer(text)
\ No newline at end of file
+    await message.answer(_reports_text(rows), reply_markup=pager_kb("reports", rows, _report_id, has_prev, has_next))
+
+@router.callback_query(F.data.startswith("reports:"))
+async def admin_reports_page(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMINS:
+        return await callback.answer("شما ادمین نیستید.")
+    rows, has_prev, has_next = await load_page(reports_page, REPORTS_PAGE_SIZE, callback.data)
+    await callback.answer()
+    if not rows:
+        return
+    await callback.message.edit_text(_reports_text(rows), reply_markup=pager_kb("reports", rows, _report_id, has_prev, has_next))
\ No newline at end of file
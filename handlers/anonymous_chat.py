@@ -7,18 +7,28 @@ import services.database as db
 from config import CREDIT_COST_RANDOM, CREDIT_COST_ADVANCED
 from handlers.keyboard import chat_actions_kb, buy_credit_kb
 from aiogram import F
-from services.database import get_online_users
+from services.database import online_users_page
 from services.database import get_credits
-from aiogram.types import ContentType
 from aiogram.types import CallbackQuery
 from services.payments import create_stars_order, create_bank_order, create_ton_order
-import time
-
-# simple in-memory rate limit: user_id -> last_ts
-_last_msg_ts = {}
+from services.session_activity import activity_tracker
+from services.relay import relay_pipeline, RELAYED_TYPES
 
+# each update's place in the sender's relay queue is reserved by relay_pipeline.order_middleware,
+# registered on the dispatcher (bot.build_dispatcher) ahead of anything that awaits; handlers
+# other than relay (flags={"relay": True}) give it back before they run
 router = Router()
 
+
+async def chatting(message: Message):
+    """
+    Filter: the sender is in a chat; hands the partner to the handler.
+    """
+    status, partner_id = await db.get_status(message.from_user.id)
+    if status == "chatting" and partner_id:
+        return {"partner_id": partner_id}
+    return False
+
 @router.message(Command("chat"))
 async def cmd_chat(message: Message):
     user_id = message.from_user.id
@@ -100,34 +110,20 @@ async def chat_actions(message: Message):
         await message.reply("کاربر بلاک شد و چت پایان یافت.")
 
 
-@router.message(F.content_type.in_({ContentType.TEXT, ContentType.STICKER, ContentType.PHOTO, ContentType.VOICE, ContentType.VIDEO}))
-async def relay(message: Message):
+@router.message(F.content_type.in_(RELAYED_TYPES), ~F.text.startswith("/"), chatting, flags={"relay": True})
+async def relay(message: Message, partner_id: int, relay_slot=None):
+    # flooding is already cut off by the throttle middleware (services/rate_limit.py)
     user_id = message.from_user.id
-    status, partner_id = await db.get_status(user_id)
-    if status != "chatting" or not partner_id:
-        return
-    # Simple rate limit: drop if user sends too fast (store nothing persistent here; extend later)
-    now = time.monotonic()
-    last = _last_msg_ts.get(user_id, 0)
-    if now - last < 0.5:
-        return
-    _last_msg_ts[user_id] = now
-    # basic relay: forward text or notify unsupported types
-    if message.text:
-        await message.bot.send_message(partner_id, message.text)
-    elif message.sticker:
-        await message.bot.send_sticker(partner_id, message.sticker.file_id)
-    elif message.photo:
-        await message.bot.send_photo(partner_id, message.photo[-1].file_id, caption=message.caption or "")
-    elif message.voice:
-        await message.bot.send_voice(partner_id, message.voice.file_id, caption=message.caption or "")
-    elif message.video:
-        await message.bot.send_video(partner_id, message.video.file_id, caption=message.caption or "")
+    if relay_slot is None:
+        return await message.reply("⏳ پیام‌های قبلی‌ات هنوز در حال ارسال‌اند؛ کمی صبر کن.")
+    # queued, not sent: copy_message goes out from the sender's relay queue, in order
+    relay_pipeline.fill(user_id, relay_slot, message.bot, message.chat.id, message.message_id, partner_id)
+    activity_tracker.touch(user_id, partner_id)
 
 
 @router.message(Command("online"))
 async def list_online(message: Message):
-    rows = await get_online_users(limit=20)
+    rows = await online_users_page(limit=20)
     if not rows:
         return await message.reply("کاربری آنلاین نیست.")
     lines = []
@@ -148,7 +144,7 @@ async def buycredit(message: Message):
     await message.reply("خرید کردیت:", reply_markup=buy_credit_kb())
 
 
-@router.callback_query()
+@router.callback_query(F.data.startswith("buy_"))
 async def handle_buy_callbacks(callback: CallbackQuery):
     data = callback.data or ""
     await callback.answer()
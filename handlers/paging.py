@@ -0,0 +1,37 @@
+# handlers/paging.py
+from typing import Awaitable, Callable, Optional, Tuple, List, Any
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+PageFn = Callable[..., Awaitable[List[Any]]]
+
+
+async def load_page(page_fn: PageFn, size: int, data: Optional[str] = None) -> Tuple[List[Any], bool, bool]:
+    """
+    Fetch one page through a keyset page function (database.reports_page / proxies_page).
+    `data` is the pressed button's callback_data ("<prefix>:prev|next:<id>"), None for the first page.
+    One extra row is read to know whether another page exists in that direction.
+    Returns (rows, has_prev, has_next).
+    """
+    if data is None:
+        rows = await page_fn(limit=size + 1)
+        return rows[:size], False, len(rows) > size
+    _, direction, cursor = data.split(":", 2)
+    if direction == "next":
+        rows = await page_fn(after_id=int(cursor), limit=size + 1)
+        return rows[:size], True, len(rows) > size
+    rows = await page_fn(before_id=int(cursor), limit=size + 1)
+    return rows[-size:], len(rows) > size, True
+
+
+def pager_kb(prefix: str, rows: List[Any], key: Callable[[Any], int], has_prev: bool, has_next: bool) -> Optional[InlineKeyboardMarkup]:
+    """
+    Prev/next buttons; the cursors are the ids of the first and last row shown.
+    """
+    if not rows:
+        return None
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"{prefix}:prev:{key(rows[0])}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="بعدی ➡️", callback_data=f"{prefix}:next:{key(rows[-1])}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
@@ -11,8 +11,7 @@ router = Router()
 async def start_cmd(message: Message):
     user_id = message.from_user.id
     username = message.from_user.username or ""
-    await db.create_user_if_not_exists(user_id, username)
-    await db.set_username(user_id, username)
+    await db.set_username(user_id, username)  # creates the user on first /start
     if await db.is_profile_complete(user_id):
         await message.answer("👋 خوش اومدی! پروفایل شما کامل است. برای ورود به چت ناشناس /chat را بزن.")
     else:
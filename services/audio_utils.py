@@ -1,6 +1,4 @@
 import os
-import yt_dlp
-from pydub import AudioSegment
 import asyncio
 
 DOWNLOAD_PATH = "downloads"
@@ -21,6 +19,7 @@ async def download_audio(link: str, filename: str = "temp.mp3") -> str:
     }
 
     def run():
+        import yt_dlp  # heavy; only needed once someone sends a link
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             ydl.download([link])
     await asyncio.to_thread(run)
@@ -35,6 +34,7 @@ async def convert_to_wav(input_path: str, output_name: str = None) -> str:
     output_path = os.path.join(DOWNLOAD_PATH, output_name)
 
     def convert():
+        from pydub import AudioSegment
         sound = AudioSegment.from_file(input_path)
         sound.export(output_path, format="wav")
     await asyncio.to_thread(convert)
@@ -0,0 +1,136 @@
+# src/services/block_index.py
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, FrozenSet, List, Tuple
+from config import BLOCK_INDEX_TTL, BLOCK_INDEX_MAX_USERS, BLOCK_BLOOM_BITS
+from services.database import get_blocked_peers, iter_block_pairs
+
+logger = logging.getLogger("block_index")
+
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter over integers; no false negatives, tunable false positives.
+    """
+
+    def __init__(self, bits: int, hashes: int = 4):
+        self.bits = max(8, bits)
+        self.hashes = hashes
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, value: int):
+        digest = hashlib.blake2b(value.to_bytes(8, "little", signed=True), digest_size=4 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4 * i:4 * i + 4], "little") % self.bits
+
+    def add(self, value: int) -> None:
+        for pos in self._positions(value):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: int) -> bool:
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class BlockIndex:
+    """
+    Per-user sets of blocked peers (both directions), loaded lazily from the DB and kept in a
+    bounded LRU. Entries expire after `ttl` seconds so blocks made on other replicas are seen;
+    blocks made through this process update the cache immediately via record_block.
+    With bloom_bits > 0 a bloom filter of every user involved in any block lets the common
+    "has never blocked anyone" case skip the DB entirely. The filter only sees other
+    processes' blocks when it is rebuilt, so like the cached sets it is trusted for `ttl`
+    seconds after its rebuild started; past that lookups go to the DB while a fresh one is
+    built in the background.
+    """
+
+    def __init__(self, ttl: int = BLOCK_INDEX_TTL, max_users: int = BLOCK_INDEX_MAX_USERS, bloom_bits: int = BLOCK_BLOOM_BITS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.bloom_bits = bloom_bits
+        self._peers: "OrderedDict[int, Tuple[float, FrozenSet[int]]]" = OrderedDict()
+        self._bloom: Optional[BloomFilter] = None
+        self._bloom_at = 0.0
+        self._rebuild: Optional[asyncio.Task] = None
+        # blocks recorded while a rebuild is scanning, replayed into the new filter
+        self._recorded: List[Tuple[int, int]] = []
+
+    async def _build_bloom(self) -> None:
+        started = time.monotonic()
+        self._recorded = []
+        bloom = BloomFilter(self.bloom_bits)
+        async for a, b in iter_block_pairs():
+            bloom.add(a)
+            bloom.add(b)
+        for a, b in self._recorded:
+            bloom.add(a)
+            bloom.add(b)
+        self._bloom, self._bloom_at = bloom, started
+
+    async def _fresh_bloom(self, now: float) -> Optional[BloomFilter]:
+        """
+        The bloom filter if it is younger than ttl, else None (and a rebuild is started).
+        The first build is awaited.
+        """
+        if not self.bloom_bits:
+            return None
+        if self._bloom is not None and now - self._bloom_at < self.ttl:
+            return self._bloom
+        if self._rebuild is None or self._rebuild.done():
+            self._rebuild = asyncio.create_task(self._build_bloom())
+            self._rebuild.add_done_callback(self._rebuilt)
+        if self._bloom is None:
+            await asyncio.shield(self._rebuild)
+            return self._bloom
+        return None
+
+    @staticmethod
+    def _rebuilt(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("block bloom filter rebuild failed: %s", task.exception())
+
+    async def blocked_peers(self, user_id: int) -> FrozenSet[int]:
+        now = time.monotonic()
+        hit = self._peers.get(user_id)
+        if hit is not None and hit[0] > now:
+            self._peers.move_to_end(user_id)
+            return hit[1]
+        bloom = await self._fresh_bloom(now)
+        if bloom is not None and user_id not in bloom:
+            peers: FrozenSet[int] = frozenset()
+        else:
+            peers = frozenset(await get_blocked_peers(user_id))
+        self._store(user_id, peers, now)
+        return peers
+
+    async def is_blocked(self, a: int, b: int) -> bool:
+        return b in await self.blocked_peers(a)
+
+    def _store(self, user_id: int, peers: FrozenSet[int], now: float) -> None:
+        self._peers[user_id] = (now + self.ttl, peers)
+        self._peers.move_to_end(user_id)
+        while len(self._peers) > self.max_users:
+            self._peers.popitem(last=False)
+
+    def record_block(self, user_id: int, blocked_id: int) -> None:
+        """
+        Called after a Block row is written: extend cached sets in place, never dropping the new pair.
+        """
+        if self._bloom is not None:
+            self._bloom.add(user_id)
+            self._bloom.add(blocked_id)
+        if self._rebuild is not None and not self._rebuild.done():
+            self._recorded.append((user_id, blocked_id))
+        for a, b in ((user_id, blocked_id), (blocked_id, user_id)):
+            hit = self._peers.get(a)
+            if hit is not None:
+                self._peers[a] = (hit[0], hit[1] | {b})
+
+    def invalidate(self, *user_ids: int) -> None:
+        for uid in user_ids:
+            self._peers.pop(uid, None)
+
+
+block_index = BlockIndex()
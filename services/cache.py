@@ -45,14 +45,15 @@ async def brpop(key: str, timeout: int = 0):
 
 async def rate_limit_check(key: str, limit: int, period_seconds: int) -> bool:
     """
-    Sliding window via INCR with TTL.
-    Returns True if allowed, False if over limit.
+    Fixed window of period_seconds starting at the first hit (the TTL is only set when the
+    key is created, so a steady sender still gets a fresh window). Returns True if allowed,
+    False if over limit. Per-user anti-flood limits live in services/rate_limit.py.
     """
     r = get_redis()
     pipe = r.pipeline()
+    pipe.set(key, 0, ex=period_seconds, nx=True)
     pipe.incr(key)
-    pipe.expire(key, period_seconds)
-    count, _ = await pipe.execute()
+    _, count = await pipe.execute()
     return int(count) <= limit
 
 
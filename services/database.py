@@ -1,20 +1,139 @@
 # src/services/database.py
 import os
+import time
+from contextlib import asynccontextmanager
 from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy import (
     Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, func, Boolean, Index, UniqueConstraint
 )
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import select, and_, or_, update
+from sqlalchemy import select, insert, delete, literal, tuple_, and_, or_, update, bindparam, event
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from services.state_cache import user_state
+from services.sqlite_writer import SQLiteWriter
+from services.telemetry import observe_db_checkout
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 if not DATABASE_URL:
     DATABASE_URL = "sqlite+aiosqlite:///./data/bot_dev.db"
+# optional replica for read-only helpers; empty means reads share the primary engine
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", DB_POOL_SIZE))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in {"1", "true", "yes"}
+
+# SQLite (file) deployments: every write goes through one writer task and connection,
+# committed in batches of up to SQLITE_WRITER_BATCH; reads keep using the pool (WAL)
+SQLITE_SINGLE_WRITER = os.getenv("SQLITE_SINGLE_WRITER", "true").lower() in {"1", "true", "yes"}
+SQLITE_WRITER_BATCH = int(os.getenv("SQLITE_WRITER_BATCH", 64))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+
+def _timed_pool(role: str):
+    class TimedQueuePool(AsyncAdaptedQueuePool):
+        """
+        Queue pool that exports how long each checkout took (waiting for a free
+        connection, or opening an overflow one) as db_pool_checkout_seconds{engine=role}.
+        """
+
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                observe_db_checkout(role, time.perf_counter() - started)
+
+    return TimedQueuePool
+
+
+def _make_engine(url: str, role: str, pool_size: int, max_overflow: int):
+    if ":memory:" in url:
+        # in-memory SQLite lives in a single connection (StaticPool); nothing to size
+        return create_async_engine(url, echo=False, future=True)
+    return create_async_engine(
+        url, echo=False, future=True,
+        poolclass=_timed_pool(role),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+
+def _is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+
+def _tune_sqlite(eng, begin: str = "BEGIN"):
+    """
+    WAL + pragmas on every new connection, and explicit BEGINs: the sqlite3 driver's own
+    implicit transactions break SAVEPOINTs and would always start deferred.
+    """
+    @event.listens_for(eng.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(eng.sync_engine, "begin")
+    def _on_begin(conn):
+        conn.exec_driver_sql(begin)
+
+
+engine = _make_engine(DATABASE_URL, "write", DB_POOL_SIZE, DB_MAX_OVERFLOW)
 AsyncSessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# read-only helpers use AsyncReadSessionLocal; they may lag the primary by the replica delay,
+# so anything that must see a write it just made stays on AsyncSessionLocal
+read_engine = _make_engine(DATABASE_READ_URL, "read", DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW) if DATABASE_READ_URL else engine
+AsyncReadSessionLocal = sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+for _eng, _url in {(engine, DATABASE_URL), (read_engine, DATABASE_READ_URL or DATABASE_URL)}:
+    if _is_sqlite_file(_url):
+        _tune_sqlite(_eng)
+
+sqlite_writer: Optional[SQLiteWriter] = None
+if _is_sqlite_file(DATABASE_URL) and SQLITE_SINGLE_WRITER:
+    # one connection taking the write lock up front (BEGIN IMMEDIATE), so writes queue in
+    # the writer instead of failing with "database is locked" on lock upgrade
+    writer_engine = _make_engine(DATABASE_URL, "writer", 1, 0)
+    _tune_sqlite(writer_engine, begin="BEGIN IMMEDIATE")
+    sqlite_writer = SQLiteWriter(
+        sessionmaker(writer_engine, expire_on_commit=False, class_=AsyncSession), max_batch=SQLITE_WRITER_BATCH
+    )
+
+
+@asynccontextmanager
+async def write_session():
+    """
+    Session inside a write transaction, committed when the block exits cleanly.
+    In SQLite single-writer mode the block runs on the writer's connection instead,
+    serialized with every other write and committed together with its batch.
+    """
+    if sqlite_writer is not None:
+        async with sqlite_writer.turn() as session:
+            yield session
+        return
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            yield session
+
+
 Base = declarative_base()
 
 
@@ -31,6 +150,7 @@ class User(Base):
     partner_id = Column(BigInteger, nullable=True)
     credits = Column(Integer, nullable=False, default=10)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    search_started_at = Column(DateTime(timezone=True), nullable=True)  # set when status becomes searching
 
 
 class Invite(Base):
@@ -67,6 +187,7 @@ class Block(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     __table_args__ = (
         UniqueConstraint('user_id', 'blocked_id', name='uq_blocks_pair'),
+        Index('ix_blocks_blocked_id', 'blocked_id'),
     )
 
 
@@ -104,6 +225,19 @@ class Proxy(Base):
     quarantine = Column(Boolean, nullable=False, default=False)
 
 Index('ix_users_status_created', User.status, User.created_at)
+Index('ix_users_status_search_started', User.status, User.search_started_at)
+# status + profile filters on users (advanced search)
+Index('ix_users_status_gender_province_city', User.status, User.gender, User.province, User.city)
+# get_session_by_user / end_chat_session_by_users: OR over both sides, one index per side
+Index('ix_chat_sessions_status_user_a', ChatSession.status, ChatSession.user_a)
+Index('ix_chat_sessions_status_user_b', ChatSession.status, ChatSession.user_b)
+# end_expired_sessions
+Index('ix_chat_sessions_status_last_activity', ChatSession.status, ChatSession.last_activity)
+Index('ix_reports_created_at', Report.created_at)
+Index('ix_invites_inviter_id', Invite.inviter_id)
+# get_active_proxies_from_db; partial so the usable pool stays small however many dead proxies pile up
+_usable_proxy = and_(Proxy.active == True, Proxy.quarantine == False)
+Index('ix_proxies_usable', Proxy.proxy, sqlite_where=_usable_proxy, postgresql_where=_usable_proxy)
 
 
 class Order(Base):
@@ -118,6 +252,10 @@ class Order(Base):
     paid_at = Column(DateTime(timezone=True), nullable=True)
 
 
+# archiver: settled orders past retention
+Index('ix_orders_status_created_at', Order.status, Order.created_at)
+
+
 # Likes / Favorites
 class Like(Base):
     __tablename__ = "likes"
@@ -144,6 +282,23 @@ class FavoriteRequest(Base):
     )
 
 
+class CreditLedger(Base):
+    """
+    Append-only record of every change to users.credits; `balance` is the value right after it.
+    """
+    __tablename__ = "credit_ledger"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, nullable=False)
+    delta = Column(Integer, nullable=False)
+    balance = Column(Integer, nullable=False)
+    reason = Column(String(32), nullable=False)  # opening, signup, grant, consume, order, invite, match
+    ref = Column(String(128), nullable=True)  # order ref, invite code, ...
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    __table_args__ = (
+        Index('ix_credit_ledger_user_id', 'user_id', 'id'),
+    )
+
+
 class Favorite(Base):
     __tablename__ = "favorites"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -155,14 +310,70 @@ class Favorite(Base):
     )
 
 
+# Archive: rows past retention moved out of the hot tables (see services/worker/archiver.py);
+# same columns and ids as the source table, plus when they were moved
+class ChatSessionArchive(Base):
+    __tablename__ = "chat_sessions_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_a = Column(BigInteger, nullable=False)
+    user_b = Column(BigInteger, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    last_activity = Column(DateTime(timezone=True), nullable=True)
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String(32), nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ReportArchive(Base):
+    __tablename__ = "reports_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    reporter_id = Column(BigInteger, nullable=False)
+    reported_id = Column(BigInteger, nullable=False)
+    reason = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OrderArchive(Base):
+    __tablename__ = "orders_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, nullable=False)
+    amount = Column(Integer, nullable=False)
+    provider = Column(String(32), nullable=False)
+    ref = Column(String(128), nullable=False)
+    status = Column(String(16), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    paid_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ArchiveCheckpoint(Base):
+    """
+    Archiver progress per source table, advanced in the same transaction as each batch.
+    """
+    __tablename__ = "archive_checkpoints"
+    name = Column(String(32), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)  # highest id archived so far
+    rows = Column(BigInteger, nullable=False, default=0)  # rows archived in total
+    last_file = Column(String(512), nullable=True)  # jsonl backend: file holding the last batch
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# source table -> (model, archive model, column retention counts from, rows that may leave at all)
+ARCHIVE_TARGETS = {
+    "chat_sessions": (ChatSession, ChatSessionArchive, ChatSession.last_activity, ChatSession.status.in_(("ended", "cancelled"))),
+    "reports": (Report, ReportArchive, Report.created_at, None),
+    "orders": (Order, OrderArchive, Order.created_at, Order.status.in_(("paid", "failed"))),
+}
+
+
 # ---------------- Orders CRUD ----------------
 async def create_order(user_id: int, amount: int, provider: str, ref: str) -> int:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            o = Order(user_id=user_id, amount=amount, provider=provider, ref=ref, status="pending")
-            session.add(o)
-            await session.flush()
-            return o.id
+    async with write_session() as session:
+        o = Order(user_id=user_id, amount=amount, provider=provider, ref=ref, status="pending")
+        session.add(o)
+        await session.flush()
+        return o.id
 
 async def get_order_by_ref(ref: str) -> Optional[Dict[str, Any]]:
     async with AsyncSessionLocal() as session:
@@ -173,18 +384,102 @@ async def get_order_by_ref(ref: str) -> Optional[Dict[str, Any]]:
         return {"id": o.id, "user_id": o.user_id, "amount": o.amount, "provider": o.provider, "ref": o.ref, "status": o.status}
 
 async def mark_order_paid(ref: str) -> bool:
+    """
+    Flip the order to paid (once) and credit its user in the same transaction.
+    """
+    async with write_session() as session:
+        res = await session.execute(
+            update(Order).where(Order.ref == ref, Order.status != "paid")
+            .values(status="paid", paid_at=func.now())
+            .returning(Order.user_id, Order.amount)
+        )
+        o = res.first()
+        if o is None:
+            return False
+        await apply_credits(session, _credit_user(o.user_id, o.amount), o.amount, "order", ref)
+        return True
+
+
+# ---------------- Archive ----------------
+def _past_retention(name: str, cutoff):
+    model, _, age, settled = ARCHIVE_TARGETS[name]
+    return age < cutoff if settled is None else and_(settled, age < cutoff)
+
+def _archivable(name: str, cutoff, limit: int):
+    # oldest first along the retention column, so its index drives the batch
+    model, _, age, _ = ARCHIVE_TARGETS[name]
+    q = select(model.id).where(_past_retention(name, cutoff)).order_by(age, model.id).limit(limit)
+    if engine.dialect.name == "postgresql":
+        # concurrent archivers take disjoint batches
+        q = q.with_for_update(skip_locked=True)
+    return q
+
+async def _advance_checkpoint(session, name: str, ids: List[int], file: Optional[str] = None) -> None:
+    stmt = _insert(ArchiveCheckpoint).values(name=name, last_id=max(ids), rows=len(ids), last_file=file)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[ArchiveCheckpoint.name],
+        set_={
+            "last_id": func.max(ArchiveCheckpoint.last_id, stmt.excluded.last_id)
+            if engine.dialect.name == "sqlite" else func.greatest(ArchiveCheckpoint.last_id, stmt.excluded.last_id),
+            "rows": ArchiveCheckpoint.rows + stmt.excluded.rows,
+            "last_file": stmt.excluded.last_file,
+            "updated_at": func.now(),
+        },
+    ))
+
+async def move_to_archive(name: str, cutoff, limit: int = 500) -> int:
+    """
+    Move up to `limit` rows of `name` past retention (oldest first) into its archive table:
+    DELETE ... RETURNING, INSERT into the archive and the checkpoint, all in one transaction,
+    so a batch is either fully moved or not at all. Returns how many rows were moved.
+    """
+    model, archive, _, _ = ARCHIVE_TARGETS[name]
+    t = model.__table__
+    batch = t.c.id.in_(_archivable(name, cutoff, limit).scalar_subquery())
+    async with write_session() as session:
+        if engine.dialect.delete_returning:
+            rows = (await session.execute(delete(t).where(batch).returning(*t.c))).all()
+        else:
+            # SQLite < 3.35: same batch, two statements, still one transaction
+            rows = (await session.execute(select(*t.c).where(batch))).all()
+            if rows:
+                await session.execute(delete(t).where(t.c.id.in_([r.id for r in rows])))
+        if rows:
+            await session.execute(insert(archive), [dict(r._mapping) for r in rows])
+            await _advance_checkpoint(session, name, [r.id for r in rows])
+    return len(rows)
+
+async def archive_candidates(name: str, cutoff, limit: int = 500) -> List[Dict[str, Any]]:
+    """
+    Up to `limit` rows of `name` past retention, oldest first, as column dicts (for archives
+    written outside the database). Read on the primary: whatever is returned gets deleted.
+    """
+    model, _, age, _ = ARCHIVE_TARGETS[name]
+    t = model.__table__
     async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(Order).where(Order.ref == ref))
-            o = res.scalar_one_or_none()
-            if not o or o.status == "paid":
-                return False
-            o.status = "paid"
-            o.paid_at = func.now()
-            u = await session.get(User, o.user_id)
-            if u:
-                u.credits += o.amount
-            return True
+        res = await session.execute(
+            select(*t.c).where(_past_retention(name, cutoff)).order_by(age, t.c.id).limit(limit)
+        )
+        return [dict(r._mapping) for r in res]
+
+async def delete_archived(name: str, ids: List[int], cutoff, file: str) -> int:
+    """
+    Delete rows already written to `file` (only those still past retention) and advance the
+    checkpoint in the same transaction. Returns how many rows were deleted.
+    """
+    model = ARCHIVE_TARGETS[name][0]
+    if not ids:
+        return 0
+    async with write_session() as session:
+        res = await session.execute(delete(model).where(model.id.in_(ids), _past_retention(name, cutoff)))
+        await _advance_checkpoint(session, name, ids, file)
+        return res.rowcount
+
+async def get_archive_checkpoints() -> Dict[str, Dict[str, Any]]:
+    async with AsyncReadSessionLocal() as session:
+        res = await session.execute(select(ArchiveCheckpoint))
+        return {c.name: {"last_id": c.last_id, "rows": c.rows, "last_file": c.last_file, "updated_at": c.updated_at}
+                for c in res.scalars()}
 
 
 # ---------------- Init ----------------
@@ -192,27 +487,100 @@ async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+async def close_db():
+    """
+    Stop the SQLite writer and close pooled connections, so a one-off script can exit
+    (aiosqlite keeps a non-daemon thread per open connection).
+    """
+    if sqlite_writer is not None:
+        await sqlite_writer.close()
+        await writer_engine.dispose()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+
 
 # ---------------- Utility / CRUD ----------------
-async def create_user_if_not_exists(user_id: int, username: Optional[str] = "") -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u is None:
-                user = User(id=user_id, username=username or "", credits=10)
-                session.add(user)
+def _insert(model):
+    """
+    INSERT with ON CONFLICT support for the engine's dialect (Postgres, SQLite >= 3.24).
+    """
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+def _after(keys, cursor, descending: bool):
+    # rows strictly past `cursor` in key order; row-value compare for composite keys
+    lhs, rhs = (keys[0], cursor[0]) if len(keys) == 1 else (tuple_(*keys), tuple_(*cursor))
+    return lhs < rhs if descending else lhs > rhs
+
+def _ordered(keys, descending: bool):
+    return [k.desc() if descending else k.asc() for k in keys]
+
+async def _keyset_page(stmt, keys, limit: int, after=None, before=None, descending: bool = False) -> list:
+    """
+    One page of `stmt` ordered by `keys` (a unique column tuple): the rows following the
+    `after` cursor, or with `before` the rows preceding it, always in display order.
+    Cursors are tuples of key values, e.g. (row.id,).
+    """
+    if before is not None:
+        q = stmt.where(_after(keys, before, not descending)).order_by(*_ordered(keys, not descending))
+    else:
+        q = stmt if after is None else stmt.where(_after(keys, after, descending))
+        q = q.order_by(*_ordered(keys, descending))
+    async with AsyncReadSessionLocal() as session:
+        rows = (await session.execute(q.limit(limit))).all()
+    return rows[::-1] if before is not None else rows
+
+async def _iter_keyset(stmt, keys, chunk: int = 1000, descending: bool = False):
+    """
+    Yield every row of `stmt` in `keys` order. Each keyset page of `chunk` rows is its own
+    short read, streamed through a server-side cursor (yield_per), so memory and the DB
+    snapshot stay bounded by one page however many rows there are. The page's connection
+    stays checked out while the consumer handles its rows, so don't do slow work per row.
+    """
+    cursor = None
+    while True:
+        q = stmt if cursor is None else stmt.where(_after(keys, cursor, descending))
+        q = q.order_by(*_ordered(keys, descending)).limit(chunk).execution_options(yield_per=min(chunk, 500))
+        n = 0
+        async with AsyncReadSessionLocal() as session:
+            result = await session.stream(q)
+            async for row in result:
+                n += 1
+                cursor = tuple(row._mapping[k] for k in keys)
+                yield row
+        if n < chunk:
+            return
+
+async def _execute(stmt) -> int:
+    async with write_session() as session:
+        res = await session.execute(stmt)
+        return res.rowcount
+
+async def create_user_if_not_exists(user_id: int, username: Optional[str] = "") -> bool:
+    """
+    Returns True if the user was created; the signup credits go through the ledger.
+    """
+    dml = (
+        _insert(User).values(id=user_id, username=username or "", credits=10)
+        .on_conflict_do_nothing(index_elements=[User.id])
+        .returning(User.id, User.credits)
+    )
+    async with write_session() as session:
+        return await apply_credits(session, dml, 10, "signup") is not None
 
 
 async def set_username(user_id: int, username: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.username = username or u.username
-            else:
-                session.add(User(id=user_id, username=username or "", credits=10))
+    """
+    Create the user if needed; an empty username never overwrites a stored one.
+    """
+    # existing users (the common case) take one UPDATE; new ones one ledgered INSERT
+    if username and await update_profile(user_id, username=username):
+        return
+    await create_user_if_not_exists(user_id, username)
 async def is_profile_complete(user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(
             select(User.gender, User.province, User.city, User.profile_pic).where(User.id == user_id)
         )
@@ -221,104 +589,122 @@ async def is_profile_complete(user_id: int) -> bool:
 
 
 # profile setters
+PROFILE_FIELDS = frozenset({"username", "gender", "province", "city", "profile_pic"})
+
+async def update_profile(user_id: int, **fields) -> bool:
+    """
+    Set several profile fields in one UPDATE. Unknown users are left alone (returns False).
+    """
+    unknown = set(fields) - PROFILE_FIELDS
+    if unknown:
+        raise ValueError(f"not profile fields: {', '.join(sorted(unknown))}")
+    if not fields:
+        return False
+    return await _execute(update(User).where(User.id == user_id).values(**fields)) > 0
+
 async def set_gender(user_id: int, gender: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.gender = gender
+    await update_profile(user_id, gender=gender)
 
 async def set_province(user_id: int, province: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.province = province
+    await update_profile(user_id, province=province)
 
 async def set_city(user_id: int, city: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.city = city
+    await update_profile(user_id, city=city)
 
 async def set_profile_pic(user_id: int, file_id: str):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.profile_pic = file_id
+    await update_profile(user_id, profile_pic=file_id)
 
 
 # credits
 async def get_credits(user_id: int) -> int:
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(select(User.credits).where(User.id == user_id))
         r = res.scalar_one_or_none()
         return int(r) if r is not None else 0
 
-async def add_credits(user_id: int, amount: int = 1):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.credits += amount
-            else:
-                session.add(User(id=user_id, credits=amount))
+async def apply_credits(session: AsyncSession, dml, delta: int, reason: str, ref: Optional[str] = None) -> Optional[int]:
+    """
+    Run `dml` (an UPDATE or INSERT on users ending in RETURNING id, credits) and append the
+    matching CreditLedger row inside the caller's transaction. On Postgres both go out as one
+    statement (the users write as a CTE feeding the ledger INSERT); elsewhere as two.
+    Returns the new balance, or None when `dml` touched no row (condition failed).
+    """
+    if not delta:
+        row = (await session.execute(dml)).first()
+        return row[1] if row is not None else None
+    if engine.dialect.name == "postgresql":
+        moved = dml.cte("moved")
+        stmt = (
+            insert(CreditLedger).add_cte(moved)
+            .from_select(
+                ["user_id", "delta", "balance", "reason", "ref"],
+                select(moved.c.id, literal(delta, Integer), moved.c.credits, literal(reason, String), literal(ref, String)),
+            )
+            .returning(CreditLedger.balance)
+        )
+        return (await session.execute(stmt)).scalar_one_or_none()
+    row = (await session.execute(dml)).first()
+    if row is None:
+        return None
+    await session.execute(insert(CreditLedger).values(user_id=row[0], delta=delta, balance=row[1], reason=reason, ref=ref))
+    return row[1]
+
+def _credit_user(user_id: int, amount: int):
+    # upsert: unknown users are created holding just `amount`
+    stmt = _insert(User).values(id=user_id, credits=amount)
+    return stmt.on_conflict_do_update(
+        index_elements=[User.id], set_={"credits": User.credits + stmt.excluded.credits}
+    ).returning(User.id, User.credits)
+
+async def add_credits(user_id: int, amount: int = 1, reason: str = "grant", ref: Optional[str] = None) -> int:
+    """
+    Returns the new balance.
+    """
+    async with write_session() as session:
+        return await apply_credits(session, _credit_user(user_id, amount), amount, reason, ref)
 
 
-async def consume_credit(user_id: int, amount: int = 1) -> bool:
+async def consume_credit(user_id: int, amount: int = 1, reason: str = "consume", ref: Optional[str] = None) -> bool:
     """
     Atomically consume credits. Returns True if successful.
+    A single conditional UPDATE, so no row lock is held across round trips.
     """
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            stmt = select(User).where(User.id == user_id).with_for_update()
-            res = await session.execute(stmt)
-            user = res.scalar_one_or_none()
-            if not user or user.credits < amount:
-                return False
-            user.credits -= amount
-            return True
+    dml = (
+        update(User).where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .returning(User.id, User.credits)
+    )
+    async with write_session() as session:
+        return await apply_credits(session, dml, -amount, reason, ref) is not None
 
 
 # invites
 async def create_invite(code: str, inviter_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            try:
-                inv = Invite(code=code, inviter_id=inviter_id)
-                session.add(inv)
-                return True
-            except IntegrityError:
-                return False
+    async with write_session() as session:
+        try:
+            inv = Invite(code=code, inviter_id=inviter_id)
+            session.add(inv)
+            return True
+        except IntegrityError:
+            return False
 
 async def use_invite_for_user(code: str, new_user_id: int) -> bool:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            inv = await session.get(Invite, code)
-            if not inv:
-                return False
-            used = await session.get(UsedInvite, new_user_id)
-            if used:
-                return False
-            # enforce single-use invite code
-            existing_use = await session.execute(select(UsedInvite).where(UsedInvite.code == code))
-            if existing_use.scalar_one_or_none():
-                return False
-            u = await session.get(User, new_user_id)
-            if not u:
-                session.add(User(id=new_user_id, credits=5))
-            else:
-                u.credits += 5
-            inviter = await session.get(User, inv.inviter_id)
-            if inviter:
-                inviter.credits += 5
-            else:
-                session.add(User(id=inv.inviter_id, credits=5))
-            ui = UsedInvite(user_id=new_user_id, code=code)
-            session.add(ui)
-            return True
+    async with write_session() as session:
+        inv = await session.get(Invite, code)
+        if not inv:
+            return False
+        used = await session.get(UsedInvite, new_user_id)
+        if used:
+            return False
+        # enforce single-use invite code
+        existing_use = await session.execute(select(UsedInvite).where(UsedInvite.code == code))
+        if existing_use.scalar_one_or_none():
+            return False
+        await apply_credits(session, _credit_user(new_user_id, 5), 5, "invite", code)
+        await apply_credits(session, _credit_user(inv.inviter_id, 5), 5, "invite", code)
+        ui = UsedInvite(user_id=new_user_id, code=code)
+        session.add(ui)
+        return True
 
 async def get_invite_for_user(inviter_id: int) -> Optional[str]:
     async with AsyncSessionLocal() as session:
@@ -327,192 +713,267 @@ async def get_invite_for_user(inviter_id: int) -> Optional[str]:
         return row
 # status / matching helpers & session management
 async def set_status(user_id: int, status: str, partner_id: Optional[int] = None):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            u = await session.get(User, user_id)
-            if u:
-                u.status = status
-                u.partner_id = partner_id
+    async with write_session() as session:
+        u = await session.get(User, user_id)
+        if u:
+            u.status = status
+            u.partner_id = partner_id
+    # write-through; unknown users are invalidated so reads see "idle" from the DB
+    if u:
+        await user_state.put(user_id, status, partner_id)
+    else:
+        await user_state.invalidate(user_id)
 
 async def get_status(user_id: int) -> Tuple[str, Optional[int]]:
+    cached = await user_state.get(user_id)
+    if cached is not None:
+        return cached
+    # primary, not the read replica: this result is cached for every replica, so replica lag
+    # would turn into up to STATE_CACHE_TTL of stale chat state
     async with AsyncSessionLocal() as session:
         res = await session.execute(select(User.status, User.partner_id).where(User.id == user_id))
         row = res.first()
         if not row:
             return ("idle", None)
-        return (row[0], row[1])
+    # fill, not put: a set_status that committed after our read has already written through
+    await user_state.fill(user_id, row[0], row[1])
+    return (row[0], row[1])
+
+
+_ONLINE_USER_COLS = (User.id, User.username, User.gender, User.province, User.city)
 
+def _online_user(r) -> Dict[str, Any]:
+    return {"user_id": r.id, "username": r.username, "gender": r.gender, "province": r.province, "city": r.city}
 
-async def find_partner_candidate(user_id: int, gender: Optional[str] = None, province: Optional[str] = None, city: Optional[str] = None) -> Optional[int]:
+async def iter_online_users(chunk: int = 1000):
     """
-    Find one candidate row with FOR UPDATE SKIP LOCKED. This is used by matcher to lock candidate.
+    Every idle user, by id. Not keyed on created_at: SQLite stores server_default timestamps
+    without microseconds while the bound cursor has them, so ties would be skipped.
     """
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            stmt = select(User).where(User.status == 'searching', User.id != user_id)
-            if gender:
-                stmt = stmt.where(User.gender == gender)
-            if province:
-                stmt = stmt.where(User.province == province)
-            if city:
-                stmt = stmt.where(User.city == city)
-            stmt = stmt.order_by(User.created_at).with_for_update(skip_locked=True).limit(1)
-            res = await session.execute(stmt)
-            cand = res.scalar_one_or_none()
-            return cand.id if cand else None
-
-
-async def get_online_users(limit: int = 50) -> List[Dict[str, Any]]:
-    async with AsyncSessionLocal() as session:
-        res = await session.execute(select(User).where(User.status == 'idle').limit(limit))
-        rows = res.scalars().all()
-        return [{"user_id": r.id, "username": r.username, "gender": r.gender, "province": r.province, "city": r.city} for r in rows]
+    stmt = select(*_ONLINE_USER_COLS).where(User.status == 'idle')
+    async for r in _iter_keyset(stmt, (User.id,), chunk):
+        yield _online_user(r)
 
+async def online_users_page(after_id: Optional[int] = None, before_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Idle users by id. after_id: next page; before_id: previous page.
+    """
+    rows = await _keyset_page(
+        select(*_ONLINE_USER_COLS).where(User.status == 'idle'), (User.id,), limit,
+        after=(after_id,) if after_id is not None else None,
+        before=(before_id,) if before_id is not None else None,
+    )
+    return [_online_user(r) for r in rows]
 
 # blocks / reports
 async def block_user(user_id: int, blocked_id: int):
+    from services.block_index import block_index
+    async with write_session() as session:
+        b = Block(user_id=user_id, blocked_id=blocked_id)
+        session.add(b)
+    block_index.record_block(user_id, blocked_id)
+
+async def get_blocked_peers(user_id: int) -> List[int]:
+    """
+    Everyone user_id blocked or was blocked by.
+    """
     async with AsyncSessionLocal() as session:
-        async with session.begin():
-            b = Block(user_id=user_id, blocked_id=blocked_id)
-            session.add(b)
+        res = await session.execute(
+            select(Block.blocked_id).where(Block.user_id == user_id).union(
+                select(Block.user_id).where(Block.blocked_id == user_id)
+            )
+        )
+        return [r for r in res.scalars().all()]
 
-async def is_blocked(a: int, b: int) -> bool:
+async def iter_block_pairs(chunk: int = 10000):
+    """
+    Stream every (user_id, blocked_id) pair in id order.
+    """
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            res = await session.execute(
+                select(Block.id, Block.user_id, Block.blocked_id)
+                .where(Block.id > last_id).order_by(Block.id).limit(chunk)
+            )
+            rows = res.all()
+        if not rows:
+            return
+        for r in rows:
+            yield (r[1], r[2])
+        last_id = rows[-1][0]
+
+async def blocked_between(session: AsyncSession, a: int, b: int) -> bool:
+    """
+    Whether a blocked b or b blocked a, read in the caller's transaction (the matcher's
+    re-check when it commits a pairing). Each direction is an index lookup.
+    """
+    res = await session.execute(
+        select(Block.id).where(
+            or_(
+                and_(Block.user_id == a, Block.blocked_id == b),
+                and_(Block.user_id == b, Block.blocked_id == a)
+            )
+        ).limit(1)
+    )
+    return res.first() is not None
+
+async def get_blocks_among(user_ids: List[int]) -> List[Tuple[int, int]]:
+    """
+    All (user_id, blocked_id) rows where both sides are in user_ids, in one query.
+    """
+    if not user_ids:
+        return []
     async with AsyncSessionLocal() as session:
         res = await session.execute(
-            select(Block).where(
-                or_(
-                    and_(Block.user_id == a, Block.blocked_id == b),
-                    and_(Block.user_id == b, Block.blocked_id == a)
-                )
-            ).limit(1)
+            select(Block.user_id, Block.blocked_id).where(
+                Block.user_id.in_(user_ids), Block.blocked_id.in_(user_ids)
+            )
         )
-        return res.scalar_one_or_none() is not None
+        return [(r[0], r[1]) for r in res.all()]
 
 async def report_user(reporter_id: int, reported_id: int, reason: str = ""):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            r = Report(reporter_id=reporter_id, reported_id=reported_id, reason=reason)
-            session.add(r)
+    async with write_session() as session:
+        r = Report(reporter_id=reporter_id, reported_id=reported_id, reason=reason)
+        session.add(r)
 
-async def list_reports(limit: int = 100):
-    async with AsyncSessionLocal() as session:
-        res = await session.execute(select(Report).order_by(Report.created_at.desc()).limit(limit))
-        return [dict(id=r.id, reporter_id=r.reporter_id, reported_id=r.reported_id, reason=r.reason, created_at=r.created_at) for r in res.scalars().all()]
+_REPORT_COLS = (Report.id, Report.reporter_id, Report.reported_id, Report.reason, Report.created_at)
+
+def _report(r) -> Dict[str, Any]:
+    return dict(id=r.id, reporter_id=r.reporter_id, reported_id=r.reported_id, reason=r.reason, created_at=r.created_at)
 
+async def reports_page(after_id: Optional[int] = None, before_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Newest reports first. after_id: next page (older than that report); before_id: previous page.
+    """
+    rows = await _keyset_page(
+        select(*_REPORT_COLS), (Report.id,), limit,
+        after=(after_id,) if after_id is not None else None,
+        before=(before_id,) if before_id is not None else None,
+        descending=True,
+    )
+    return [_report(r) for r in rows]
+
+async def iter_reports(chunk: int = 1000):
+    """
+    Every report, newest first.
+    """
+    async for r in _iter_keyset(select(*_REPORT_COLS), (Report.id,), chunk, descending=True):
+        yield _report(r)
 
 # chat sessions
 async def create_chat_session(user_a: int, user_b: int) -> int:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            cs = ChatSession(user_a=user_a, user_b=user_b)
-            session.add(cs)
-            await session.flush()
-            return cs.id
+    async with write_session() as session:
+        cs = ChatSession(user_a=user_a, user_b=user_b)
+        session.add(cs)
+        await session.flush()
+        return cs.id
 
 async def end_chat_session(session_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            cs = await session.get(ChatSession, session_id)
-            if cs and cs.status == "active":
-                cs.status = "ended"
-                cs.ended_at = func.now()
+    async with write_session() as session:
+        cs = await session.get(ChatSession, session_id)
+        if cs and cs.status == "active":
+            cs.status = "ended"
+            cs.ended_at = func.now()
 
 
 # ---------------- User Prefs / Cookies ----------------
 async def get_user_best_quality(user_id: int) -> Optional[str]:
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(select(UserPrefs.best_quality).where(UserPrefs.user_id == user_id))
         return res.scalar_one_or_none()
 
 async def set_user_best_quality(user_id: int, best_quality: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            row = await session.get(UserPrefs, user_id)
-            if row is None:
-                session.add(UserPrefs(user_id=user_id, best_quality=best_quality))
-            else:
-                row.best_quality = best_quality
+    stmt = _insert(UserPrefs).values(user_id=user_id, best_quality=best_quality)
+    await _execute(stmt.on_conflict_do_update(index_elements=[UserPrefs.user_id], set_={"best_quality": stmt.excluded.best_quality}))
 
 async def set_user_cookie_path(user_id: int, enc_path: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            row = await session.get(UserCookie, user_id)
-            if row is None:
-                session.add(UserCookie(user_id=user_id, enc_path=enc_path))
-            else:
-                row.enc_path = enc_path
+    stmt = _insert(UserCookie).values(user_id=user_id, enc_path=enc_path)
+    await _execute(stmt.on_conflict_do_update(index_elements=[UserCookie.user_id], set_={"enc_path": stmt.excluded.enc_path}))
 
 async def get_user_cookie_path(user_id: int) -> Optional[str]:
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(select(UserCookie.enc_path).where(UserCookie.user_id == user_id))
         return res.scalar_one_or_none()
 
 
 # ---------------- Proxies CRUD ----------------
 async def add_proxy_to_db(proxy: str) -> bool:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            exists = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
-            if exists.scalar_one_or_none():
-                return False
-            session.add(Proxy(proxy=proxy, active=True, quarantine=False, failed_count=0))
-            return True
+    async with write_session() as session:
+        exists = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
+        if exists.scalar_one_or_none():
+            return False
+        session.add(Proxy(proxy=proxy, active=True, quarantine=False, failed_count=0))
+        return True
 
 async def remove_proxy_from_db(proxy: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
-            row = res.scalar_one_or_none()
-            if row:
-                await session.delete(row)
+    async with write_session() as session:
+        res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
+        row = res.scalar_one_or_none()
+        if row:
+            await session.delete(row)
 
 async def list_proxies_from_db(limit: int = 100):
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(select(Proxy.id, Proxy.proxy, Proxy.created_at, Proxy.updated_at, Proxy.active, Proxy.failed_count).limit(limit))
         return res.all()
 
+_PROXY_COLS = (Proxy.id, Proxy.proxy, Proxy.created_at, Proxy.updated_at, Proxy.active, Proxy.failed_count)
+
+async def proxies_page(after_id: Optional[int] = None, before_id: Optional[int] = None, limit: int = 20):
+    """
+    Proxies in id order, rows shaped like list_proxies_from_db. after_id: next page; before_id: previous page.
+    """
+    return await _keyset_page(
+        select(*_PROXY_COLS), (Proxy.id,), limit,
+        after=(after_id,) if after_id is not None else None,
+        before=(before_id,) if before_id is not None else None,
+    )
+
+async def iter_proxies(chunk: int = 1000):
+    async for r in _iter_keyset(select(*_PROXY_COLS), (Proxy.id,), chunk):
+        yield r
+
 async def get_active_proxies_from_db(limit: int = 50):
-    async with AsyncSessionLocal() as session:
+    async with AsyncReadSessionLocal() as session:
         res = await session.execute(select(Proxy.proxy).where(Proxy.active == True, Proxy.quarantine == False).limit(limit))
         return [r for r in res.scalars().all()]
 
 async def mark_proxy_failed_in_db(proxy: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
-            row = res.scalar_one_or_none()
-            if row:
-                row.failed_count += 1
-                if row.failed_count >= 3:
-                    row.active = False
+    async with write_session() as session:
+        res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
+        row = res.scalar_one_or_none()
+        if row:
+            row.failed_count += 1
+            if row.failed_count >= 3:
+                row.active = False
 
 async def mark_proxy_ok_in_db(proxy: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
-            row = res.scalar_one_or_none()
-            if row:
-                row.failed_count = 0
-                row.active = True
-                row.quarantine = False
+    async with write_session() as session:
+        res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
+        row = res.scalar_one_or_none()
+        if row:
+            row.failed_count = 0
+            row.active = True
+            row.quarantine = False
 
 async def quarantine_proxy_in_db(proxy: str) -> None:
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
-            row = res.scalar_one_or_none()
-            if row:
-                row.quarantine = True
-                row.active = False
-            else:
-                session.add(Proxy(proxy=proxy, active=False, quarantine=True, failed_count=0))
+    async with write_session() as session:
+        res = await session.execute(select(Proxy).where(Proxy.proxy == proxy))
+        row = res.scalar_one_or_none()
+        if row:
+            row.quarantine = True
+            row.active = False
+        else:
+            session.add(Proxy(proxy=proxy, active=False, quarantine=True, failed_count=0))
 async def get_session_by_user(user_id: int) -> Optional[Dict[str, Any]]:
     async with AsyncSessionLocal() as session:
         res = await session.execute(
+            # status inside each branch so both sides are index lookups (MULTI-INDEX OR / BitmapOr)
             select(ChatSession).where(
-                and_(
-                    ChatSession.status == "active",
-                    or_(ChatSession.user_a == user_id, ChatSession.user_b == user_id)
+                or_(
+                    and_(ChatSession.status == "active", ChatSession.user_a == user_id),
+                    and_(ChatSession.status == "active", ChatSession.user_b == user_id)
                 )
             ).limit(1)
         )
@@ -522,60 +983,98 @@ async def get_session_by_user(user_id: int) -> Optional[Dict[str, Any]]:
         return {"id": cs.id, "user_a": cs.user_a, "user_b": cs.user_b, "started_at": cs.started_at, "last_activity": cs.last_activity}
 
 async def end_chat_session_by_users(user_a: int, user_b: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            res = await session.execute(select(ChatSession).where(
-                and_(
-                    ChatSession.status == "active",
-                    or_(
-                        and_(ChatSession.user_a == user_a, ChatSession.user_b == user_b),
-                        and_(ChatSession.user_a == user_b, ChatSession.user_b == user_a)
-                    )
-                )
-            ).limit(1))
-            cs = res.scalar_one_or_none()
-            if cs:
-                cs.status = "ended"
-                cs.ended_at = func.now()
+    async with write_session() as session:
+        res = await session.execute(select(ChatSession).where(
+            or_(
+                and_(ChatSession.status == "active", ChatSession.user_a == user_a, ChatSession.user_b == user_b),
+                and_(ChatSession.status == "active", ChatSession.user_a == user_b, ChatSession.user_b == user_a)
+            )
+        ).limit(1))
+        cs = res.scalar_one_or_none()
+        if cs:
+            cs.status = "ended"
+            cs.ended_at = func.now()
 
 async def update_session_activity(session_id: int):
-    async with AsyncSessionLocal() as session:
-        async with session.begin():
-            cs = await session.get(ChatSession, session_id)
-            if cs:
-                cs.last_activity = func.now()
+    async with write_session() as session:
+        cs = await session.get(ChatSession, session_id)
+        if cs:
+            cs.last_activity = func.now()
 
-async def end_expired_sessions(max_seconds: int = 3600) -> int:
+async def touch_sessions(entries: List[Tuple[int, int, Any]]) -> None:
+    """
+    Bulk last_activity update for active sessions, one executemany statement.
+    entries: (user_a, user_b, last_seen) in either user order.
+    """
+    if not entries:
+        return
+    # Core table: ORM bulk UPDATE with a list of params only supports primary-key WHERE
+    t = ChatSession.__table__
+    stmt = (
+        update(t)
+        .where(or_(
+            and_(t.c.status == "active", t.c.user_a == bindparam("a"), t.c.user_b == bindparam("b")),
+            and_(t.c.status == "active", t.c.user_a == bindparam("b"), t.c.user_b == bindparam("a")),
+        ))
+        .values(last_activity=bindparam("seen"))
+    )
+    async with write_session() as session:
+        await session.execute(stmt, [{"a": a, "b": b, "seen": seen} for a, b, seen in entries])
+
+async def end_expired_sessions(max_seconds: int = 3600, chunk: int = 1000) -> int:
     """
     End sessions with last_activity older than max_seconds.
-    Returns number of sessions ended.
+    Returns number of sessions ended (see expire_sessions).
     """
-    import datetime
-    # NOTE: sqlite syntax for datetime funcs differs; use python fallback for sqlite.
-    if DATABASE_URL.startswith("sqlite"):
-        # fallback implementation: select and compare in python
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                res = await session.execute(select(ChatSession).where(ChatSession.status == "active"))
-                ended = 0
-                from datetime import datetime, timezone, timedelta
-                for cs in res.scalars().all():
-                    if cs.last_activity:
-                        # cs.last_activity is datetime
-                        if (datetime.now(timezone.utc) - cs.last_activity) .total_seconds() > max_seconds:
-                            cs.status = "ended"
-                            cs.ended_at = func.now()
-                            ended += 1
-                return ended
-    else:
-        # For Postgres, do atomic update
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                # use raw update with interval
-                await session.execute(
-                    update(ChatSession).
-                    where(ChatSession.status == "active").
-                    where(ChatSession.last_activity < func.now() - func.cast(f'{max_seconds} seconds', Text))
+    return len(await expire_sessions(max_seconds=max_seconds, chunk=chunk))
+
+async def expire_sessions(max_seconds: int = 3600, chunk: int = 1000) -> List[int]:
+    """
+    End idle sessions set-based, `chunk` rows per transaction, and return their ids.
+    Each chunk is one UPDATE ... RETURNING id, user_a, user_b (SQLite >= 3.35 and Postgres);
+    both users are put back to idle in the same transaction, but only while they are still
+    chatting with each other. Nothing is loaded beyond the ids of the current chunk.
+    """
+    from datetime import datetime, timezone, timedelta
+    # cutoff computed here so the same bound parameter works on every dialect
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_seconds)
+    cs, users = ChatSession.__table__, User.__table__
+    expired = (
+        select(cs.c.id)
+        .where(cs.c.status == "active", cs.c.last_activity < cutoff)
+        .order_by(cs.c.id)
+        .limit(chunk)
+    )
+    if engine.dialect.name == "postgresql":
+        # concurrent cleaners take disjoint chunks instead of waiting on each other
+        expired = expired.with_for_update(skip_locked=True)
+    # keep last_activity as it was; the column's onupdate would otherwise stamp now()
+    end = update(cs).values(status="ended", ended_at=func.now(), last_activity=cs.c.last_activity)
+    release = (
+        update(users)
+        .where(users.c.id == bindparam("uid"), users.c.partner_id == bindparam("pid"), users.c.status == "chatting")
+        .values(status="idle", partner_id=None)
+    )
+    ended: List[int] = []
+    while True:
+        async with write_session() as session:
+            if engine.dialect.update_returning:
+                res = await session.execute(
+                    end.where(cs.c.id.in_(expired.scalar_subquery())).returning(cs.c.id, cs.c.user_a, cs.c.user_b)
                 )
-                # For simplicity return 0 here (counting would require RETURNING which SQLAlchemy async may support).
-                return 0               
\ No newline at end of file
+                rows = res.all()
+            else:
+                # SQLite < 3.35: same chunk, two statements, still one transaction
+                rows = (await session.execute(
+                    select(cs.c.id, cs.c.user_a, cs.c.user_b).where(cs.c.id.in_(expired.scalar_subquery()))
+                )).all()
+                if rows:
+                    await session.execute(end.where(cs.c.id.in_([r[0] for r in rows])))
+            if rows:
+                params = [{"uid": a, "pid": b} for _, a, b in rows] + [{"uid": b, "pid": a} for _, a, b in rows]
+                await session.execute(release, params)
+        if rows:
+            ended.extend(r[0] for r in rows)
+            await user_state.invalidate(*{u for _, a, b in rows for u in (a, b)})
+        if len(rows) < chunk:
+            return ended
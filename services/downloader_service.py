@@ -1,5 +1,4 @@
 import asyncio
-import yt_dlp
 from pathlib import Path
 from services.proxy_service import get_active_proxies, mark_proxy_failed, test_proxy
 from services.database import get_user_cookie_path
@@ -8,12 +7,17 @@ from services.crypto import decrypt_cookie_to_temp, remove_temp_cookie
 DOWNLOAD_DIR = Path("data/downloads")
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+def _youtube_dl(opts: dict):
+    # yt-dlp is the heaviest import in the bot; load it on the first download, not at startup
+    import yt_dlp
+    return yt_dlp.YoutubeDL(opts)
+
 def get_formats(url: str):
     """
     فراخوانی همزمان (blocking) برای گرفتن فرمت‌ها با yt-dlp
     """
     ydl_opts = {}
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    with _youtube_dl(ydl_opts) as ydl:
         info = ydl.extract_info(url, download=False)
         formats = []
         for f in info.get("formats", []):
@@ -44,7 +48,7 @@ async def download_no_proxy(url: str, format_id: str = None, tg_user_id: int = N
 
     def run():
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with _youtube_dl(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=True)
                 filename = ydl.prepare_filename(info)
             return filename
@@ -72,7 +76,7 @@ async def try_download_with_proxy(url: str, proxy: str, format_id: str = None, t
 
     def run():
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with _youtube_dl(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=True)
                 filename = ydl.prepare_filename(info)
             return filename
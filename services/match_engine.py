@@ -0,0 +1,144 @@
+# src/services/match_engine.py
+import heapq
+import time
+from collections import OrderedDict
+from itertools import product
+from typing import Optional, Dict, Tuple, Set, Iterable, List
+
+BucketKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class SearchTicket:
+    """
+    A waiting searcher: own profile (what others filter on) plus the filters it searches with.
+    """
+    __slots__ = ("user_id", "gender", "province", "city",
+                 "want_gender", "want_province", "want_city", "required", "enqueued_at")
+
+    def __init__(self, user_id: int, gender: Optional[str] = None, province: Optional[str] = None,
+                 city: Optional[str] = None, want_gender: Optional[str] = None,
+                 want_province: Optional[str] = None, want_city: Optional[str] = None,
+                 required: int = 1, enqueued_at: Optional[float] = None):
+        self.user_id = user_id
+        self.gender = gender
+        self.province = province
+        self.city = city
+        self.want_gender = want_gender
+        self.want_province = want_province
+        self.want_city = want_city
+        self.required = required
+        self.enqueued_at = time.time() if enqueued_at is None else enqueued_at
+
+    @property
+    def wanted_key(self) -> BucketKey:
+        return (self.want_gender, self.want_province, self.want_city)
+
+    def profile_keys(self) -> Iterable[BucketKey]:
+        """
+        Every bucket this ticket can be found in: its exact profile and each wildcard (None) generalization.
+        """
+        for g, p, c in product((self.gender, None), (self.province, None), (self.city, None)):
+            yield (g, p, c)
+
+    def relaxed(self, now: float, relax_after: float) -> "SearchTicket":
+        """
+        Copy with filters loosened by waiting time: city after relax_after seconds,
+        province after twice that. Gender is kept and the cost already quoted is unchanged.
+        """
+        steps = int((now - self.enqueued_at) // relax_after) if relax_after > 0 else 0
+        if steps < 1 or not (self.want_city or self.want_province):
+            return self
+        return SearchTicket(
+            self.user_id, gender=self.gender, province=self.province, city=self.city,
+            want_gender=self.want_gender,
+            want_province=self.want_province if steps < 2 else None,
+            want_city=None, required=self.required, enqueued_at=self.enqueued_at,
+        )
+
+    def accepts(self, other: "SearchTicket") -> bool:
+        if self.want_gender and self.want_gender != other.gender:
+            return False
+        if self.want_province and self.want_province != other.province:
+            return False
+        if self.want_city and self.want_city != other.city:
+            return False
+        return True
+
+
+class MatchEngine:
+    """
+    In-process searcher pool. Each waiting ticket is indexed in the FIFO bucket of every
+    (gender, province, city) generalization of its profile, so a searcher's filter tuple
+    addresses its candidate bucket directly and pairing never scans the users table.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[BucketKey, "OrderedDict[int, SearchTicket]"] = {}
+        self._tickets: Dict[int, SearchTicket] = {}
+        self._claimed: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._tickets
+
+    def get(self, user_id: int) -> Optional[SearchTicket]:
+        return self._tickets.get(user_id)
+
+    def add(self, ticket: SearchTicket) -> None:
+        self.discard(ticket.user_id)
+        self._tickets[ticket.user_id] = ticket
+        for key in ticket.profile_keys():
+            self._buckets.setdefault(key, OrderedDict())[ticket.user_id] = ticket
+
+    def discard(self, user_id: int) -> Optional[SearchTicket]:
+        ticket = self._tickets.pop(user_id, None)
+        self._claimed.discard(user_id)
+        if ticket is None:
+            return None
+        for key in ticket.profile_keys():
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.pop(user_id, None)
+                if not bucket:
+                    del self._buckets[key]
+        return ticket
+
+    def claim_next(self, ticket: SearchTicket, exclude: Optional[Set[int]] = None) -> Optional[SearchTicket]:
+        """
+        Return the longest-waiting compatible ticket for `ticket` and mark it claimed so concurrent
+        searchers skip it. The caller must `discard` it once paired or `release` it otherwise.
+        """
+        bucket = self._buckets.get(ticket.wanted_key)
+        if not bucket:
+            return None
+        for uid, cand in bucket.items():
+            if uid == ticket.user_id or uid in self._claimed:
+                continue
+            if exclude and uid in exclude:
+                continue
+            if not cand.accepts(ticket):
+                continue
+            self._claimed.add(uid)
+            return cand
+        return None
+
+    def release(self, user_id: int) -> None:
+        self._claimed.discard(user_id)
+
+    def oldest(self, n: int) -> List[SearchTicket]:
+        return heapq.nsmallest(n, self._tickets.values(), key=lambda t: t.enqueued_at)
+
+    def bucket_depths(self) -> Dict[BucketKey, int]:
+        """
+        Waiting tickets per exact (gender, province, city) profile.
+        """
+        depths: Dict[BucketKey, int] = {}
+        for t in self._tickets.values():
+            key = (t.gender, t.province, t.city)
+            depths[key] = depths.get(key, 0) + 1
+        return depths
+
+
+match_engine = MatchEngine()
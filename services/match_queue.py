@@ -0,0 +1,517 @@
+# src/services/match_queue.py
+import asyncio
+import json
+import logging
+import time
+import zlib
+from typing import Optional, Set, List, Dict, Iterable, Tuple
+from redis.asyncio import Redis
+from config import MATCH_BACKEND, MATCH_SHARDS
+from services.cache import get_redis
+from services.match_engine import SearchTicket, MatchEngine, BucketKey, match_engine
+
+logger = logging.getLogger("match_queue")
+
+# A pool lives under one hash tag, so every key a script touches is in one Redis Cluster slot
+# and is passed in KEYS. Tickets are fields of the HASH <prefix>tickets (value: _encode, a
+# JSON array, since profile fields are free text), and each is indexed in the ZSET
+# <prefix>bucket:<g>|<p>|<c> of every wildcard ('*') generalization of its profile (parts
+# escaped by _key_part), scored by enqueue time so ZRANGE yields FIFO order.
+
+# KEYS: tickets, the 8 buckets of the new ticket, then the tickets hash and 8 buckets of the
+# ticket it replaces (only when ARGV[4] is not empty), then the route hash (only when
+# ARGV[6] is not empty).
+# ARGV: uid, ticket, score, ticket to replace ('' = none), only_if_absent, route, expected route
+# Returns 0 without writing if the replaced ticket or the route changed since the caller read them.
+_LUA_ADD = """
+local uid = ARGV[1]
+local old = KEYS[1]
+if ARGV[4] ~= '' then old = KEYS[10] end
+if ARGV[6] ~= '' and (redis.call('HGET', KEYS[#KEYS], uid) or '') ~= ARGV[7] then
+  return 0
+end
+if ARGV[5] == '1' and redis.call('HEXISTS', KEYS[1], uid) == 1 then
+  return 1
+end
+if (redis.call('HGET', old, uid) or '') ~= ARGV[4] then
+  return 0
+end
+if ARGV[4] ~= '' then
+  redis.call('HDEL', old, uid)
+  for i = 11, 18 do redis.call('ZREM', KEYS[i], uid) end
+end
+redis.call('HSET', KEYS[1], uid, ARGV[2])
+for i = 2, 9 do redis.call('ZADD', KEYS[i], ARGV[3], uid) end
+if ARGV[6] ~= '' then redis.call('HSET', KEYS[#KEYS], uid, ARGV[6]) end
+return 1
+"""
+
+# KEYS: tickets, the ticket's 8 buckets (when ARGV[2] is not empty), route hash (when ARGV[3]
+# is not empty).
+# ARGV: uid, ticket expected ('' = none), route entry to clear ('' = leave the route alone)
+# Removes the ticket only if it is still the expected one; returns 0 otherwise.
+_LUA_DROP = """
+local uid = ARGV[1]
+if (redis.call('HGET', KEYS[1], uid) or '') ~= ARGV[2] then
+  return 0
+end
+if ARGV[2] ~= '' then
+  redis.call('HDEL', KEYS[1], uid)
+  for i = 2, 9 do redis.call('ZREM', KEYS[i], uid) end
+end
+if ARGV[3] ~= '' and redis.call('HGET', KEYS[#KEYS], uid) == ARGV[3] then
+  redis.call('HDEL', KEYS[#KEYS], uid)
+end
+return 1
+"""
+
+# KEYS: the bucket the searcher wants, tickets
+# ARGV: uid, g, p, c, offset, page size, pages, excluded uids...
+# Walks the bucket from `offset`, `pages` ZRANGE pages at most, for the oldest ticket that
+# accepts the searcher. Returns {offset, uid, ticket} when found, {offset to resume at} when
+# the pages ran out first, false once the bucket is exhausted. Read-only apart from pruning
+# index entries whose ticket is gone.
+_LUA_SCAN = """
+local excluded = {}
+for i = 8, #ARGV do excluded[ARGV[i]] = true end
+local offset, page = tonumber(ARGV[5]), tonumber(ARGV[6])
+for _ = 1, tonumber(ARGV[7]) do
+  local ids = redis.call('ZRANGE', KEYS[1], offset, offset + page - 1)
+  for _, uid in ipairs(ids) do
+    local raw = false
+    if uid ~= ARGV[1] and not excluded[uid] then
+      raw = redis.call('HGET', KEYS[2], uid)
+      if not raw then
+        redis.call('ZREM', KEYS[1], uid)
+        offset = offset - 1
+      end
+    end
+    if raw then
+      local t = cjson.decode(raw)
+      if (t[4] == '' or t[4] == ARGV[2]) and (t[5] == '' or t[5] == ARGV[3])
+          and (t[6] == '' or t[6] == ARGV[4]) then
+        return {offset, uid, raw}
+      end
+    end
+    offset = offset + 1
+  end
+  if #ids < page then
+    return false
+  end
+end
+return {offset}
+"""
+
+
+def _s(v: Optional[str]) -> str:
+    return v or ""
+
+
+def _n(v: str) -> Optional[str]:
+    return v or None
+
+
+def _key_part(v: Optional[str]) -> str:
+    # '*' is the wildcard and '|' the separator; escape them (and the escape) in real values
+    if not v:
+        return "*"
+    return v.replace("%", "%25").replace("|", "%7C").replace("*", "%2A")
+
+
+def _encode(ticket: SearchTicket) -> str:
+    # a JSON array, not a joined string: profile fields are user input and may hold any
+    # separator. The scan script reads fields 4-6 (the wanted profile) by position.
+    return json.dumps([
+        _s(ticket.gender), _s(ticket.province), _s(ticket.city),
+        _s(ticket.want_gender), _s(ticket.want_province), _s(ticket.want_city),
+        ticket.required, ticket.enqueued_at,
+    ], ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(user_id, raw: str) -> SearchTicket:
+    g, p, c, wg, wp, wc, req, ts = json.loads(raw)
+    return SearchTicket(
+        int(user_id), gender=_n(g), province=_n(p), city=_n(c),
+        want_gender=_n(wg), want_province=_n(wp), want_city=_n(wc),
+        required=int(req), enqueued_at=float(ts),
+    )
+
+
+class _Wakeup:
+    """
+    Edge-triggered "someone enqueued" signal for the match worker.
+    """
+
+    def __init__(self):
+        self._event: Optional[asyncio.Event] = None
+
+    @property
+    def event(self) -> asyncio.Event:
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    async def notify(self, ticket: Optional[SearchTicket] = None) -> None:
+        self.event.set()
+
+    async def wait_for_enqueue(self, timeout: Optional[float] = None) -> bool:
+        """
+        Sleep until notify() fires or timeout passes. Returns True if woken by an enqueue.
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.event.clear()
+
+
+class LocalMatchQueue(_Wakeup):
+    """
+    Async facade over the in-process MatchEngine. claim_next only marks the candidate,
+    so `release` keeps its place in line.
+    """
+
+    def __init__(self, engine: MatchEngine):
+        super().__init__()
+        self.engine = engine
+
+    async def add(self, ticket: SearchTicket) -> None:
+        self.engine.add(ticket)
+
+    async def claim_next(self, ticket: SearchTicket, exclude: Optional[Set[int]] = None) -> Optional[SearchTicket]:
+        return self.engine.claim_next(ticket, exclude=exclude)
+
+    async def release(self, ticket: SearchTicket) -> None:
+        self.engine.release(ticket.user_id)
+
+    async def discard(self, user_id: int) -> None:
+        self.engine.discard(user_id)
+
+    async def contains(self, user_id: int) -> bool:
+        return user_id in self.engine
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, SearchTicket]:
+        return {uid: t for uid in user_ids if (t := self.engine.get(uid)) is not None}
+
+    async def oldest(self, n: int) -> List[SearchTicket]:
+        return self.engine.oldest(n)
+
+    async def bucket_depths(self) -> Dict[BucketKey, int]:
+        return self.engine.bucket_depths()
+
+    async def size(self) -> int:
+        return len(self.engine)
+
+
+class RedisMatchQueue(_Wakeup):
+    """
+    Searcher pool shared by every bot replica. Buckets are Redis sorted sets; claiming a
+    partner finds the oldest compatible ticket with one server-side scan and takes it with a
+    second script that only succeeds if the ticket is still there unchanged, so concurrent
+    replicas cannot double-pair. The scan pages through the whole bucket (scan_pages pages
+    of scan_limit per call, resumed until found, exhausted or claim_budget seconds passed),
+    so compatible tickets behind a run of incompatible or excluded ones are still found.
+    A claimed ticket is removed from the pool; `release` puts it back with its original
+    enqueue time unless the user has queued again meanwhile.
+    Enqueue wakeups are fanned out to every replica's worker over Redis pub/sub.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = "match:{pool}:", scan_limit: int = 64,
+                 scan_pages: int = 16, claim_budget: float = 0.05):
+        super().__init__()
+        self._redis = redis
+        self.prefix = prefix
+        self.scan_limit = scan_limit
+        self.scan_pages = scan_pages
+        self.claim_budget = claim_budget
+        self.tickets_key = f"{prefix}tickets"
+        self._scripts = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def channel(self) -> str:
+        return f"{self.prefix}wakeup"
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def _script(self, name: str, source: str):
+        if name not in self._scripts:
+            self._scripts[name] = self.redis.register_script(source)
+        return self._scripts[name]
+
+    def _bucket_key(self, g: Optional[str], p: Optional[str], c: Optional[str]) -> str:
+        return f"{self.prefix}bucket:{_key_part(g)}|{_key_part(p)}|{_key_part(c)}"
+
+    def _bucket_keys(self, ticket: SearchTicket) -> List[str]:
+        return [self._bucket_key(*key) for key in ticket.profile_keys()]
+
+    async def _add(self, ticket: SearchTicket, only_if_absent: bool = False,
+                   replaces: Optional[Tuple["RedisMatchQueue", str]] = None,
+                   route: Optional[Tuple[str, str, str]] = None) -> bool:
+        """
+        Write `ticket` in one script. `replaces` is the (queue, ticket) the user currently
+        has, if any, which is dropped in the same step; `route` is (route hash, new entry,
+        expected entry) for a ShardedMatchQueue. False if either changed since it was read.
+        """
+        keys = [self.tickets_key] + self._bucket_keys(ticket)
+        old = ""
+        if replaces is not None:
+            queue, old = replaces
+            keys += [queue.tickets_key] + queue._bucket_keys(_decode(ticket.user_id, old))
+        route_key, route_to, route_from = route or ("", "", "")
+        if route_key:
+            keys.append(route_key)
+        done = await self._script("add", _LUA_ADD)(keys=keys, args=[
+            ticket.user_id, _encode(ticket), repr(ticket.enqueued_at), old,
+            "1" if only_if_absent else "0", route_to, route_from,
+        ])
+        return bool(done)
+
+    async def _drop(self, user_id: int, raw: Optional[str], route: Optional[Tuple[str, str]] = None) -> bool:
+        """
+        Remove the user's ticket if it is still `raw` (None: expect no ticket), and with
+        `route` = (route hash, entry) the route too if it still points here.
+        """
+        keys = [self.tickets_key]
+        if raw:
+            keys += self._bucket_keys(_decode(user_id, raw))
+        route_key, entry = route or ("", "")
+        if route_key:
+            keys.append(route_key)
+        return bool(await self._script("drop", _LUA_DROP)(keys=keys, args=[user_id, raw or "", entry]))
+
+    async def _ticket(self, user_id: int) -> Optional[str]:
+        return await self.redis.hget(self.tickets_key, user_id)
+
+    async def add(self, ticket: SearchTicket) -> None:
+        while True:
+            old = await self._ticket(ticket.user_id)
+            if await self._add(ticket, replaces=(self, old) if old else None):
+                return
+
+    async def claim_next(self, ticket: SearchTicket, exclude: Optional[Set[int]] = None) -> Optional[SearchTicket]:
+        scan = self._script("scan", _LUA_SCAN)
+        keys = [self._bucket_key(*ticket.wanted_key), self.tickets_key]
+        args: List = [ticket.user_id, _s(ticket.gender), _s(ticket.province), _s(ticket.city)]
+        deadline = time.monotonic() + self.claim_budget
+        offset = 0
+        while True:
+            row = await scan(keys=keys, args=args + [offset, self.scan_limit, self.scan_pages, *(exclude or ())])
+            if not row:
+                return None
+            offset = int(row[0])
+            if len(row) == 3:
+                uid, raw = row[1], row[2]
+                if await self._drop(int(uid), raw):
+                    return _decode(uid, raw)
+                # another replica took it between the scan and the take; it has left the
+                # bucket, so resuming at its offset continues with the ticket behind it
+            elif time.monotonic() >= deadline:
+                return None
+
+    async def release(self, ticket: SearchTicket) -> None:
+        await self._add(ticket, only_if_absent=True)
+
+    async def discard(self, user_id: int) -> None:
+        while True:
+            raw = await self._ticket(user_id)
+            if raw is None or await self._drop(user_id, raw):
+                return
+
+    async def contains(self, user_id: int) -> bool:
+        return bool(await self.redis.hexists(self.tickets_key, user_id))
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, SearchTicket]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = await self.redis.hmget(self.tickets_key, user_ids)
+        return {uid: _decode(uid, raw) for uid, raw in zip(user_ids, rows) if raw is not None}
+
+    async def bucket_depths(self) -> Dict[BucketKey, int]:
+        """
+        Waiting tickets per exact profile. Walks every ticket, so call it at metrics cadence only.
+        """
+        depths: Dict[BucketKey, int] = {}
+        async for _, raw in self.redis.hscan_iter(self.tickets_key, count=1000):
+            g, p, c = json.loads(raw)[:3]
+            key = (_n(g), _n(p), _n(c))
+            depths[key] = depths.get(key, 0) + 1
+        return depths
+
+    async def oldest(self, n: int) -> List[SearchTicket]:
+        ids = await self.redis.zrange(self._bucket_key(None, None, None), 0, n - 1)
+        tickets = await self.get_many(int(i) for i in ids)
+        return [tickets[int(i)] for i in ids if int(i) in tickets]
+
+    async def notify(self, ticket: Optional[SearchTicket] = None) -> None:
+        self.event.set()
+        await self.redis.publish(self.channel, "1")
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        self.event.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("match wakeup subscription lost: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def wait_for_enqueue(self, timeout: Optional[float] = None) -> bool:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return await super().wait_for_enqueue(timeout)
+
+    async def size(self) -> int:
+        return int(await self.redis.hlen(self.tickets_key))
+
+
+def shard_of(province: Optional[str], shards: int) -> int:
+    # crc32 rather than hash(): must agree across processes and restarts
+    return zlib.crc32((province or "").encode()) % shards
+
+
+class ShardedMatchQueue:
+    """
+    Searcher pool split into `shards` independent Redis pools, one per match worker process.
+    A ticket waits in the shard of its own province, so everyone who can satisfy a province
+    filter sits in one shard, men and women alike, and a shard worker's batch pass sees
+    complementary searchers together. Gender is deliberately not part of the key: that
+    would put the two sides of most pairs in different shards. A province-filtered search
+    claims from that province's shard only; any other search tries its own shard first,
+    then the rest. The shard a user was routed to is recorded so release/discard reach the
+    right pool. Shards share the pool's hash tag, so moving a user to another shard (drop
+    the old ticket, write the new one and the route) is a single script: replicas enqueueing
+    the same user at once can't leave a ticket in two shards.
+    """
+
+    def __init__(self, shards: int, redis: Optional[Redis] = None, prefix: str = "match:{pool}:"):
+        self.shards = [RedisMatchQueue(redis, prefix=f"{prefix}shard{i}:") for i in range(shards)]
+        self._redis = redis
+        self.route_key = f"{prefix}route"
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def route(self, ticket: SearchTicket) -> int:
+        return shard_of(ticket.province, len(self.shards))
+
+    def claim_order(self, ticket: SearchTicket) -> List[int]:
+        if ticket.want_province:
+            # only someone from that province can satisfy the filter, and they all wait there
+            return [shard_of(ticket.want_province, len(self.shards))]
+        own = self.route(ticket)
+        return [own] + [i for i in range(len(self.shards)) if i != own]
+
+    async def _routed(self, user_id: int) -> Optional[RedisMatchQueue]:
+        i = await self.redis.hget(self.route_key, user_id)
+        return self.shards[int(i)] if i is not None else None
+
+    async def add(self, ticket: SearchTicket) -> None:
+        i = self.route(ticket)
+        while True:
+            old = await self.redis.hget(self.route_key, ticket.user_id)
+            old_q = self.shards[int(old)] if old is not None else self.shards[i]
+            raw = await old_q._ticket(ticket.user_id)
+            if await self.shards[i]._add(ticket, replaces=(old_q, raw) if raw else None,
+                                         route=(self.route_key, str(i), old or "")):
+                return
+
+    async def claim_next(self, ticket: SearchTicket, exclude: Optional[Set[int]] = None) -> Optional[SearchTicket]:
+        for i in self.claim_order(ticket):
+            cand = await self.shards[i].claim_next(ticket, exclude=exclude)
+            if cand is not None:
+                return cand
+        return None
+
+    async def release(self, ticket: SearchTicket) -> None:
+        while True:
+            i = await self.redis.hget(self.route_key, ticket.user_id)
+            if i is None:
+                return
+            # only into the shard the route still names; a concurrent add may have moved the user
+            if await self.shards[int(i)]._add(ticket, only_if_absent=True, route=(self.route_key, i, i)):
+                return
+
+    async def discard(self, user_id: int) -> None:
+        while True:
+            i = await self.redis.hget(self.route_key, user_id)
+            if i is None:
+                return
+            q = self.shards[int(i)]
+            if await q._drop(user_id, await q._ticket(user_id), route=(self.route_key, i)):
+                return
+
+    async def contains(self, user_id: int) -> bool:
+        q = await self._routed(user_id)
+        return q is not None and await q.contains(user_id)
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, SearchTicket]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        routes = await self.redis.hmget(self.route_key, user_ids)
+        by_shard: Dict[int, List[int]] = {}
+        for uid, i in zip(user_ids, routes):
+            if i is not None:
+                by_shard.setdefault(int(i), []).append(uid)
+        tickets: Dict[int, SearchTicket] = {}
+        for i, uids in by_shard.items():
+            tickets.update(await self.shards[i].get_many(uids))
+        return tickets
+
+    async def oldest(self, n: int) -> List[SearchTicket]:
+        tickets: List[SearchTicket] = []
+        for q in self.shards:
+            tickets.extend(await q.oldest(n))
+        return sorted(tickets, key=lambda t: t.enqueued_at)[:n]
+
+    async def bucket_depths(self) -> Dict[BucketKey, int]:
+        depths: Dict[BucketKey, int] = {}
+        for q in self.shards:
+            for key, n in (await q.bucket_depths()).items():
+                depths[key] = depths.get(key, 0) + n
+        return depths
+
+    async def notify(self, ticket: Optional[SearchTicket] = None) -> None:
+        # wake only the worker owning the shard the ticket landed in
+        q = await self._routed(ticket.user_id) if ticket is not None else None
+        for shard in ([q] if q is not None else self.shards):
+            await shard.notify()
+
+    async def wait_for_enqueue(self, timeout: Optional[float] = None) -> bool:
+        waits = [asyncio.create_task(q.wait_for_enqueue(timeout)) for q in self.shards]
+        done, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for t in pending:
+            t.cancel()
+        return any(t.result() for t in done)
+
+    async def size(self) -> int:
+        return sum([await q.size() for q in self.shards])
+
+
+def _make_queue():
+    if MATCH_BACKEND == "redis":
+        if MATCH_SHARDS > 1:
+            return ShardedMatchQueue(MATCH_SHARDS)
+        return RedisMatchQueue()
+    return LocalMatchQueue(match_engine)
+
+
+match_queue = _make_queue()
@@ -1,78 +1,265 @@
 # src/services/matcher.py
-from typing import Optional, Tuple
-from services.database import AsyncSessionLocal, User, create_chat_session, is_blocked
-from config import CREDIT_COST_RANDOM, CREDIT_COST_ADVANCED
-from sqlalchemy import select
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple, Set, List, Dict
+from services.database import AsyncSessionLocal, write_session, User, ChatSession, get_blocks_among, blocked_between, apply_credits, create_user_if_not_exists
+from services.block_index import block_index
+from services.state_cache import user_state
+from services.match_engine import SearchTicket, MatchEngine
+from services.match_queue import match_queue
+from services.telemetry import observe_match, set_queue_length
+from config import CREDIT_COST_RANDOM, CREDIT_COST_ADVANCED, MATCH_RELAX_AFTER
+from sqlalchemy import select, update, func
+
+
+async def _load_searcher(user_id: int) -> User:
+    async with AsyncSessionLocal() as session:
+        me = await session.get(User, user_id)
+    if me is None:
+        await create_user_if_not_exists(user_id)
+        # fresh session: the first one's snapshot predates the insert
+        async with AsyncSessionLocal() as session:
+            me = await session.get(User, user_id)
+    return me
+
+
+def _pair_update(t: SearchTicket, other: SearchTicket, cost: int, searching: bool = True):
+    # conditional: only a user still searching (if asked) with enough credits is paired
+    cond = [User.id == t.user_id, User.credits >= cost]
+    if searching:
+        cond.append(User.status == "searching")
+    return (
+        update(User).where(*cond)
+        .values(status="chatting", partner_id=other.user_id, credits=User.credits - cost)
+        .returning(User.id, User.credits)
+    )
+
+
+class _PairingLost(Exception):
+    # raised inside the write block so everything it did is rolled back
+    def __init__(self, outcome: str):
+        super().__init__(outcome)
+        self.outcome = outcome
+
+
+async def _commit_pair(me: SearchTicket, cand: SearchTicket) -> Tuple[Optional[int], str]:
+    """
+    Write the final pairing in one transaction. Both UPDATEs are conditional, so a candidate that
+    stopped searching or a user without enough credits makes the whole pairing roll back.
+    Blocks are checked again in the same transaction: the block index may not have seen a
+    block made on another replica yet.
+    Returns (session_id, outcome); session_id is None unless outcome is "paired", else outcome
+    says why: "blocked", "stale" (candidate no longer searching) or "poor" (we can't pay).
+    """
+    try:
+        async with write_session() as session:
+            if await blocked_between(session, me.user_id, cand.user_id):
+                raise _PairingLost("blocked")
+            if await apply_credits(session, _pair_update(cand, me, 1), -1, "match") is None:
+                raise _PairingLost("stale")
+            if await apply_credits(session, _pair_update(me, cand, me.required, searching=False), -me.required, "match") is None:
+                raise _PairingLost("poor")
+            cs = ChatSession(user_a=me.user_id, user_b=cand.user_id)
+            session.add(cs)
+            await session.flush()
+    except _PairingLost as e:
+        return None, e.outcome
+    await user_state.put(me.user_id, "chatting", cand.user_id)
+    await user_state.put(cand.user_id, "chatting", me.user_id)
+    return cs.id, "paired"
+
+
+async def _mark_searching(user_id: int) -> None:
+    async with write_session() as session:
+        await session.execute(
+            update(User).where(User.id == user_id)
+            .values(status="searching", partner_id=None, search_started_at=func.now())
+        )
+    await user_state.put(user_id, "searching", None)
+
 
 async def enqueue_search(user_id: int, gender: Optional[str] = None, province: Optional[str] = None, city: Optional[str] = None) -> Optional[Tuple[int,int]]:
     """
     Try atomic match: returns tuple (partner_id, session_id) if matched, else None.
+    Candidates come from the match queue (in-memory or Redis); only the final pairing touches the
+    users table. If nobody compatible is waiting, the user is marked searching and queued.
+    """
+    # determine required credits (advanced if any filter is present)
+    is_advanced = any([gender, province, city])
+    required = CREDIT_COST_ADVANCED if is_advanced else CREDIT_COST_RANDOM
+
+    me = await _load_searcher(user_id)
+    if (me.credits or 0) < required:
+        return None
+
+    await match_queue.discard(user_id)
+    ticket = SearchTicket(
+        user_id, gender=me.gender, province=me.province, city=me.city,
+        want_gender=gender, want_province=province, want_city=city, required=required,
+    )
+
+    # known blocked peers are skipped inside the bucket scan; _commit_pair catches the rest
+    rejected: Set[int] = set(await block_index.blocked_peers(user_id))
+    while True:
+        cand = await match_queue.claim_next(ticket, exclude=rejected)
+        if cand is None:
+            break
+        try:
+            cs_id, outcome = await _commit_pair(ticket, cand)
+        except BaseException:
+            await match_queue.release(cand)
+            raise
+        if cs_id is not None:
+            await match_queue.discard(cand.user_id)
+            observe_match(0.0, time.time() - cand.enqueued_at)
+            set_queue_length(await match_queue.size())
+            return (cand.user_id, cs_id)
+        if outcome == "blocked":
+            # a block the index hadn't seen yet (made on another replica): refresh and skip
+            block_index.invalidate(user_id, cand.user_id)
+            rejected.add(cand.user_id)
+            await match_queue.release(cand)
+            continue
+        if outcome == "stale":
+            # stale candidate (no longer searching elsewhere): drop it and keep looking
+            await match_queue.discard(cand.user_id)
+            continue
+        # we could not afford the pairing after all
+        await match_queue.release(cand)
+        return None
+
+    await _mark_searching(user_id)
+    await match_queue.add(ticket)
+    await match_queue.notify(ticket)
+    set_queue_length(await match_queue.size())
+    return None
+
+
+def _epoch(dt: Optional[datetime]) -> float:
+    if dt is None:
+        return 0.0
+    if dt.tzinfo is None:
+        # SQLite hands back naive UTC timestamps
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def pair_greedy(tickets: List[SearchTicket], blocks: Dict[int, Set[int]]) -> List[Tuple[SearchTicket, SearchTicket]]:
+    """
+    Greedy in-memory pairing: replay tickets in enqueue order through a scratch MatchEngine,
+    so each searcher takes the longest-waiting compatible, non-blocked partner seen so far.
+    Returns (searcher, candidate) pairs; the searcher pays its own cost, the candidate pays 1.
+    """
+    scratch = MatchEngine()
+    pairs: List[Tuple[SearchTicket, SearchTicket]] = []
+    for t in sorted(tickets, key=lambda t: t.enqueued_at):
+        cand = scratch.claim_next(t, exclude=blocks.get(t.user_id))
+        if cand is None:
+            scratch.add(t)
+            continue
+        scratch.discard(cand.user_id)
+        pairs.append((t, cand))
+    return pairs
+
+
+# A searcher whose ticket is missing this many seconds after search_started_at was lost by
+# the queue (e.g. an in-memory queue after a restart); a younger one may still be between
+# _mark_searching and match_queue.add.
+LOST_SEARCH_GRACE = 60
+
+
+async def release_lost_searchers(candidates: List[Tuple[int, Optional[datetime]]]) -> int:
     """
+    Put searchers the match queue no longer knows back to idle. Their filters and price
+    only ever lived in the ticket, so pairing them as random searchers would ignore what
+    they asked (and paid) for; they can simply search again. Takes (user_id,
+    search_started_at) pairs; returns how many were released.
+    """
+    cutoff = time.time() - LOST_SEARCH_GRACE
+    ids = [uid for uid, started in candidates if _epoch(started) < cutoff]
+    if not ids:
+        return 0
+    async with write_session() as session:
+        res = await session.execute(
+            update(User)
+            .where(User.id.in_(ids), User.status == "searching",
+                   User.search_started_at < datetime.now(timezone.utc) - timedelta(seconds=LOST_SEARCH_GRACE))
+            .values(status="idle", partner_id=None)
+            .returning(User.id)
+        )
+        released = [r[0] for r in res.all()]
+    for uid in released:
+        await user_state.put(uid, "idle", None)
+    return len(released)
+
+
+async def _searching_window(window: int, relax_after: float) -> List[SearchTicket]:
     async with AsyncSessionLocal() as session:
-        async with session.begin():
-            me = await session.get(User, user_id)
-            if me is None:
-                me = User(id=user_id, credits=10)
-                session.add(me)
-                await session.flush()
-
-            # determine required credits (advanced if any filter is present)
-            is_advanced = any([gender, province, city])
-            required = CREDIT_COST_ADVANCED if is_advanced else CREDIT_COST_RANDOM
-
-            if (me.credits or 0) < required:
-                return None
-
-            me.status = "searching"
-            me.partner_id = None
-
-            # candidate query
-            stmt = select(User).where(User.status == 'searching', User.id != user_id)
-            if gender:
-                stmt = stmt.where(User.gender == gender)
-            if province:
-                stmt = stmt.where(User.province == province)
-            if city:
-                stmt = stmt.where(User.city == city)
-            stmt = stmt.order_by(User.created_at).with_for_update(skip_locked=True).limit(1)
-            res = await session.execute(stmt)
-            candidate = res.scalar_one_or_none()
-            if not candidate:
-                return None
-
-            # lock me row
-            me_stmt = select(User).where(User.id == user_id).with_for_update()
-            res2 = await session.execute(me_stmt)
-            me_locked = res2.scalar_one()
-
-            # re-check credit with same required cost
-            if me_locked.credits < required or candidate.credits < 1:
-                candidate.status = 'idle'
-                candidate.partner_id = None
-                me_locked.status = 'idle'
-                me_locked.partner_id = None
-                return None
-
-            # avoid pairing blocked users
-            if await is_blocked(me_locked.id, candidate.id):
-                # skip this candidate; mark candidate idle and try none (caller can retry)
-                candidate.status = 'idle'
-                candidate.partner_id = None
-                me_locked.status = 'idle'
-                me_locked.partner_id = None
-                return None
-
-            me_locked.credits -= required
-            candidate.credits -= 1
-
-            me_locked.status = 'chatting'
-            me_locked.partner_id = candidate.id
-            candidate.status = 'chatting'
-            candidate.partner_id = me_locked.id
-
-            # create chat session
-            cs_id = await create_chat_session(me_locked.id, candidate.id)
-            return (candidate.id, cs_id)
+        res = await session.execute(
+            select(User.id, User.search_started_at)
+            .where(User.status == "searching")
+            .order_by(User.search_started_at.asc().nulls_first())
+            .limit(window)
+        )
+        rows = res.all()
+    if not rows:
+        return []
+
+    now = time.time()
+    queued = await match_queue.get_many([uid for uid, _ in rows])
+    # searching in the DB but unknown to the queue: the ticket (filters, price) is gone
+    await release_lost_searchers([(uid, started) for uid, started in rows if uid not in queued])
+    return [queued[uid].relaxed(now, relax_after) for uid, _ in rows if uid in queued]
+
+
+async def match_batch(window: int = 500, relax_after: float = MATCH_RELAX_AFTER, queue=None) -> int:
+    """
+    Pair a whole window of searchers at once: one query for their profiles, one for blocks
+    among them, greedy pairing in memory, then every pair and ChatSession row in a single
+    transaction. Each pair gets a SAVEPOINT so a pair invalidated meanwhile (e.g. matched
+    by enqueue_search) is skipped without aborting the rest. Returns number of pairs made.
+    The window holds the longest waiters; tickets waiting past relax_after get loosened filters.
+    With `queue` (one shard of a ShardedMatchQueue) the window is that queue's oldest tickets
+    instead of the users table, so shard workers never look at each other's searchers.
+    """
+    now = time.time()
+    if queue is None:
+        tickets = await _searching_window(window, relax_after)
+    else:
+        tickets = [t.relaxed(now, relax_after) for t in await queue.oldest(window)]
+    if len(tickets) < 2:
+        return 0
+
+    blocks: Dict[int, Set[int]] = {}
+    for a, b in await get_blocks_among([t.user_id for t in tickets]):
+        blocks.setdefault(a, set()).add(b)
+        blocks.setdefault(b, set()).add(a)
 
+    pairs = pair_greedy(tickets, blocks)
+    if not pairs:
+        return 0
 
+    made: List[Tuple[SearchTicket, SearchTicket]] = []
+    async with write_session() as session:
+        for me, cand in pairs:
+            sp = await session.begin_nested()
+            ok = True
+            for t, other, cost in ((cand, me, 1), (me, cand, me.required)):
+                if await apply_credits(session, _pair_update(t, other, cost), -cost, "match") is None:
+                    ok = False
+                    break
+            if not ok:
+                await sp.rollback()
+                continue
+            session.add(ChatSession(user_a=me.user_id, user_b=cand.user_id))
+            await sp.commit()
+            made.append((me, cand))
 
+    for me, cand in made:
+        await user_state.put(me.user_id, "chatting", cand.user_id)
+        await user_state.put(cand.user_id, "chatting", me.user_id)
+        await match_queue.discard(me.user_id)
+        await match_queue.discard(cand.user_id)
+        observe_match(now - me.enqueued_at, now - cand.enqueued_at)
+    set_queue_length(await match_queue.size())
+    return len(made)
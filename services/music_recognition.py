@@ -1,6 +1,5 @@
-from shazamio import Shazam
-
 async def recognize_song(file_path: str):
+    from shazamio import Shazam  # heavy (aiohttp client stack, pydantic models); first use only
     shazam = Shazam()
     result = await shazam.recognize_song(file_path)
     if 'track' in result and result['track']:
@@ -2,14 +2,18 @@ import os
 import hmac
 import hashlib
 from typing import Dict, Any, Optional
-import stripe
 from services.database import create_order, mark_order_paid, get_order_by_ref
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 
-if STRIPE_SECRET_KEY:
-    stripe.api_key = STRIPE_SECRET_KEY
+
+def _stripe():
+    # the stripe SDK is large and only the card checkout uses it; import on first call
+    import stripe
+    if STRIPE_SECRET_KEY:
+        stripe.api_key = STRIPE_SECRET_KEY
+    return stripe
 
 
 async def create_checkout_session(user_id: int, amount_credits: int, price_cents: int, success_url: str, cancel_url: str) -> Dict[str, Any]:
@@ -17,7 +21,7 @@ async def create_checkout_session(user_id: int, amount_credits: int, price_cents
         raise RuntimeError("Stripe not configured")
     ref = f"user{user_id}_{amount_credits}"
     order_id = await create_order(user_id, amount_credits, provider="stripe", ref=ref)
-    session = stripe.checkout.Session.create(
+    session = _stripe().checkout.Session.create(
         payment_method_types=["card"],
         line_items=[{
             'price_data': {
@@ -39,7 +43,7 @@ async def handle_stripe_webhook(payload: bytes, sig_header: str) -> bool:
     if not STRIPE_WEBHOOK_SECRET:
         return False
     try:
-        event = stripe.Webhook.construct_event(
+        event = _stripe().Webhook.construct_event(
             payload=payload, sig_header=sig_header, secret=STRIPE_WEBHOOK_SECRET
         )
     except Exception:
@@ -1,10 +1,9 @@
 import re
-import requests
 from typing import List
 from config import PROXY_HEALTH_INTERVAL
 import asyncio
 from services.database import (
-    add_proxy_to_db, remove_proxy_from_db, list_proxies_from_db,
+    add_proxy_to_db, remove_proxy_from_db, list_proxies_from_db, proxies_page, iter_proxies,
     get_active_proxies_from_db, mark_proxy_failed_in_db, mark_proxy_ok_in_db,
     quarantine_proxy_in_db
 )
@@ -35,6 +34,9 @@ async def quarantine_proxy(proxy: str):
 async def list_proxies(limit: int = 100):
     return await list_proxies_from_db(limit)
 
+async def list_proxies_page(after_id=None, before_id=None, limit: int = 20):
+    return await proxies_page(after_id=after_id, before_id=before_id, limit=limit)
+
 async def get_active_proxies(limit: int = 50):
     return await get_active_proxies_from_db(limit)
 
@@ -45,6 +47,7 @@ async def mark_proxy_ok(proxy: str):
     await mark_proxy_ok_in_db(proxy)
 
 def test_proxy(proxy: str, timeout: int = REQUEST_TIMEOUT) -> bool:
+    import requests  # imported on the first health check, not with the admin handlers
     proxies = {"http": proxy, "https": proxy}
     try:
         r = requests.get(TEST_URL, proxies=proxies, timeout=timeout)
@@ -63,12 +66,13 @@ async def proxy_health_worker():
     """
     while True:
         try:
-            rows = await list_proxies_from_db(limit=500)
             async def check(proxy: str):
                 return await asyncio.to_thread(test_proxy, proxy)
-            tasks = [check(r[1]) for r in rows]
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
+            # the whole table (not just the first 500), collected before testing so no DB
+            # connection is held while requests run, then tested 50 at a time
+            proxies = [r[1] async for r in iter_proxies()]
+            for i in range(0, len(proxies), 50):
+                await asyncio.gather(*[check(p) for p in proxies[i:i + 50]], return_exceptions=True)
         except Exception as e:
             print("proxy_health_worker error:", e)
         await asyncio.sleep(PROXY_HEALTH_INTERVAL)
\ No newline at end of file
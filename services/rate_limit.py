@@ -0,0 +1,184 @@
+# src/services/rate_limit.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from aiogram.types import CallbackQuery, Message
+from redis.asyncio import Redis
+from config import RATE_LIMIT_BACKEND, RATE_LIMIT_MAX_KEYS
+from services.cache import get_redis
+from services.telemetry import inc_rate_limited
+
+logger = logging.getLogger("rate_limit")
+
+
+class RatePolicy:
+    """
+    `limit` requests per `period` seconds on average, with bursts of up to `burst` back to
+    back (default: limit).
+    """
+    __slots__ = ("name", "limit", "period", "burst", "interval")
+
+    def __init__(self, name: str, limit: int, period: float, burst: Optional[int] = None):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.burst = burst or limit
+        self.interval = period / limit
+
+
+# Per-command policies; other commands get "command", everything else a user sends "message"
+# (chat messages included: the burst lets an album of 10 through, the rate is one every 0.5s).
+POLICIES: Dict[str, RatePolicy] = {p.name: p for p in (
+    RatePolicy("message", 2, 1, burst=10),
+    RatePolicy("command", 1, 1, burst=5),
+    RatePolicy("callback", 3, 1, burst=10),
+    RatePolicy("chat", 5, 60, burst=3),
+    RatePolicy("random", 5, 60, burst=3),
+    RatePolicy("advanced", 5, 60, burst=3),
+    RatePolicy("download", 10, 60, burst=3),
+)}
+# at most one "slow down" reply per user per this policy
+NOTICE_POLICY = RatePolicy("notice", 1, 10)
+
+
+# GCRA: the key holds the theoretical arrival time (ms) of the next request at the steady
+# rate; a request is allowed while that is no more than burst-1 intervals ahead of now.
+# Uses the server clock, so replicas with skewed clocks agree. Returns ms to wait (0 = ok).
+_LUA_GCRA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - interval * tonumber(ARGV[2])
+if now < allow_at then
+  return allow_at - now
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return 0
+"""
+
+
+class LocalRateLimiter:
+    """
+    GCRA per (policy, user) in process memory. An entry is only a timestamp and is worthless
+    once it is in the past, so expired entries are dropped from the LRU end as new hits come
+    in, and the map never holds more than `max_keys` (evicting a live entry only forgives
+    that user early).
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+
+    async def hit(self, policy: RatePolicy, user_id: int) -> float:
+        """
+        Count a request; returns 0 if it is allowed, else seconds until it would be.
+        """
+        now = time.monotonic()
+        key = (policy.name, user_id)
+        tat = max(self._tat.get(key, now), now)
+        new_tat = tat + policy.interval
+        allow_at = new_tat - policy.interval * policy.burst
+        if now < allow_at:
+            return allow_at - now
+        self._tat[key] = new_tat
+        self._tat.move_to_end(key)
+        while self._tat:
+            oldest = next(iter(self._tat))
+            if len(self._tat) <= self.max_keys and self._tat[oldest] > now:
+                break
+            del self._tat[oldest]
+        return 0.0
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class RedisRateLimiter:
+    """
+    GCRA per (policy, user) in Redis, one atomic script call per request, so the limit holds
+    across replicas. Keys expire as soon as they stop mattering.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = "rl:"):
+        self._redis = redis
+        self.prefix = prefix
+        self._gcra = None
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    async def hit(self, policy: RatePolicy, user_id: int) -> float:
+        if self._gcra is None:
+            self._gcra = self.redis.register_script(_LUA_GCRA)
+        wait_ms = await self._gcra(
+            keys=[f"{self.prefix}{policy.name}:{user_id}"],
+            args=[int(policy.interval * 1000), policy.burst],
+        )
+        return int(wait_ms) / 1000
+
+
+class NullRateLimiter:
+    async def hit(self, policy: RatePolicy, user_id: int) -> float:
+        return 0.0
+
+
+def policy_for(event: Any) -> RatePolicy:
+    if isinstance(event, CallbackQuery):
+        return POLICIES["callback"]
+    text = getattr(event, "text", None) or ""
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        return POLICIES.get(command, POLICIES["command"])
+    return POLICIES["message"]
+
+
+class Throttle:
+    """
+    Outer middleware for messages and callback queries (dp.message / dp.callback_query):
+    updates over their policy's rate are dropped before any handler or filter runs.
+    Throttled commands get a short reply (rate limited itself); callbacks are answered so
+    the button stops spinning; plain messages are dropped silently.
+    """
+
+    def __init__(self, limiter=None):
+        self.limiter = limiter if limiter is not None else rate_limiter
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+        policy = policy_for(event)
+        try:
+            wait = await self.limiter.hit(policy, user.id)
+        except Exception as e:
+            # a limiter outage must not take the bot down with it
+            logger.warning("rate limit check failed, letting the update through: %s", e)
+            return await handler(event, data)
+        if not wait:
+            return await handler(event, data)
+        inc_rate_limited(policy.name)
+        if isinstance(event, CallbackQuery):
+            await event.answer("⏳ کمی آهسته‌تر!")
+        elif isinstance(event, Message) and policy.name != "message":
+            if not await self.limiter.hit(NOTICE_POLICY, user.id):
+                await event.reply(f"⏳ کمی صبر کن؛ {max(1, round(wait))} ثانیه دیگر دوباره امتحان کن.")
+        return None
+
+
+def _make_limiter():
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimiter()
+    if RATE_LIMIT_BACKEND == "memory":
+        return LocalRateLimiter()
+    return NullRateLimiter()
+
+
+rate_limiter = _make_limiter()
+throttle = Throttle(rate_limiter)
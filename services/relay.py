@@ -0,0 +1,169 @@
+# src/services/relay.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import ContentType, Message
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramServerError
+from config import RELAY_QUEUE_MAX, RELAY_MAX_ATTEMPTS
+from services.send_scheduler import send_priority, RELAY
+from services.telemetry import set_relay_queue_depth, observe_relay, inc_relay
+
+logger = logging.getLogger("relay")
+
+# everything copy_message can reproduce; service messages, polls and games stay out
+RELAYED_TYPES = {
+    ContentType.TEXT, ContentType.STICKER, ContentType.PHOTO, ContentType.VOICE, ContentType.VIDEO,
+    ContentType.AUDIO, ContentType.DOCUMENT, ContentType.VIDEO_NOTE, ContentType.ANIMATION,
+    ContentType.LOCATION, ContentType.VENUE, ContentType.CONTACT, ContentType.DICE,
+}
+
+
+def relayable(message: Message) -> bool:
+    """
+    Whether the relay handler could take this message: a relayed type, and not a command.
+    """
+    return message.content_type in RELAYED_TYPES and not (message.text or "").startswith("/")
+
+
+class _Job:
+    __slots__ = ("bot", "from_chat_id", "message_id", "to_chat_id", "queued_at")
+
+    def __init__(self, bot: Bot, from_chat_id: int, message_id: int, to_chat_id: int, queued_at: float):
+        self.bot = bot
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.to_chat_id = to_chat_id
+        self.queued_at = queued_at
+
+
+class RelayPipeline:
+    """
+    Delivers chat messages to the partner with copy_message (any content type, and no
+    "forwarded from" header), in the order the sender sent them, off the handler's path.
+
+    Each sender has an ordered queue of slots, one per incoming update, reserved by
+    order_middleware the moment the update arrives, before any await can reorder updates
+    handled concurrently. The relay handler (flagged "relay") fills its slot with a job;
+    updates routed to any other handler release theirs before it runs (handler_middleware),
+    so a slow command or download never holds back the sender's chat messages. A per-sender task (running only while there is
+    work) sends jobs head first, so a flood wait or retry delays that sender's messages only.
+    """
+
+    def __init__(self, max_queue: int = RELAY_QUEUE_MAX, max_attempts: int = RELAY_MAX_ATTEMPTS):
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self._slots: Dict[int, Deque[asyncio.Future]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._queued = 0
+
+    async def order_middleware(self, handler, event, data: Dict[str, Any]):
+        """
+        Outer update middleware: for messages the relay could take, passes `relay_slot`
+        (None when the sender's queue is full) to the handlers and releases it if nobody
+        filled it. It must run before anything that can await (the FSM storage read, the
+        throttle), see bot.build_dispatcher.
+        """
+        user = data.get("event_from_user")
+        message = getattr(event, "message", None)
+        if user is None or message is None or not relayable(message):
+            return await handler(event, data)
+        slot = self.reserve(user.id)
+        data["relay_slot"] = slot
+        try:
+            return await handler(event, data)
+        finally:
+            if slot is not None:
+                self.release(user.id, slot)
+
+    async def handler_middleware(self, handler, event: Message, data: Dict[str, Any]):
+        """
+        Inner message middleware: once routing has picked a handler without the "relay"
+        flag, give the update's slot back before that handler runs.
+        """
+        slot = data.get("relay_slot")
+        if slot is not None and not get_flag(data, "relay"):
+            self.release(event.from_user.id, slot)
+        return await handler(event, data)
+
+    def reserve(self, user_id: int) -> Optional[asyncio.Future]:
+        slots = self._slots.setdefault(user_id, deque())
+        if len(slots) >= self.max_queue:
+            inc_relay("rejected")
+            return None
+        slot = asyncio.get_running_loop().create_future()
+        slots.append(slot)
+        return slot
+
+    def fill(self, user_id: int, slot: asyncio.Future, bot: Bot, from_chat_id: int, message_id: int, to_chat_id: int) -> None:
+        if slot.done():
+            return
+        slot.set_result(_Job(bot, from_chat_id, message_id, to_chat_id, time.monotonic()))
+        self._queued += 1
+        set_relay_queue_depth(self._queued)
+        if user_id not in self._tasks:
+            self._tasks[user_id] = asyncio.create_task(self._drain(user_id))
+
+    def release(self, user_id: int, slot: asyncio.Future) -> None:
+        if not slot.done():
+            slot.set_result(None)
+        if user_id not in self._tasks:
+            # nothing is draining, so the head can only hold released or pending slots
+            slots = self._slots.get(user_id)
+            while slots and slots[0].done() and slots[0].result() is None:
+                slots.popleft()
+            if slots is not None and not slots:
+                del self._slots[user_id]
+
+    async def _drain(self, user_id: int) -> None:
+        slots = self._slots[user_id]
+        try:
+            with send_priority(RELAY):
+                await self._drain_slots(slots)
+        finally:
+            del self._tasks[user_id]
+            if not slots and self._slots.get(user_id) is slots:
+                del self._slots[user_id]
+
+    async def _drain_slots(self, slots: Deque[asyncio.Future]) -> None:
+        while slots:
+            job = await slots[0]  # an earlier update may still be in its handler
+            if job is not None:
+                try:
+                    await self._deliver(job)
+                finally:
+                    self._queued -= 1
+                    set_relay_queue_depth(self._queued)
+            slots.popleft()
+
+    async def _deliver(self, job: _Job) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await job.bot.copy_message(chat_id=job.to_chat_id, from_chat_id=job.from_chat_id, message_id=job.message_id)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                inc_relay("retried")
+                logger.warning("relay to %s failed (attempt %d): %s", job.to_chat_id, attempt, e)
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+            except TelegramAPIError as e:
+                # partner blocked the bot, message can't be copied, flood waits the send
+                # scheduler already retried, ...: retrying here won't help
+                inc_relay("failed")
+                logger.info("relay to %s dropped: %s", job.to_chat_id, e)
+                return False
+            except Exception as e:
+                inc_relay("failed")
+                logger.exception("relay to %s failed: %s", job.to_chat_id, e)
+                return False
+            inc_relay("sent")
+            observe_relay(time.monotonic() - job.queued_at)
+            return True
+        inc_relay("failed")
+        return False
+
+
+relay_pipeline = RelayPipeline()
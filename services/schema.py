@@ -0,0 +1,81 @@
+# src/services/schema.py
+import asyncio
+import logging
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import DBAPIError
+
+from services.database import engine, init_db
+
+logger = logging.getLogger("schema")
+
+# Alembic head the models in services/database.py correspond to; bump it with every new
+# migration (migrate() refuses to run when it disagrees with alembic/versions)
+SCHEMA_REVISION = "0004"
+ALEMBIC_DIR = Path(__file__).resolve().parent.parent / "alembic"
+
+
+async def current_revision() -> Optional[str]:
+    """
+    The database's alembic_version stamp, None if it has never been stamped.
+    """
+    async with engine.connect() as conn:
+        try:
+            return (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar()
+        except DBAPIError:
+            return None
+
+
+async def _is_empty() -> bool:
+    async with engine.connect() as conn:
+        return not await conn.run_sync(lambda c: inspect(c).get_table_names())
+
+
+def _alembic_config():
+    from alembic.config import Config
+    # no ini file on purpose: env.py would otherwise reset this process's logging config
+    cfg = Config()
+    cfg.set_main_option("script_location", str(ALEMBIC_DIR))
+    return cfg
+
+
+async def migrate() -> None:
+    """
+    create_all (migrations assume the base tables exist), then alembic upgrade head.
+    The migrations skip whatever create_all already made, so this also adopts databases
+    that were created before they were stamped.
+    """
+    from alembic import command
+    from alembic.script import ScriptDirectory
+    cfg = _alembic_config()
+    head = ScriptDirectory.from_config(cfg).get_current_head()
+    if head != SCHEMA_REVISION:
+        raise RuntimeError(f"alembic head is {head} but SCHEMA_REVISION is {SCHEMA_REVISION}; update services/schema.py")
+    await init_db()
+    # env.py runs the migration in its own event loop, so keep it off this one
+    await asyncio.to_thread(command.upgrade, cfg, "head")
+
+
+async def ensure_schema(migrate_if_needed: bool = False) -> str:
+    """
+    Check the schema before serving. The usual case is one query for the alembic stamp,
+    no reflection or create_all. An empty database is created and stamped right away; any
+    other mismatch only migrates with migrate_if_needed (bot.py --migrate), otherwise raises.
+    Returns "current", "created" or "migrated".
+    """
+    revision = await current_revision()
+    if revision == SCHEMA_REVISION:
+        return "current"
+    if revision is None and await _is_empty():
+        await migrate()
+        return "created"
+    if not migrate_if_needed:
+        raise RuntimeError(
+            f"database schema is at {revision or 'an unstamped revision'}, this code needs {SCHEMA_REVISION}; "
+            "run `python bot.py --migrate` (or `alembic upgrade head`)"
+        )
+    logger.info("Migrating schema %s -> %s", revision, SCHEMA_REVISION)
+    await migrate()
+    return "migrated"
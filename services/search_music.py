@@ -1,4 +1,3 @@
-import requests
 import asyncio
 
 async def search_musicbrainz(title: str, artist: str = ""):
@@ -7,6 +6,7 @@ async def search_musicbrainz(title: str, artist: str = ""):
     """
     url = f"https://musicbrainz.org/ws/2/recording/?query={title}&fmt=json"
     def req():
+        import requests
         res = requests.get(url)
         if res.status_code == 200:
             data = res.json()
@@ -33,6 +33,7 @@ async def search_lastfm(api_key: str, title: str, artist: str = ""):
         "format": "json"
     }
     def req():
+        import requests
         res = requests.get(url, params=params)
         if res.status_code == 200:
             results = res.json()
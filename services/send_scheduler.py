@@ -0,0 +1,232 @@
+# src/services/send_scheduler.py
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_PER_MINUTE, SEND_MAX_RETRIES
+from services.telemetry import set_outbound_queue_depth, observe_outbound_wait, inc_outbound_retry_after
+
+logger = logging.getLogger("send_scheduler")
+
+# priority classes, most urgent first
+RELAY, REPLY, BROADCAST = 0, 1, 2
+PRIORITY_NAMES = ("relay", "reply", "broadcast")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("send_priority", default=REPLY)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """
+    Sends made inside the block (by this task) are scheduled with `priority`.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        Seconds until one token is available (0 if it is now).
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle_full(self, now: float) -> bool:
+        return self.paused_until <= now and self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+
+class _Request:
+    __slots__ = ("future", "queued_at")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Paces everything the bot sends to chats (sendX, copyMessage, forwardMessage, editX)
+    under Telegram's flood limits: a global token bucket, one per private chat and a slower
+    one per group. Waiting sends are granted by priority class (relay > reply > broadcast).
+    Within a class each chat has its own FIFO, and chats with something queued sit in a
+    heap keyed by when their bucket next has a token, so a grant costs O(log chats) however
+    long the backlog is. A 429 pauses that chat's bucket for retry_after and the request is
+    retried, up to max_retries, so callers only see the error when Telegram keeps refusing.
+
+    Installed as a request middleware on the bot's session (install()), so message.answer,
+    bot.send_* and the relay all go through it without changes; use send_priority() to
+    mark a lower or higher class.
+    """
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: int = SEND_CHAT_BURST, group_per_minute: float = SEND_GROUP_PER_MINUTE,
+                 max_retries: int = SEND_MAX_RETRIES, max_buckets: int = 100_000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.group_burst = max(1, int(group_per_minute / 4))
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # per class: chat_id -> FIFO of waiting sends, and a heap of (ready_at, seq, chat_id)
+        # holding one entry per chat with a non-empty FIFO
+        self._fifos: List[Dict[int, Deque[_Request]]] = [{} for _ in PRIORITY_NAMES]
+        self._ready: List[List[Tuple[float, int, int]]] = [[] for _ in PRIORITY_NAMES]
+        self._depths = [0] * len(PRIORITY_NAMES)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def install(self, bot: Bot) -> None:
+        bot.session.middleware(self)
+
+    @staticmethod
+    def is_send(method: TelegramMethod) -> bool:
+        name = method.__api_method__
+        return name.startswith(("send", "copy", "forward", "edit")) and name != "sendChatAction"
+
+    async def __call__(self, make_request, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if not self.is_send(method) or not isinstance(chat_id, int):
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, _priority.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                inc_outbound_retry_after(method.__api_method__)
+                self._bucket(chat_id).pause(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                logger.info("%s to %s hit flood control; retrying in %ss", method.__api_method__, chat_id, e.retry_after)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            group = chat_id < 0
+            bucket = TokenBucket(self.group_rate if group else self.chat_rate,
+                                 self.group_burst if group else self.chat_burst)
+            self._buckets[chat_id] = bucket
+            # a full, unpaused bucket is the same as a new one, so dropping it loses nothing;
+            # stop at the first busy one (the map may briefly overshoot rather than scan)
+            now = time.monotonic()
+            while len(self._buckets) > self.max_buckets:
+                oldest = next(iter(self._buckets))
+                if oldest == chat_id or not self._buckets[oldest].idle_full(now):
+                    break
+                del self._buckets[oldest]
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int, priority: int = REPLY) -> None:
+        """
+        Wait until a message to chat_id may go out.
+        """
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._dispatch(), name="send-scheduler")
+        req = _Request(loop.create_future())
+        fifo = self._fifos[priority].get(chat_id)
+        if fifo is None:
+            fifo = self._fifos[priority][chat_id] = deque()
+            # the real wait is worked out when the entry reaches the top of the heap
+            heapq.heappush(self._ready[priority], (req.queued_at, next(self._seq), chat_id))
+        fifo.append(req)
+        self._depths[priority] += 1
+        self._publish_depth()
+        self._wakeup.set()
+        await req.future
+
+    def _publish_depth(self) -> None:
+        for name, n in zip(PRIORITY_NAMES, self._depths):
+            set_outbound_queue_depth(name, n)
+
+    def _grant_next(self, now: float) -> Optional[float]:
+        """
+        Grant the most urgent request that can go now; otherwise return how long until one can
+        (None when nothing is waiting).
+        """
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            return wait if any(self._depths) else None
+        for priority, heap in enumerate(self._ready):
+            fifos = self._fifos[priority]
+            while heap and heap[0][0] <= now:
+                _, seq, chat_id = heapq.heappop(heap)
+                fifo = fifos[chat_id]
+                while fifo and fifo[0].future.done():  # callers that gave up
+                    fifo.popleft()
+                    self._depths[priority] -= 1
+                if not fifo:
+                    del fifos[chat_id]
+                    continue
+                bucket = self._bucket(chat_id)
+                chat_wait = bucket.delay(now)
+                if chat_wait > 0:
+                    # paused or out of tokens since it was queued: requeue at its real time
+                    heapq.heappush(heap, (now + chat_wait, seq, chat_id))
+                    continue
+                req = fifo.popleft()
+                self._depths[priority] -= 1
+                self.global_bucket.take()
+                bucket.take()
+                req.future.set_result(None)
+                observe_outbound_wait(now - req.queued_at)
+                if fifo:
+                    heapq.heappush(heap, (now + bucket.delay(now), next(self._seq), chat_id))
+                else:
+                    del fifos[chat_id]
+                return 0.0
+        tops = [heap[0][0] for heap in self._ready if heap]
+        return max(0.0, min(tops) - now) if tops else None
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wakeup.clear()
+            wait = self._grant_next(time.monotonic())
+            if wait == 0:
+                self._publish_depth()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+send_scheduler = SendScheduler()
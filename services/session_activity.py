@@ -0,0 +1,63 @@
+# src/services/session_activity.py
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Tuple, Optional
+from services.database import touch_sessions
+
+logger = logging.getLogger("session_activity")
+
+
+class ActivityTracker:
+    """
+    Coalesces chat activity in memory: touch() only records the latest timestamp per user pair,
+    and run() writes everything seen since the last flush in one bulk UPDATE at most every
+    flush_seconds (sooner if max_pending pairs pile up). Activity is therefore at most
+    flush_seconds stale in chat_sessions.last_activity.
+    """
+
+    def __init__(self, flush_seconds: float = 15.0, max_pending: int = 5000):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending: Dict[Tuple[int, int], datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def touch(self, user_id: int, partner_id: int) -> None:
+        key = (user_id, partner_id) if user_id < partner_id else (partner_id, user_id)
+        self._pending[key] = datetime.now(timezone.utc)
+        if len(self._pending) >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        try:
+            await touch_sessions([(a, b, seen) for (a, b), seen in batch.items()])
+        except Exception:
+            # keep the newest timestamp per pair for the next attempt
+            for key, seen in batch.items():
+                if self._pending.get(key, seen) <= seen:
+                    self._pending[key] = seen
+            raise
+        return len(batch)
+
+    async def run(self) -> None:
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.exception("session activity flush failed: %s", e)
+        finally:
+            # final flush on shutdown
+            await self.flush()
+
+
+activity_tracker = ActivityTracker()
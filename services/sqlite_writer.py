@@ -0,0 +1,139 @@
+# src/services/sqlite_writer.py
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger("sqlite_writer")
+
+
+class _Turn:
+    __slots__ = ("granted", "finished", "committed")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.granted: "asyncio.Future[AsyncSession]" = loop.create_future()
+        self.finished: "asyncio.Future[Optional[BaseException]]" = loop.create_future()
+        self.committed: "asyncio.Future[None]" = loop.create_future()
+
+
+class SQLiteWriter:
+    """
+    Serializes every write transaction onto one connection owned by a single task.
+
+    Callers queue for a turn (see turn()); the writer lends them its session inside a SAVEPOINT,
+    waits for their block to finish, then serves the next caller in the same transaction.
+    The transaction commits once the queue is empty or max_batch turns ran, so a burst of
+    small writes costs one fsync instead of one each (group commit). A turn that raises only
+    rolls back its own savepoint. Each turn starts with an empty identity map, so objects an
+    earlier turn loaded are read again. turn() returns after the batch holding it has committed.
+    """
+
+    def __init__(self, session_factory, max_batch: int = 64):
+        self._factory = session_factory
+        self.max_batch = max_batch
+        self.batches = 0
+        self.turns = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_running(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(), name="sqlite-writer")
+        return loop
+
+    async def close(self):
+        """
+        Stop the writer task; call once no more turns are queued.
+        """
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    @asynccontextmanager
+    async def turn(self):
+        loop = self._ensure_running()
+        job = _Turn(loop)
+        self._queue.put_nowait(job)
+        try:
+            session = await job.granted
+        except BaseException as e:
+            # cancelled right after being granted: hand the turn back or the writer waits forever
+            if job.granted.done() and not job.granted.cancelled():
+                job.finished.set_result(e)
+            raise
+        try:
+            yield session
+            # flush here so constraint errors surface in the caller, like a normal commit would
+            await session.flush()
+        except BaseException as e:
+            job.finished.set_result(e)
+            raise
+        job.finished.set_result(None)
+        await job.committed
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            done: List[_Turn] = []
+            try:
+                async with self._factory() as session:
+                    await session.begin()
+                    while True:
+                        if await self._serve(session, job):
+                            done.append(job)
+                        if len(done) >= self.max_batch or self._queue.empty():
+                            break
+                        job = self._queue.get_nowait()
+                    await session.commit()
+            except Exception as e:
+                logger.exception("sqlite writer batch failed: %s", e)
+                for j in done:
+                    if not j.committed.done():
+                        j.committed.set_exception(e)
+                # the job being served when it failed (e.g. SQLITE_BUSY on BEGIN IMMEDIATE,
+                # or in begin_nested) is not in done yet; its caller must not wait forever
+                if not job.granted.done():
+                    job.granted.set_exception(e)
+                elif not job.committed.done():
+                    job.committed.set_exception(e)
+                continue
+            self.batches += 1
+            self.turns += len(done)
+            for j in done:
+                if not j.committed.done():
+                    j.committed.set_result(None)
+
+    async def _serve(self, session: AsyncSession, job: _Turn) -> bool:
+        """
+        Run one caller's block in a savepoint; True if it should be committed with the batch.
+        """
+        if job.granted.cancelled():
+            return False  # caller went away while queued
+        # turns share the session, and Core UPDATE/DELETEs bypass its identity map: without
+        # this a caller could get() an object as an earlier turn left it, not as the row is.
+        # Detach rather than expire, so earlier callers can still read what they loaded.
+        session.expunge_all()
+        sp = await session.begin_nested()
+        job.granted.set_result(session)
+        err = await job.finished
+        if err is None:
+            try:
+                if sp.is_active:
+                    await sp.commit()
+                return True
+            except Exception as e:
+                job.committed.set_exception(e)
+        # also needed when a failed flush already deactivated the savepoint
+        await sp.rollback()
+        session.expunge_all()
+        return False
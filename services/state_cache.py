@@ -0,0 +1,132 @@
+# src/services/state_cache.py
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from redis.asyncio import Redis
+from config import STATE_CACHE_BACKEND, STATE_CACHE_TTL, STATE_CACHE_MAX_USERS
+from services.cache import get_redis
+from services.telemetry import inc_state_cache
+
+State = Tuple[str, Optional[int]]
+
+
+class LocalStateCache:
+    """
+    In-process (status, partner_id) per user, bounded LRU. Entries expire after `ttl` seconds,
+    which bounds how long a write made by another replica can go unseen.
+
+    Writers put() the new state (or invalidate(), which leaves a tombstone for `ttl`);
+    readers that missed fill() what they loaded only if nothing was written meanwhile, so
+    a read that started before a write can't overwrite it with the old state.
+    """
+
+    def __init__(self, ttl: int = STATE_CACHE_TTL, max_users: int = STATE_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.hits = 0
+        self.misses = 0
+        # None marks an invalidated user (tombstone)
+        self._states: "OrderedDict[int, Tuple[float, Optional[State]]]" = OrderedDict()
+
+    async def get(self, user_id: int) -> Optional[State]:
+        hit = self._states.get(user_id)
+        if hit is not None and hit[1] is not None and hit[0] > time.monotonic():
+            self._states.move_to_end(user_id)
+            self.hits += 1
+            inc_state_cache(True)
+            return hit[1]
+        self.misses += 1
+        inc_state_cache(False)
+        return None
+
+    def _store(self, user_id: int, state: Optional[State]) -> None:
+        self._states[user_id] = (time.monotonic() + self.ttl, state)
+        self._states.move_to_end(user_id)
+        while len(self._states) > self.max_users:
+            self._states.popitem(last=False)
+
+    async def put(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        self._store(user_id, (status, partner_id))
+
+    async def fill(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        hit = self._states.get(user_id)
+        if hit is None or hit[0] <= time.monotonic():
+            self._store(user_id, (status, partner_id))
+
+    async def invalidate(self, *user_ids: int) -> None:
+        for uid in user_ids:
+            self._store(uid, None)
+
+
+class RedisStateCache:
+    """
+    (status, partner_id) per user in Redis, shared by all replicas, so a chat ended on one
+    replica is seen by the relay on every other one immediately. Same put/fill/invalidate
+    contract as LocalStateCache: fill is a SET NX and invalidate writes an empty tombstone,
+    so a reader on any replica can't overwrite a newer write.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, ttl: int = STATE_CACHE_TTL, prefix: str = "state:"):
+        self._redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    async def get(self, user_id: int) -> Optional[State]:
+        raw = await self.redis.get(f"{self.prefix}{user_id}")
+        if not raw:
+            self.misses += 1
+            inc_state_cache(False)
+            return None
+        self.hits += 1
+        inc_state_cache(True)
+        status, _, partner = raw.partition("|")
+        return (status, int(partner) if partner else None)
+
+    async def put(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        await self.redis.set(f"{self.prefix}{user_id}", f"{status}|{partner_id or ''}", ex=self.ttl)
+
+    async def fill(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        await self.redis.set(f"{self.prefix}{user_id}", f"{status}|{partner_id or ''}", ex=self.ttl, nx=True)
+
+    async def invalidate(self, *user_ids: int) -> None:
+        if user_ids:
+            pipe = self.redis.pipeline(transaction=False)
+            for uid in user_ids:
+                pipe.set(f"{self.prefix}{uid}", "", ex=self.ttl)
+            await pipe.execute()
+
+
+class NullStateCache:
+    hits = 0
+    misses = 0
+
+    async def get(self, user_id: int) -> Optional[State]:
+        return None
+
+    async def put(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        pass
+
+    async def fill(self, user_id: int, status: str, partner_id: Optional[int]) -> None:
+        pass
+
+    async def invalidate(self, *user_ids: int) -> None:
+        pass
+
+
+def _make_cache():
+    if STATE_CACHE_BACKEND == "redis":
+        return RedisStateCache()
+    if STATE_CACHE_BACKEND == "memory":
+        return LocalStateCache()
+    return NullStateCache()
+
+
+user_state = _make_cache()
@@ -1,5 +1,6 @@
 import os
-from prometheus_client import Counter, Gauge
+from typing import Dict, Tuple, Optional
+from prometheus_client import Counter, Gauge, Histogram
 
 PROMETHEUS_ENABLED = os.getenv("PROMETHEUS_ENABLED", "false").lower() in {"1","true","yes"}
 
@@ -8,15 +9,70 @@ queue_length = Gauge("queue_length", "Current queue length for matching")
 active_sessions = Gauge("active_sessions", "Number of active chat sessions")
 likes_total = Counter("likes_total", "Total likes processed")
 fav_requests_total = Counter("fav_requests_total", "Total favorite requests processed")
+match_wait_seconds = Histogram(
+    "match_wait_seconds", "Time from entering the search queue to being matched",
+    buckets=(0.05, 0.25, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+state_cache_requests = Counter("state_cache_requests_total", "User state cache lookups", ["result"])
+db_pool_checkout_seconds = Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the DB pool", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+queue_depth = Gauge("queue_depth", "Searchers waiting per (gender, province, city) bucket", ["gender", "province", "city"])
+archived_rows = Counter("archived_rows_total", "Rows moved out of hot tables by the archiver", ["table"])
+relay_queue_depth = Gauge("relay_queue_depth", "Chat messages accepted for relay and not yet delivered")
+relay_latency_seconds = Histogram(
+    "relay_latency_seconds", "Time from accepting a chat message to delivering its copy to the partner",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+relay_messages = Counter("relay_messages_total", "Relayed chat messages by outcome", ["result"])
+outbound_queue_depth = Gauge("outbound_queue_depth", "Sends waiting for a flood-limit token", ["priority"])
+outbound_wait_seconds = Histogram(
+    "outbound_wait_seconds", "Time a send waited in the outbound scheduler",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+outbound_retry_after = Counter("outbound_retry_after_total", "429 responses from Telegram", ["method"])
+webhook_inflight = Gauge("webhook_inflight", "Webhook updates being processed")
+webhook_updates = Counter("webhook_updates_total", "Webhook requests by outcome", ["result"])
+partitioned_updates = Counter("partitioned_updates_total", "Updates appended to the update stream", ["partition"])
+update_lag_seconds = Histogram(
+    "update_lag_seconds", "Time an update waited in the update stream before being handled",
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+rate_limited = Counter("rate_limited_total", "Updates dropped by the anti-flood limiter", ["policy"])
 
 def inc_match():
     if PROMETHEUS_ENABLED:
         matches_total.inc()
 
+def observe_match(*wait_seconds: float):
+    """
+    One successful match; records the time-to-match of each matched user.
+    """
+    if PROMETHEUS_ENABLED:
+        matches_total.inc()
+        for w in wait_seconds:
+            match_wait_seconds.observe(max(0.0, w))
+
+def inc_state_cache(hit: bool):
+    if PROMETHEUS_ENABLED:
+        state_cache_requests.labels("hit" if hit else "miss").inc()
+
+def observe_db_checkout(engine: str, seconds: float):
+    if PROMETHEUS_ENABLED:
+        db_pool_checkout_seconds.labels(engine).observe(seconds)
+
 def set_queue_length(n: int):
     if PROMETHEUS_ENABLED:
         queue_length.set(n)
 
+def set_queue_depths(depths: Dict[Tuple[Optional[str], Optional[str], Optional[str]], int]):
+    if PROMETHEUS_ENABLED:
+        queue_depth.clear()
+        for (g, p, c), n in depths.items():
+            queue_depth.labels(g or "-", p or "-", c or "-").set(n)
+        queue_length.set(sum(depths.values()))
+
 def set_active_sessions(n: int):
     if PROMETHEUS_ENABLED:
         active_sessions.set(n)
@@ -29,4 +85,50 @@ def inc_fav_requests(n: int = 1):
     if PROMETHEUS_ENABLED:
         fav_requests_total.inc(n)
 
+def inc_archived(table: str, n: int):
+    if PROMETHEUS_ENABLED:
+        archived_rows.labels(table).inc(n)
+
+def set_relay_queue_depth(n: int):
+    if PROMETHEUS_ENABLED:
+        relay_queue_depth.set(n)
+
+def observe_relay(seconds: float):
+    if PROMETHEUS_ENABLED:
+        relay_latency_seconds.observe(seconds)
+
+def inc_relay(result: str):
+    if PROMETHEUS_ENABLED:
+        relay_messages.labels(result).inc()
 
+def set_outbound_queue_depth(priority: str, n: int):
+    if PROMETHEUS_ENABLED:
+        outbound_queue_depth.labels(priority).set(n)
+
+def observe_outbound_wait(seconds: float):
+    if PROMETHEUS_ENABLED:
+        outbound_wait_seconds.observe(seconds)
+
+def inc_outbound_retry_after(method: str):
+    if PROMETHEUS_ENABLED:
+        outbound_retry_after.labels(method).inc()
+
+def inc_rate_limited(policy: str):
+    if PROMETHEUS_ENABLED:
+        rate_limited.labels(policy).inc()
+
+def set_webhook_inflight(n: int):
+    if PROMETHEUS_ENABLED:
+        webhook_inflight.set(n)
+
+def inc_webhook_update(result: str):
+    if PROMETHEUS_ENABLED:
+        webhook_updates.labels(result).inc()
+
+def inc_partitioned_update(partition: str):
+    if PROMETHEUS_ENABLED:
+        partitioned_updates.labels(partition).inc()
+
+def observe_update_lag(seconds: float):
+    if PROMETHEUS_ENABLED:
+        update_lag_seconds.observe(seconds)
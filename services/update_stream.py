@@ -0,0 +1,149 @@
+# src/services/update_stream.py
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError, TelegramRetryAfter
+from redis.asyncio import Redis
+from config import (
+    UPDATE_PARTITIONS, UPDATE_STREAM_MAXLEN, FSM_STORAGE, MATCH_BACKEND, STATE_CACHE_BACKEND, RATE_LIMIT_BACKEND,
+)
+from services.cache import get_redis
+from services.telemetry import inc_partitioned_update
+
+logger = logging.getLogger("update_stream")
+
+
+def check_partitioned_config(partitions: int = UPDATE_PARTITIONS) -> None:
+    """
+    With several partitions, a user's chat partner (and everyone they could be matched
+    with) is usually handled by another process, so nothing per-user may live in process
+    memory. Raises RuntimeError listing the settings that would.
+    """
+    if partitions <= 1:
+        return
+    problems = []
+    if FSM_STORAGE != "redis":
+        problems.append("FSM_STORAGE=redis")
+    if MATCH_BACKEND != "redis":
+        problems.append("MATCH_BACKEND=redis (a private match queue per worker can't pair across partitions)")
+    if STATE_CACHE_BACKEND not in ("redis", "off"):
+        problems.append("STATE_CACHE_BACKEND=redis or off (a chat ended in one worker stays cached in the others)")
+    if RATE_LIMIT_BACKEND not in ("redis", "off"):
+        problems.append("RATE_LIMIT_BACKEND=redis or off")
+    if problems:
+        raise RuntimeError(f"UPDATE_PARTITIONS={partitions} needs " + "; ".join(problems))
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    The user an update comes from (message.from, callback_query.from, ...), falling back to
+    the chat; None for updates that have neither (e.g. poll).
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        who = event.get("from") or event.get("user") or event.get("chat")
+        if isinstance(who, dict) and "id" in who:
+            return int(who["id"])
+    return None
+
+
+def partition_of(update: Dict[str, Any], partitions: int = UPDATE_PARTITIONS) -> int:
+    user_id = update_user_id(update)
+    return user_id % partitions if user_id is not None else 0
+
+
+class UpdateStream:
+    """
+    Incoming updates split into `partitions` Redis streams by sender, so every update of a
+    user lands on the same stream and is handled, in arrival order, by the one worker
+    process that owns it (services/worker/update_worker.py). Streams are capped at about
+    `maxlen` entries; past that the oldest are dropped.
+    """
+
+    def __init__(self, partitions: int = UPDATE_PARTITIONS, redis: Optional[Redis] = None,
+                 prefix: str = "updates:", maxlen: int = UPDATE_STREAM_MAXLEN):
+        self.partitions = partitions
+        self._redis = redis
+        self.prefix = prefix
+        self.maxlen = maxlen
+        self.group = "workers"
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def key(self, partition: int) -> str:
+        return f"{self.prefix}{partition}"
+
+    async def publish(self, update: Dict[str, Any]) -> None:
+        partition = partition_of(update, self.partitions)
+        await self.redis.xadd(self.key(partition), {"u": json.dumps(update, ensure_ascii=False)},
+                              maxlen=self.maxlen, approximate=True)
+        inc_partitioned_update(str(partition))
+
+    async def ensure_group(self, partition: int) -> None:
+        try:
+            await self.redis.xgroup_create(self.key(partition), self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read(self, partition: int, pending: bool, count: int, block_ms: int) -> List:
+        """
+        [(entry_id, update)] for this partition's worker: its own unacknowledged entries
+        (left by a crash) when `pending`, new ones otherwise.
+        """
+        rows = await self.redis.xreadgroup(
+            self.group, f"partition-{partition}", {self.key(partition): "0" if pending else ">"},
+            count=count, block=None if pending else block_ms,
+        )
+        if not rows:
+            return []
+        return [(entry_id, json.loads(fields["u"])) for entry_id, fields in rows[0][1]]
+
+    async def ack(self, partition: int, entry_id: str) -> None:
+        await self.redis.xack(self.key(partition), self.group, entry_id)
+
+
+async def poll_into(bot: Bot, stream: UpdateStream, allowed_updates: List[str], timeout: int = 30) -> None:
+    """
+    Long polling for a front process that does not handle updates itself: everything
+    getUpdates returns goes to the stream, and the offset only moves past an update once
+    it has been published. If publishing fails (Redis down) the rest of the batch is kept
+    and retried with backoff; getUpdates is not called again until it is through.
+    """
+    offset = None
+    backlog: list = []
+    failures = 0
+    while True:
+        if not backlog:
+            try:
+                backlog = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                                request_timeout=timeout + 10)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(5)
+                continue
+        while backlog:
+            update = backlog[0]
+            try:
+                await stream.publish(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            except Exception as e:
+                failures += 1
+                logger.warning("publishing update %s failed (attempt %d): %s", update.update_id, failures, e)
+                await asyncio.sleep(min(2 ** failures, 30))
+                break
+            failures = 0
+            backlog.pop(0)
+            offset = update.update_id + 1
+
+
+update_stream = UpdateStream()
@@ -1,6 +1,3 @@
-import requests
-import os
-
 import os
 
 GOOGLE_DRIVE_TOKEN = os.getenv("GOOGLE_DRIVE_TOKEN", "TOKEN")
@@ -28,6 +25,7 @@ async def upload_file(file_path: str) -> str:
 
 def upload_google_drive(file_path: str) -> str:
     """آپلود در گوگل درایو (نیاز به توکن معتبر دارد)"""
+    import requests
     headers = {"Authorization": f"Bearer {GOOGLE_DRIVE_TOKEN}"}
     metadata = {"name": os.path.basename(file_path)}
     files = {
@@ -48,6 +46,7 @@ def upload_google_drive(file_path: str) -> str:
 
 def upload_dropbox(file_path: str) -> str:
     """آپلود در دراپ‌باکس (نیاز به توکن معتبر دارد)"""
+    import requests
     headers = {
         "Authorization": f"Bearer {DROPBOX_TOKEN}",  # اصلاح تایپ Athorization
         "Dropbox-API-Arg": f'{{"path": "/{os.path.basename(file_path)}","mode":"add","autorename":true,"mute":false}}',
@@ -65,6 +64,7 @@ def upload_dropbox(file_path: str) -> str:
 
 def upload_gofile(file_path: str) -> str:
     """آپلود در gofile.io (بدون نیاز به اکانت)"""
+    import requests
     with open(file_path, "rb") as f:
         files = {"file": f}
         response = requests.post("https://store1.gofile.io/uploadFile", files=files)
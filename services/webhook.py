@@ -0,0 +1,182 @@
+# src/services/webhook.py
+import asyncio
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from redis.asyncio import Redis
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_MAX_INFLIGHT, WEBHOOK_DEDUP_BACKEND, WEBHOOK_DEDUP_TTL,
+)
+from services.cache import get_redis
+from services.telemetry import set_webhook_inflight, inc_webhook_update
+
+logger = logging.getLogger("webhook")
+
+
+class LocalUpdateDedup:
+    """
+    update_ids seen by this process in the last `ttl` seconds, bounded LRU.
+    """
+
+    def __init__(self, ttl: int = WEBHOOK_DEDUP_TTL, max_ids: int = 100_000):
+        self.ttl = ttl
+        self.max_ids = max_ids
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    async def first_seen(self, update_id: int) -> bool:
+        now = time.monotonic()
+        while self._seen:
+            oldest = next(iter(self._seen))
+            if len(self._seen) < self.max_ids and self._seen[oldest] > now:
+                break
+            del self._seen[oldest]
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = now + self.ttl
+        return True
+
+    async def forget(self, update_id: int) -> None:
+        self._seen.pop(update_id, None)
+
+
+class RedisUpdateDedup:
+    """
+    update_ids seen by any web worker, one SET NX per update, so a redelivery that lands on
+    another worker behind the load balancer is still dropped.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, ttl: int = WEBHOOK_DEDUP_TTL, prefix: str = "update:"):
+        self._redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    async def first_seen(self, update_id: int) -> bool:
+        return bool(await self.redis.set(f"{self.prefix}{update_id}", 1, ex=self.ttl, nx=True))
+
+    async def forget(self, update_id: int) -> None:
+        await self.redis.delete(f"{self.prefix}{update_id}")
+
+
+def _make_dedup():
+    if WEBHOOK_DEDUP_BACKEND == "redis":
+        return RedisUpdateDedup()
+    return LocalUpdateDedup()
+
+
+class WebhookServer:
+    """
+    Receives updates from Telegram over HTTP. Each POST is checked against the secret
+    token, deduplicated by update_id (Telegram redelivers whatever it did not get a 200 for)
+    and handed to the dispatcher in a background task; the 200 goes back right away.
+    At most `max_inflight` updates are processed at once; past that the server answers 503
+    without recording the update, and Telegram retries it later.
+
+    Nothing is kept between requests except the dedup set, so with the Redis dedup backend
+    any number of workers can sit behind one load balancer. With `sink` set (e.g.
+    UpdateStream.publish) accepted updates are handed to it before answering instead of
+    being processed here, and a failed hand-off answers 500 so Telegram redelivers.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 max_inflight: int = WEBHOOK_MAX_INFLIGHT, dedup=None,
+                 sink: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.max_inflight = max_inflight
+        self.dedup = dedup if dedup is not None else _make_dedup()
+        self.sink = sink
+        self._tasks: Set[asyncio.Task] = set()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        app.on_shutdown.append(self._drain)
+        return app
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"inflight": len(self._tasks)})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.secret
+        ):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+            update_id = int(update["update_id"])
+        except (ValueError, KeyError, TypeError):
+            inc_webhook_update("invalid")
+            return web.Response(status=400)
+        if len(self._tasks) >= self.max_inflight:
+            inc_webhook_update("busy")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        if not await self.dedup.first_seen(update_id):
+            inc_webhook_update("duplicate")
+            return web.Response()
+        if self.sink is not None:
+            try:
+                await self.sink(update)
+            except Exception as e:
+                await self.dedup.forget(update_id)
+                inc_webhook_update("failed")
+                logger.exception("handing off update %s failed: %s", update_id, e)
+                return web.Response(status=500)
+            inc_webhook_update("accepted")
+            return web.Response()
+        task = asyncio.create_task(self._process(update_id, update))
+        self._tasks.add(task)
+        set_webhook_inflight(len(self._tasks))
+        task.add_done_callback(self._done)
+        inc_webhook_update("accepted")
+        return web.Response()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        set_webhook_inflight(len(self._tasks))
+
+    async def _process(self, update_id: int, update: dict) -> None:
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            # the 200 is already sent, so Telegram won't redeliver; nothing to retry with
+            inc_webhook_update("failed")
+            logger.exception("update %s failed: %s", update_id, e)
+
+    async def _drain(self, app: web.Application, timeout: float = 30) -> None:
+        if self._tasks:
+            logger.info("waiting for %d in-flight updates", len(self._tasks))
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def run(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, url: str = WEBHOOK_URL) -> None:
+        """
+        Serve until cancelled. With `url` set, registers it with Telegram first; leave it
+        empty to run locally (e.g. to replay recorded updates with bench/webhook_replay.py).
+        """
+        if url:
+            await self.bot.set_webhook(
+                url.rstrip("/") + self.path, secret_token=self.secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=min(100, self.max_inflight),
+            )
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("webhook listening on %s:%s%s", host, port, self.path)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
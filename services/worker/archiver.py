@@ -0,0 +1,129 @@
+# src/services/worker/archiver.py
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import (
+    DATA_DIR, ARCHIVE_BACKEND, ARCHIVE_SESSIONS_DAYS, ARCHIVE_REPORTS_DAYS, ARCHIVE_ORDERS_DAYS,
+    ARCHIVE_BATCH, ARCHIVE_INTERVAL, ARCHIVE_PAUSE_SECONDS,
+)
+from services.database import move_to_archive, archive_candidates, delete_archived, get_archive_checkpoints, close_db
+from services.telemetry import inc_archived
+
+logger = logging.getLogger("archiver")
+
+RETENTION_DAYS = {
+    "chat_sessions": ARCHIVE_SESSIONS_DAYS,
+    "reports": ARCHIVE_REPORTS_DAYS,
+    "orders": ARCHIVE_ORDERS_DAYS,
+}
+ARCHIVE_DIR = DATA_DIR / "archive"
+
+
+def _json_value(v: Any) -> Any:
+    return v.isoformat() if isinstance(v, datetime) else str(v)
+
+
+def write_jsonl(name: str, rows: List[Dict[str, Any]], root: Path = ARCHIVE_DIR) -> Path:
+    """
+    Write one batch to <root>/<name>/<name>-<min id>-<max id>.jsonl.gz and fsync it.
+    Written to a temp file and renamed, so a file that exists is always complete; a batch
+    retried after a crash gets the same name and replaces it.
+    """
+    folder = root / name
+    folder.mkdir(parents=True, exist_ok=True)
+    ids = [r["id"] for r in rows]
+    path = folder / f"{name}-{min(ids):010d}-{max(ids):010d}.jsonl.gz"
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for row in rows:
+                gz.write(json.dumps(row, ensure_ascii=False, default=_json_value).encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+async def archive_table(name: str, days: int, backend: str = ARCHIVE_BACKEND, batch: int = ARCHIVE_BATCH,
+                        pause: float = ARCHIVE_PAUSE_SECONDS, max_batches: Optional[int] = None) -> int:
+    """
+    Archive everything in `name` older than `days`, one bounded batch at a time.
+    Each batch commits together with its checkpoint, so an interrupted run resumes with the
+    next batch. With the jsonl backend a crash between writing a file and deleting its rows
+    can write those rows again (at-least-once); dedupe by id when loading the files.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        if backend == "jsonl":
+            rows = await archive_candidates(name, cutoff, batch)
+            if not rows:
+                break
+            path = await asyncio.to_thread(write_jsonl, name, rows)
+            n = await delete_archived(name, [r["id"] for r in rows], cutoff, str(path))
+            full = len(rows) == batch and n > 0
+        else:
+            n = await move_to_archive(name, cutoff, batch)
+            full = n == batch
+        moved += n
+        batches += 1
+        inc_archived(name, n)
+        if not full:
+            break
+        await asyncio.sleep(pause)
+    return moved
+
+
+async def archive_once(backend: str = ARCHIVE_BACKEND, **kwargs) -> Dict[str, int]:
+    moved = {}
+    for name, days in RETENTION_DAYS.items():
+        if days > 0:
+            moved[name] = await archive_table(name, days, backend=backend, **kwargs)
+    return moved
+
+
+async def archive_loop(interval_seconds: int = ARCHIVE_INTERVAL, backend: str = ARCHIVE_BACKEND):
+    """
+    Every interval_seconds move rows past retention out of the hot tables.
+    """
+    try:
+        for name, cp in (await get_archive_checkpoints()).items():
+            logger.info("Archive %s: %d rows so far, up to id %d", name, cp["rows"], cp["last_id"])
+    except Exception as e:
+        logger.exception("reading archive checkpoints failed: %s", e)
+    while True:
+        try:
+            moved = await archive_once(backend=backend)
+            if any(moved.values()):
+                logger.info("Archived %s", ", ".join(f"{n} {name}" for name, n in moved.items() if n))
+        except Exception as e:
+            logger.exception("archiver error: %s", e)
+        await asyncio.sleep(interval_seconds)
+
+
+async def _archive_once_and_close(backend: str) -> Dict[str, int]:
+    try:
+        return await archive_once(backend=backend)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Move rows past retention out of the hot tables")
+    ap.add_argument("--backend", choices=["table", "jsonl"], default=ARCHIVE_BACKEND if ARCHIVE_BACKEND != "off" else "table")
+    ap.add_argument("--once", action="store_true", help="archive the current backlog and exit")
+    ap.add_argument("--interval", type=int, default=ARCHIVE_INTERVAL)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.once:
+        moved = asyncio.run(_archive_once_and_close(args.backend))
+        logger.info("Archived %s", ", ".join(f"{n} {name}" for name, n in moved.items()) or "nothing")
+    else:
+        asyncio.run(archive_loop(interval_seconds=args.interval, backend=args.backend))
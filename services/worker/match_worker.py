@@ -1,39 +1,128 @@
 # src/services/workers/match_worker.py
+import argparse
 import asyncio
 import logging
+import multiprocessing
+import time
 from typing import Optional
 
-from services.matcher import enqueue_search
+from config import MATCH_BACKEND, MATCH_SHARDS
+from services.matcher import match_batch, release_lost_searchers
+from services.match_queue import match_queue, ShardedMatchQueue
 from services.database import AsyncSessionLocal, User
+from services.telemetry import set_queue_depths
 from sqlalchemy import select
 
 logger = logging.getLogger("match_worker")
 logger.setLevel(logging.INFO)
 
 
-async def scan_and_match_loop(interval_seconds: int = 2):
+async def _release_lost(limit: int) -> int:
+    # searchers in the DB whose ticket the queue no longer has (e.g. after a Redis restart)
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            select(User.id, User.search_started_at)
+            .where(User.status == "searching").order_by(User.search_started_at).limit(limit)
+        )
+        rows = res.all()
+    queued = await match_queue.get_many([uid for uid, _ in rows])
+    released = await release_lost_searchers([(uid, started) for uid, started in rows if uid not in queued])
+    if released:
+        logger.info("Released %d searchers the match queue lost", released)
+    return released
+
+
+async def scan_and_match_loop(interval_seconds: int = 30, batch: bool = True, window: int = 500, metrics_seconds: int = 10, shard: Optional[int] = None):
     """
     Background loop: scan for users in 'searching' and try to match them pairwise.
     This is a fallback worker — ideally matching is immediate in enqueue_search,
     but this ensures eventual pairing.
+    With batch=True each pass pairs a whole window of searchers in one transaction
+    (see matcher.match_batch); batch=False leaves matching to enqueue_search and only
+    releases searchers the queue lost.
+    Between passes the worker sleeps until someone enqueues (asyncio event in-process,
+    Redis pub/sub across replicas); interval_seconds is only the fallback rescan period.
+    Per-bucket queue depths are exported at most every metrics_seconds.
+    With `shard` set the loop only pairs searchers in that shard's pool (see run_sharded).
     """
+    queue = match_queue.shards[shard] if shard is not None else match_queue
+    last_metrics = 0.0
     while True:
+        pairs = 0
         try:
-            # fetch a list of searching users (small batch)
-            async with AsyncSessionLocal() as session:
-                async with session.begin():
-                    res = await session.execute(select(User.id).where(User.status == "searching").limit(50))
-                    ids = [r for r in res.scalars().all()]
-
-            # try to match each id (best-effort)
-            for uid in ids:
-                # call matcher; it will try to find a candidate and match atomically
-                partner = await enqueue_search(uid)
-                if partner:
-                    logger.info(f"Worker matched {uid} <-> {partner}")
-                await asyncio.sleep(0)  # yield control
+            started = time.perf_counter()
+            if batch:
+                pairs = await match_batch(window=window, queue=queue if shard is not None else None)
+            else:
+                await _release_lost(limit=500)
+            elapsed = time.perf_counter() - started
+            if pairs:
+                logger.info("Worker matched %d pairs in %.3fs (%.1f pairs/s)", pairs, elapsed, pairs / max(elapsed, 1e-6))
+            if time.monotonic() - last_metrics >= metrics_seconds:
+                last_metrics = time.monotonic()
+                set_queue_depths(await queue.bucket_depths())
 
         except Exception as e:
             logger.exception("Error in match_worker loop: %s", e)
 
+        # a full window may have left more pairable searchers behind; rescan right away
+        if batch and pairs * 2 >= window:
+            await asyncio.sleep(0)
+            continue
+        await queue.wait_for_enqueue(timeout=interval_seconds)
+
+
+def _shard_main(shard: int, interval_seconds: int, window: int):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(scan_and_match_loop(interval_seconds=interval_seconds, window=window, shard=shard))
+
+
+async def _coordinator_loop(interval_seconds: int):
+    """
+    Release searchers that are only in the DB (their ticket was lost, e.g. by a Redis
+    restart); shard workers only ever look at their own pool.
+    """
+    while True:
+        try:
+            await _release_lost(limit=500)
+        except Exception as e:
+            logger.exception("Error in match coordinator: %s", e)
         await asyncio.sleep(interval_seconds)
+
+
+def run_sharded(shards: int = MATCH_SHARDS, interval_seconds: int = 30, window: int = 500):
+    """
+    Run one match worker process per shard of the Redis searcher pool plus a coordinator in
+    this process. Routing of searchers to shards happens at enqueue time (ShardedMatchQueue).
+    """
+    if MATCH_BACKEND != "redis" or not isinstance(match_queue, ShardedMatchQueue) or shards != len(match_queue.shards):
+        raise RuntimeError("sharded matching needs MATCH_BACKEND=redis and MATCH_SHARDS matching --shards")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_shard_main, args=(i, interval_seconds, window), name=f"match-shard-{i}", daemon=True)
+             for i in range(shards)]
+    for p in procs:
+        p.start()
+    try:
+        asyncio.run(_coordinator_loop(interval_seconds))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run the match worker")
+    ap.add_argument("--shards", type=int, default=MATCH_SHARDS)
+    ap.add_argument("--interval", type=int, default=30)
+    ap.add_argument("--window", type=int, default=500)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if MATCH_BACKEND != "redis":
+        # an in-memory queue here would be a private, empty copy: the bot's searchers (and
+        # their filters) live in the bot process, which runs scan_and_match_loop itself
+        raise SystemExit("the match worker needs MATCH_BACKEND=redis (with the memory backend, bot.py runs the match loop)")
+    if args.shards > 1:
+        run_sharded(args.shards, interval_seconds=args.interval, window=args.window)
+    else:
+        asyncio.run(scan_and_match_loop(interval_seconds=args.interval, window=args.window))
@@ -0,0 +1,154 @@
+# src/services/workers/update_worker.py
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from config import TOKEN, UPDATE_PARTITIONS, UPDATE_WORKER_CONCURRENCY, SEND_GLOBAL_RATE
+from services.update_stream import UpdateStream, update_stream, update_user_id, check_partitioned_config
+from services.telemetry import observe_update_lag
+
+logger = logging.getLogger("update_worker")
+logger.setLevel(logging.INFO)
+
+
+class PartitionConsumer:
+    """
+    Handles one partition of the update stream. Different users' updates run concurrently
+    (at most `concurrency` at a time); a user's updates run one after another in stream
+    order, each after the previous one finished, exactly as if a single process polled.
+
+    Each user with work has a FIFO drained by one task, which takes a concurrency slot only
+    while an update is being handled, so a user whose handler is stuck (or who sends a
+    flood) holds at most one slot and never blocks reading the next users' updates. Reading
+    ahead of handling is capped at `max_backlog` entries. An entry is acknowledged once
+    handled, so after a crash the worker starts with what it had read but not finished.
+    """
+
+    def __init__(self, partition: int, bot: Bot, dp: Dispatcher, stream: UpdateStream = update_stream,
+                 concurrency: int = UPDATE_WORKER_CONCURRENCY, max_backlog: Optional[int] = None):
+        self.partition = partition
+        self.bot = bot
+        self.dp = dp
+        self.stream = stream
+        self._slots = asyncio.Semaphore(concurrency)
+        self._backlog = asyncio.Semaphore(max_backlog or concurrency * 16)
+        self._queues: Dict[int, Deque[Tuple[str, dict]]] = {}
+        self._drains: Dict[int, asyncio.Task] = {}
+
+    async def run(self, block_ms: int = 5000, count: int = 100) -> None:
+        await self.stream.ensure_group(self.partition)
+        pending = True
+        while True:
+            try:
+                entries = await self.stream.read(self.partition, pending, count, block_ms)
+            except Exception as e:
+                logger.exception("reading partition %d failed: %s", self.partition, e)
+                await asyncio.sleep(1)
+                continue
+            if pending and not entries:
+                pending = False
+                continue
+            for entry_id, update in entries:
+                await self._backlog.acquire()
+                self._schedule(entry_id, update)
+            if pending:
+                # wait for this batch before asking for the next one, or it would come back
+                await asyncio.gather(*self._drains.values(), return_exceptions=True)
+
+    def _schedule(self, entry_id: str, update: dict) -> None:
+        user_id = update_user_id(update) or 0
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._drains[user_id] = asyncio.create_task(self._drain(user_id, queue))
+        queue.append((entry_id, update))
+
+    async def _drain(self, user_id: int, queue: Deque[Tuple[str, dict]]) -> None:
+        try:
+            while queue:
+                entry_id, update = queue[0]
+                try:
+                    async with self._slots:
+                        await self._handle(entry_id, update)
+                finally:
+                    queue.popleft()
+                    self._backlog.release()
+        finally:
+            # no await since the last emptiness check, so nothing was queued in between
+            del self._queues[user_id]
+            del self._drains[user_id]
+
+    async def _handle(self, entry_id: str, update: dict) -> None:
+        observe_update_lag(max(0.0, time.time() - int(entry_id.split("-", 1)[0]) / 1000))
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            logger.exception("update %s failed: %s", update.get("update_id"), e)
+        try:
+            await self.stream.ack(self.partition, entry_id)
+        except Exception as e:
+            # still pending in the stream: handled again after a restart, not lost
+            logger.exception("acking %s failed: %s", entry_id, e)
+
+
+async def run_partition(partition: int, partitions: int = UPDATE_PARTITIONS) -> None:
+    # --partitions may disagree with the environment this worker was started with
+    check_partitioned_config(partitions)
+    # imported here: bot.py pulls in every handler, which only worker processes need
+    from bot import build_dispatcher
+    from services.send_scheduler import send_scheduler, TokenBucket
+    from services.session_activity import activity_tracker
+
+    bot = Bot(token=TOKEN)
+    send_scheduler.install(bot)
+    # the global send rate is per bot token, so each partition gets its share of it
+    share = SEND_GLOBAL_RATE / partitions
+    send_scheduler.global_bucket = TokenBucket(share, max(1.0, share))
+    dp = build_dispatcher()
+    asyncio.create_task(activity_tracker.run())
+    logger.info("update worker for partition %d/%d started", partition, partitions)
+    try:
+        await PartitionConsumer(partition, bot, dp).run()
+    finally:
+        await bot.session.close()
+
+
+def _partition_main(partition: int, partitions: int):
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_partition(partition, partitions))
+
+
+def run_all(partitions: int = UPDATE_PARTITIONS):
+    """
+    One worker process per partition on this machine. Each partition must have exactly one
+    worker (anywhere), or a user's updates could be handled out of order.
+    """
+    check_partitioned_config(partitions)  # fail here rather than once per child
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_partition_main, args=(i, partitions), name=f"update-worker-{i}", daemon=True)
+             for i in range(partitions)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    finally:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Handle updates from the partitioned update stream")
+    ap.add_argument("--partition", type=int, default=None, help="run only this partition (default: all of them)")
+    ap.add_argument("--partitions", type=int, default=UPDATE_PARTITIONS)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.partition is not None:
+        asyncio.run(run_partition(args.partition, args.partitions))
+    else:
+        run_all(args.partitions)
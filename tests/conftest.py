@@ -0,0 +1,79 @@
+# tests/conftest.py
+import os
+import tempfile
+
+import pytest
+
+# services/* read their settings at import time, so the environment is fixed before any of
+# them is imported: a throwaway SQLite file (in single-writer mode, like a production SQLite
+# deployment) and the in-process backends
+_TMP = tempfile.mkdtemp(prefix="bot_tests_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{_TMP}/test.db",
+    "DATABASE_READ_URL": "",
+    "DATA_DIR": _TMP,
+    "MATCH_BACKEND": "memory",
+    "MATCH_SHARDS": "1",
+    "STATE_CACHE_BACKEND": "memory",
+    "RATE_LIMIT_BACKEND": "memory",
+    "WEBHOOK_DEDUP_BACKEND": "memory",
+    "ARCHIVE_BACKEND": "off",
+    "UPDATE_PARTITIONS": "1",
+    "PROMETHEUS_ENABLED": "false",
+})
+
+
+@pytest.fixture
+async def db():
+    """
+    services.database on an empty schema, with the in-process caches and match pool reset.
+    """
+    from services import database
+    from services.block_index import block_index
+    from services.match_queue import match_queue
+    from services.state_cache import user_state
+
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+    user_state._states.clear()
+    block_index._peers.clear()
+    match_queue.engine.__init__()
+    match_queue._event = None  # bound to the previous test's event loop
+    yield database
+    # every test gets its own event loop; don't carry connections or the writer task over
+    await database.close_db()
+
+
+@pytest.fixture
+def searching(db):
+    """
+    searching(uid, gender, ...) puts a searcher in the pool the way enqueue_search leaves one
+    that found nobody (marked in the DB, ticket queued), without pairing or waking anyone.
+    """
+    from services.match_engine import SearchTicket
+    from services.match_queue import match_queue
+    from services.matcher import _mark_searching
+
+    async def searching(uid, gender, province="tehran", at=0.0, required=1, **wants):
+        await db.create_user_if_not_exists(uid)
+        await db.update_profile(uid, gender=gender, province=province, city=province)
+        await _mark_searching(uid)
+        ticket = SearchTicket(uid, gender=gender, province=province, city=province,
+                              required=required, enqueued_at=at, **wants)
+        await match_queue.add(ticket)
+        return ticket
+
+    return searching
+
+
+@pytest.fixture
+async def redis():
+    """
+    Fresh in-memory Redis (fakeredis, with Lua) speaking the same protocol as services.cache.get_redis().
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    r = fakeredis.FakeAsyncRedis(decode_responses=True)
+    yield r
+    await r.flushall()
+    await r.aclose()
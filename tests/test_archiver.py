@@ -0,0 +1,86 @@
+import gzip
+import json
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from services.worker import archiver
+
+
+@pytest.fixture(params=["table", "jsonl"])
+def backend(request):
+    shutil.rmtree(archiver.ARCHIVE_DIR, ignore_errors=True)
+    return request.param
+
+
+async def backdate(db, model, column, ids, days):
+    t = model.__table__
+    async with db.write_session() as session:
+        await session.execute(
+            update(t).where(t.c.id.in_(ids))
+            .values({column: datetime.now(timezone.utc) - timedelta(days=days)})
+        )
+
+
+async def ids_of(db, model):
+    async with db.AsyncSessionLocal() as session:
+        return sorted((await session.execute(select(model.id))).scalars())
+
+
+def jsonl_ids(name):
+    ids = []
+    for path in sorted((archiver.ARCHIVE_DIR / name).glob("*.jsonl.gz")):
+        with gzip.open(path, "rt") as f:
+            ids += [json.loads(line)["id"] for line in f]
+    return sorted(ids)
+
+
+async def archived_ids(db, backend, name, archive_model):
+    return await ids_of(db, archive_model) if backend == "table" else jsonl_ids(name)
+
+
+async def test_archives_old_reports_in_batches_once(db, backend):
+    await db.create_user_if_not_exists(1)
+    for i in range(7):
+        await db.report_user(1, 2, f"r{i}")
+    await backdate(db, db.Report, "created_at", [1, 2, 3, 4, 5], days=200)
+
+    moved = await archiver.archive_table("reports", 180, backend=backend, batch=2, pause=0)
+
+    assert moved == 5
+    assert await ids_of(db, db.Report) == [6, 7]
+    assert await archived_ids(db, backend, "reports", db.ReportArchive) == [1, 2, 3, 4, 5]
+    cp = (await db.get_archive_checkpoints())["reports"]
+    assert (cp["last_id"], cp["rows"]) == (5, 5)
+    if backend == "jsonl":
+        assert cp["last_file"].endswith("reports-0000000005-0000000005.jsonl.gz")
+
+    # nothing left past retention: a second run moves nothing and leaves the checkpoint alone
+    assert await archiver.archive_table("reports", 180, backend=backend, batch=2, pause=0) == 0
+    assert (await db.get_archive_checkpoints())["reports"]["rows"] == 5
+    assert await archived_ids(db, backend, "reports", db.ReportArchive) == [1, 2, 3, 4, 5]
+
+
+async def test_only_settled_rows_leave(db, backend):
+    for uid in (1, 2, 3, 4):
+        await db.create_user_if_not_exists(uid)
+    ended = await db.create_chat_session(1, 2)
+    active = await db.create_chat_session(3, 4)
+    await db.end_chat_session(ended)
+    await backdate(db, db.ChatSession, "last_activity", [ended, active], days=60)
+    await db.create_order(1, 5, "manual", "paid")
+    await db.create_order(1, 5, "manual", "pending")
+    await db.mark_order_paid("paid")
+    await backdate(db, db.Order, "created_at", [1, 2], days=400)
+
+    moved = await archiver.archive_once(backend=backend, pause=0)
+
+    assert moved == {"chat_sessions": 1, "reports": 0, "orders": 1}
+    assert await ids_of(db, db.ChatSession) == [active]
+    assert await ids_of(db, db.Order) == [2]  # still pending
+    assert await archived_ids(db, backend, "chat_sessions", db.ChatSessionArchive) == [ended]
+    assert await archived_ids(db, backend, "orders", db.OrderArchive) == [1]
+    assert set(await db.get_archive_checkpoints()) == {"chat_sessions", "orders"}
+    assert await archiver.archive_once(backend=backend, pause=0) == {"chat_sessions": 0, "reports": 0, "orders": 0}
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import services.block_index as block_index_module
+from services.block_index import BlockIndex
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(block_index_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def db_lookups(monkeypatch):
+    calls = []
+    real = block_index_module.get_blocked_peers
+
+    async def counting(user_id):
+        calls.append(user_id)
+        return await real(user_id)
+
+    monkeypatch.setattr(block_index_module, "get_blocked_peers", counting)
+    return calls
+
+
+async def test_users_without_blocks_skip_the_db(db, clock, db_lookups):
+    await db.block_user(1, 2)
+    index = BlockIndex(ttl=60, bloom_bits=1 << 16)
+
+    assert await index.blocked_peers(5) == frozenset()
+    assert await index.blocked_peers(6) == frozenset()
+    assert db_lookups == []  # the bloom filter has neither
+    assert await index.blocked_peers(2) == {1}
+    assert db_lookups == [2]
+
+
+async def test_a_block_from_another_replica_is_seen_after_the_ttl(db, clock, db_lookups):
+    index = BlockIndex(ttl=60, bloom_bits=1 << 16)
+    assert not await index.is_blocked(7, 8)
+
+    # written elsewhere: this index's filter and cache don't know about it yet
+    await db.block_user(7, 8)
+    clock[0] += 30
+    assert not await index.is_blocked(7, 8)  # within ttl the cached answer is trusted
+
+    clock[0] += 31
+    assert await index.is_blocked(7, 8)  # entry and filter too old: the DB answers meanwhile
+    assert db_lookups == [7]
+    await index._rebuild
+    assert 7 in index._bloom and 8 in index._bloom
+    assert await index.blocked_peers(9) == frozenset()
+    assert db_lookups == [7]  # the rebuilt filter is trusted again
+
+
+async def test_blocks_recorded_during_a_rebuild_are_kept(db, clock, monkeypatch):
+    index = BlockIndex(ttl=60, bloom_bits=1 << 16)
+    await db.block_user(1, 2)
+
+    async def pairs_with_a_block_midway():
+        yield (1, 2)
+        index.record_block(10, 11)  # blocked through this process while the scan runs
+
+    monkeypatch.setattr(block_index_module, "iter_block_pairs", pairs_with_a_block_midway)
+    assert await index.blocked_peers(3) == frozenset()  # the first build is awaited
+    assert 10 in index._bloom and 11 in index._bloom
+    assert 1 in index._bloom
@@ -0,0 +1,53 @@
+import asyncio
+
+from sqlalchemy import select
+
+
+async def ledger(db, user_id):
+    async with db.AsyncSessionLocal() as session:
+        res = await session.execute(
+            select(db.CreditLedger.delta, db.CreditLedger.balance, db.CreditLedger.reason)
+            .where(db.CreditLedger.user_id == user_id).order_by(db.CreditLedger.id)
+        )
+        return [tuple(r) for r in res.all()]
+
+
+async def test_every_change_is_in_the_ledger(db):
+    assert await db.create_user_if_not_exists(1)
+    assert not await db.create_user_if_not_exists(1)  # no second signup bonus
+    assert await db.add_credits(1, 5) == 15
+    assert await db.consume_credit(1, 3)
+    assert await db.add_credits(2, 4) == 4  # unknown users are created holding the grant
+
+    assert await ledger(db, 1) == [(10, 10, "signup"), (5, 15, "grant"), (-3, 12, "consume")]
+    assert await ledger(db, 2) == [(4, 4, "grant")]
+    assert await db.get_credits(1) == 12
+
+
+async def test_consume_is_conditional(db):
+    await db.create_user_if_not_exists(1)
+    assert not await db.consume_credit(1, 11)
+    assert not await db.consume_credit(99, 1)  # unknown user
+    assert await db.get_credits(1) == 10
+    assert await ledger(db, 1) == [(10, 10, "signup")]
+
+
+async def test_concurrent_consumes_never_overdraw(db):
+    await db.create_user_if_not_exists(1)
+    results = await asyncio.gather(*(db.consume_credit(1, 1) for _ in range(25)))
+
+    assert results.count(True) == 10
+    assert await db.get_credits(1) == 0
+    rows = await ledger(db, 1)
+    assert sum(delta for delta, _, _ in rows) == 0
+    # balances step down one at a time: no two consumes read the same balance
+    assert [balance for _, balance, _ in rows[1:]] == list(range(9, -1, -1))
+
+
+async def test_order_credits_once(db):
+    await db.create_user_if_not_exists(1)
+    await db.create_order(1, 7, "manual", "ref-1")
+    assert await db.mark_order_paid("ref-1")
+    assert not await db.mark_order_paid("ref-1")
+    assert await db.get_credits(1) == 17
+    assert (await ledger(db, 1))[-1] == (7, 17, "order")
@@ -0,0 +1,79 @@
+from sqlalchemy import select
+
+from services.match_engine import MatchEngine, SearchTicket
+from services.matcher import enqueue_search
+
+
+def ticket(uid, gender=None, province=None, city=None, at=0.0, **wants):
+    return SearchTicket(uid, gender=gender, province=province, city=city, enqueued_at=at, **wants)
+
+
+def test_claim_takes_longest_waiting_compatible():
+    engine = MatchEngine()
+    engine.add(ticket(1, "male", "tehran", at=1))
+    engine.add(ticket(2, "female", "tehran", at=2))
+    engine.add(ticket(3, "female", "shiraz", at=3))
+
+    assert engine.claim_next(ticket(9, "male", want_gender="female")).user_id == 2
+    # 2 is claimed now, so the next searcher gets the one behind it
+    assert engine.claim_next(ticket(8, "male", want_gender="female")).user_id == 3
+    assert engine.claim_next(ticket(7, "male", want_gender="female")) is None
+
+
+def test_claim_respects_the_candidates_own_filters():
+    engine = MatchEngine()
+    engine.add(ticket(1, "female", at=1, want_gender="female"))
+    engine.add(ticket(2, "female", at=2))
+
+    assert engine.claim_next(ticket(9, "male")).user_id == 2
+
+
+def test_claim_skips_self_and_excluded():
+    engine = MatchEngine()
+    engine.add(ticket(1, at=1))
+    engine.add(ticket(2, at=2))
+
+    assert engine.claim_next(ticket(1), exclude={2}) is None
+
+
+def test_release_and_discard():
+    engine = MatchEngine()
+    engine.add(ticket(1, "female", "tehran", "tehran", at=1))
+    cand = engine.claim_next(ticket(9))
+    engine.release(cand.user_id)
+    assert engine.claim_next(ticket(9, want_city="tehran")).user_id == 1
+
+    engine.discard(1)
+    assert len(engine) == 0
+    assert engine.bucket_depths() == {}
+    assert engine.claim_next(ticket(9)) is None
+
+
+def test_relaxed_drops_city_then_province():
+    t = ticket(1, "male", at=0, want_gender="female", want_province="tehran", want_city="tehran")
+    assert t.relaxed(now=5, relax_after=10) is t
+    assert t.relaxed(now=10, relax_after=10).wanted_key == ("female", "tehran", None)
+    assert t.relaxed(now=20, relax_after=10).wanted_key == ("female", None, None)
+    assert t.relaxed(now=100, relax_after=0) is t
+
+
+async def test_enqueue_search_pairs_with_a_waiting_searcher(db):
+    for uid, gender in ((1, "female"), (2, "male")):
+        await db.create_user_if_not_exists(uid)
+        await db.update_profile(uid, gender=gender, province="tehran", city="tehran")
+
+    assert await enqueue_search(1) is None
+    assert await db.get_status(1) == ("searching", None)
+
+    partner, session_id = await enqueue_search(2, gender="female")
+    assert partner == 1
+    assert await db.get_status(1) == ("chatting", 2)
+    assert await db.get_status(2) == ("chatting", 1)
+    # the waiting searcher pays the random price, the filtered one the advanced price
+    assert await db.get_credits(1) == 10 - 1
+    assert await db.get_credits(2) == 10 - 2
+    async with db.AsyncSessionLocal() as session:
+        cs = await session.get(db.ChatSession, session_id)
+        assert (cs.user_a, cs.user_b, cs.status) == (2, 1, "active")
+        users = (await session.execute(select(db.User.id).where(db.User.status == "searching"))).all()
+        assert users == []
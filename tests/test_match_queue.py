@@ -0,0 +1,124 @@
+import asyncio
+
+from services.match_engine import SearchTicket
+from services.match_queue import RedisMatchQueue, ShardedMatchQueue, shard_of
+
+
+def ticket(uid, gender=None, province=None, at=0.0, **wants):
+    return SearchTicket(uid, gender=gender, province=province, enqueued_at=float(at), **wants)
+
+
+async def test_redis_claims_are_atomic(redis):
+    queue = RedisMatchQueue(redis)
+    for uid in range(1, 21):
+        await queue.add(ticket(uid, "female", at=uid))
+
+    searchers = [ticket(100 + i, "male", want_gender="female") for i in range(30)]
+    claimed = await asyncio.gather(*(queue.claim_next(t) for t in searchers))
+
+    got = [c.user_id for c in claimed if c is not None]
+    assert sorted(got) == list(range(1, 21))  # every candidate once, nobody twice
+    assert await queue.size() == 0
+    assert await redis.zcard("match:{pool}:bucket:*|*|*") == 0
+
+
+async def test_redis_claim_finds_a_candidate_deep_in_the_bucket(redis):
+    queue = RedisMatchQueue(redis, scan_limit=8, scan_pages=2)
+    # 100 women ahead in line who only want women, then 50 the searcher has blocked
+    for uid in range(1, 101):
+        await queue.add(ticket(uid, "female", at=uid, want_gender="female"))
+    for uid in range(101, 151):
+        await queue.add(ticket(uid, "female", at=uid))
+    await queue.add(ticket(200, "female", at=200))
+
+    me = ticket(1000, "male", want_gender="female")
+    cand = await queue.claim_next(me, exclude=set(range(101, 151)))
+    assert cand.user_id == 200
+    assert await queue.claim_next(me, exclude=set(range(101, 151))) is None
+
+
+async def test_redis_claim_budget_bounds_the_scan(redis):
+    queue = RedisMatchQueue(redis, scan_limit=4, scan_pages=1, claim_budget=0)
+    for uid in range(1, 21):
+        await queue.add(ticket(uid, "female", at=uid, want_gender="female"))
+    await queue.add(ticket(50, "female", at=50))
+
+    # one script call per claim: the budget is spent before the compatible ticket is reached
+    assert await queue.claim_next(ticket(1000, "male")) is None
+    assert await queue.size() == 21
+
+
+async def test_redis_add_replaces_and_release_keeps_newer(redis):
+    queue = RedisMatchQueue(redis)
+    await queue.add(ticket(1, "female", "tehran", at=1))
+    await queue.add(ticket(1, "female", "shiraz", at=2))
+    assert await queue.size() == 1
+    assert await redis.zcard("match:{pool}:bucket:*|tehran|*") == 0
+    assert (await queue.get_many([1]))[1].province == "shiraz"
+
+    cand = await queue.claim_next(ticket(9, want_province="shiraz"))
+    assert cand.user_id == 1 and cand.enqueued_at == 2
+    await queue.release(cand)
+    assert (await queue.oldest(5))[0].enqueued_at == 2
+
+    # the user queued again while claimed: release must not bring the old ticket back
+    cand = await queue.claim_next(ticket(9))
+    await queue.add(ticket(1, "female", "tehran", at=3))
+    await queue.release(cand)
+    assert (await queue.get_many([1]))[1].province == "tehran"
+
+    await queue.discard(1)
+    assert await queue.size() == 0
+    assert await queue.bucket_depths() == {}
+
+
+async def test_sharded_concurrent_enqueues_leave_one_ticket(redis):
+    queue = ShardedMatchQueue(4, redis)
+    provinces = ["tehran", "shiraz", "tabriz", "mashhad", "isfahan", "yazd"]
+    assert len({shard_of(p, 4) for p in provinces}) > 1
+
+    await asyncio.gather(*(queue.add(ticket(1, "female", p, at=i)) for i, p in enumerate(provinces * 5)))
+
+    holding = [i for i, q in enumerate(queue.shards) if await q.contains(1)]
+    assert len(holding) == 1
+    assert int(await redis.hget(queue.route_key, 1)) == holding[0]
+    assert await queue.size() == 1
+
+    cand = await queue.claim_next(ticket(9, "male"))
+    assert cand.user_id == 1
+    await queue.release(cand)
+    assert await queue.size() == 1
+    await queue.discard(1)
+    assert await queue.size() == 0
+    assert await redis.hget(queue.route_key, 1) is None
+
+
+async def test_sharded_release_follows_a_concurrent_move(redis):
+    queue = ShardedMatchQueue(4, redis)
+    a, b = "tehran", next(p for p in ("shiraz", "tabriz", "mashhad") if shard_of(p, 4) != shard_of("tehran", 4))
+    await queue.add(ticket(1, "female", a, at=1))
+    cand = await queue.claim_next(ticket(9, "male"))
+    await queue.add(ticket(1, "female", b, at=2))  # queued again, in another shard, while claimed
+    await queue.release(cand)
+
+    assert await queue.size() == 1
+    assert (await queue.get_many([1]))[1].province == b
+
+
+async def test_redis_tickets_survive_separators_in_free_text(redis):
+    # province comes straight from "/advanced province=..."
+    queue = RedisMatchQueue(redis)
+    await queue.add(ticket(1, "female", "a|b|c", at=1))
+    await queue.add(ticket(2, "female", "*", at=2, want_province="x|y"))
+    await queue.add(ticket(3, "female", "tehran", at=3))
+
+    assert [t.province for t in await queue.oldest(5)] == ["a|b|c", "*", "tehran"]
+    assert (await queue.get_many([2]))[2].want_province == "x|y"
+    assert await queue.bucket_depths() == {("female", "a|b|c", None): 1, ("female", "*", None): 1,
+                                           ("female", "tehran", None): 1}
+
+    # "*" as a real province is its own bucket, not the wildcard one, and 2 only accepts x|y
+    assert await queue.claim_next(ticket(9, "male", "tehran", want_province="*")) is None
+    assert (await queue.claim_next(ticket(10, "male", "x|y", want_province="*"))).user_id == 2
+    assert (await queue.claim_next(ticket(11, "male", "tehran", want_province="a|b|c"))).user_id == 1
+    assert await queue.size() == 1
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from services.match_queue import match_queue
+from services.matcher import enqueue_search
+from services.worker.match_worker import scan_and_match_loop
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not await predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def test_enqueue_wakes_the_worker_well_before_the_interval(db):
+    await db.create_user_if_not_exists(1)
+    waiter = asyncio.create_task(match_queue.wait_for_enqueue(timeout=30))
+    await asyncio.sleep(0)
+
+    started = time.monotonic()
+    assert await enqueue_search(1) is None  # nobody to pair with: queued, and the worker woken
+    assert await asyncio.wait_for(waiter, 5) is True
+    assert time.monotonic() - started < 1
+
+
+async def test_wait_for_enqueue_times_out_without_one(db):
+    assert await match_queue.wait_for_enqueue(timeout=0.05) is False
+
+
+async def test_in_process_loop_runs_a_batch_pass_on_wakeup(db, searching):
+    worker = asyncio.create_task(scan_and_match_loop(interval_seconds=30))
+    try:
+        await asyncio.sleep(0.1)  # first pass over the empty pool, then it sleeps
+        await searching(1, "female", at=1)
+        await searching(2, "male", at=2)
+        await match_queue.notify()
+
+        async def paired():
+            return await db.get_status(1) == ("chatting", 2)
+
+        await wait_for(paired)
+    finally:
+        worker.cancel()
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, func, update
+
+from services.match_engine import SearchTicket
+from services.match_queue import match_queue
+from services.matcher import enqueue_search, match_batch, pair_greedy
+
+
+async def sessions(db):
+    async with db.AsyncSessionLocal() as session:
+        return (await session.execute(select(db.ChatSession.user_a, db.ChatSession.user_b))).all()
+
+
+def test_pair_greedy_oldest_first_and_skips_blocks():
+    tickets = [SearchTicket(uid, enqueued_at=uid) for uid in (1, 2, 3, 4)]
+    pairs = pair_greedy(tickets, {1: {2}, 2: {1}})
+    assert [(a.user_id, b.user_id) for a, b in pairs] == [(3, 1), (4, 2)]
+
+
+async def test_match_batch_pairs_the_whole_window(db, searching):
+    for uid in range(1, 7):
+        await searching(uid, "female" if uid % 2 else "male", at=uid)
+
+    assert await match_batch(window=10) == 3
+    assert await match_queue.size() == 0
+    assert len(await sessions(db)) == 3
+    for uid in range(1, 7):
+        status, partner = await db.get_status(uid)
+        assert status == "chatting" and await db.get_status(partner) == ("chatting", uid)
+
+
+async def test_match_batch_skips_a_pair_that_no_longer_holds(db, searching):
+    await searching(1, "female", at=1)
+    await searching(2, "male", at=2)
+    await searching(3, "female", at=3)
+    await searching(4, "male", at=4)
+    # 2 can no longer pay: only its pair rolls back (its own savepoint), 3 and 4 still pair
+    assert await db.consume_credit(2, 10)
+
+    assert await match_batch(window=10) == 1
+    assert await sessions(db) == [(4, 3)]
+    assert await db.get_status(1) == ("searching", None)
+    assert await db.get_credits(1) == 10
+    async with db.AsyncSessionLocal() as session:
+        ledger = await session.execute(
+            select(func.count()).select_from(db.CreditLedger).where(db.CreditLedger.reason == "match")
+        )
+        assert ledger.scalar() == 2
+
+
+async def test_enqueue_search_rechecks_blocks_the_index_has_not_seen(db, searching):
+    from services.block_index import block_index
+
+    await searching(1, "female", at=1)
+    await db.create_user_if_not_exists(2)
+    assert await block_index.blocked_peers(2) == frozenset()  # cached before the block
+    # written by another replica: this process's block index doesn't know about it
+    async with db.write_session() as session:
+        session.add(db.Block(user_id=1, blocked_id=2))
+
+    assert await enqueue_search(2) is None
+    assert await db.get_status(1) == ("searching", None)
+    assert await db.get_status(2) == ("searching", None)
+    assert await match_queue.contains(1) and await match_queue.contains(2)
+    assert await block_index.blocked_peers(2) == frozenset({1})
+    assert await db.get_credits(1) == 10
+
+
+async def test_match_batch_relaxes_filters_of_long_waiting_searchers(db, searching):
+    now = time.time()
+    await searching(1, "female", "shiraz", at=now - 5)
+    await searching(2, "male", "tehran", at=now - 25, required=2,
+                    want_gender="female", want_province="tehran", want_city="tehran")
+
+    assert await match_batch(window=10, relax_after=0) == 0
+    # 25s at 10s per step: city and province are both dropped, gender never is
+    assert await match_batch(window=10, relax_after=10) == 1
+    assert await db.get_status(2) == ("chatting", 1)
+
+
+async def test_match_batch_releases_searchers_the_queue_lost(db, searching):
+    await searching(1, "female", at=1)
+    await db.create_user_if_not_exists(2)
+    async with db.write_session() as session:
+        # searching in the DB for a while, but no ticket (e.g. the bot restarted)
+        await session.execute(
+            update(db.User).where(db.User.id == 2)
+            .values(status="searching", search_started_at=datetime.now(timezone.utc) - timedelta(minutes=5))
+        )
+
+    assert await match_batch(window=10) == 0
+    assert await db.get_status(2) == ("idle", None)
+    assert await db.get_status(1) == ("searching", None)
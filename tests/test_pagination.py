@@ -0,0 +1,56 @@
+async def seed_reports(db, n):
+    await db.create_user_if_not_exists(1)
+    for i in range(n):
+        await db.report_user(1, 2, f"r{i}")
+
+
+def ids(rows, key="id"):
+    return [r[key] for r in rows]
+
+
+async def test_reports_page_walks_both_ways(db):
+    await seed_reports(db, 7)
+
+    first = ids(await db.reports_page(limit=3))
+    assert first == [7, 6, 5]  # newest first
+    second = ids(await db.reports_page(after_id=first[-1], limit=3))
+    assert second == [4, 3, 2]
+    last = ids(await db.reports_page(after_id=second[-1], limit=3))
+    assert last == [1]  # a short page means there is no next one
+
+    # previous pages come back in display order, not reversed
+    assert ids(await db.reports_page(before_id=last[0], limit=3)) == second
+    assert ids(await db.reports_page(before_id=second[0], limit=3)) == first
+
+
+async def test_pages_past_either_end_are_empty(db):
+    await seed_reports(db, 3)
+    assert await db.reports_page(after_id=1, limit=3) == []
+    assert await db.reports_page(before_id=3, limit=3) == []
+    # a previous page near the start is short, not padded from the other side
+    assert ids(await db.reports_page(before_id=2, limit=3)) == [3]
+
+
+async def test_empty_table(db):
+    assert await db.reports_page(limit=3) == []
+    assert [r async for r in db.iter_reports(chunk=2)] == []
+
+
+async def test_iter_reports_yields_every_row_once(db):
+    await seed_reports(db, 7)
+    # chunk boundaries fall inside, and exactly at the end of, the table
+    for chunk in (1, 2, 7, 10):
+        assert [r["id"] async for r in db.iter_reports(chunk=chunk)] == list(range(7, 0, -1))
+
+
+async def test_online_users_page_only_lists_idle_users(db):
+    for uid in range(1, 6):
+        await db.create_user_if_not_exists(uid)
+    await db.set_status(2, "searching")
+    await db.set_status(4, "chatting", 5)
+
+    first = ids(await db.online_users_page(limit=2), "user_id")
+    assert first == [1, 3]
+    assert ids(await db.online_users_page(after_id=3, limit=2), "user_id") == [5]
+    assert ids(await db.online_users_page(before_id=5, limit=2), "user_id") == first
+    assert [u["user_id"] async for u in db.iter_online_users(chunk=1)] == [1, 3, 5]
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.rate_limit import LocalRateLimiter, RatePolicy, RedisRateLimiter, Throttle, policy_for
+
+FAST = RatePolicy("fast", 20, 1, burst=3)  # one every 50ms, three back to back
+
+
+@pytest.fixture(params=["memory", "redis"])
+def limiter(request, redis):
+    if request.param == "memory":
+        return LocalRateLimiter(max_keys=100)
+    return RedisRateLimiter(redis)
+
+
+async def test_burst_then_limited(limiter):
+    assert [await limiter.hit(FAST, 1) for _ in range(3)] == [0, 0, 0]
+    wait = await limiter.hit(FAST, 1)
+    assert 0 < wait <= 0.05
+    assert await limiter.hit(FAST, 2) == 0  # per user
+    assert await limiter.hit(RatePolicy("other", 20, 1, burst=3), 1) == 0  # and per policy
+
+
+async def test_refused_hits_do_not_count(limiter):
+    slow = RatePolicy("slow", 10, 1, burst=3)  # one every 100ms
+    for _ in range(3):
+        await limiter.hit(slow, 1)
+    for _ in range(5):
+        assert await limiter.hit(slow, 1) > 0
+    await asyncio.sleep(0.13)
+    # one interval later exactly one more is allowed, however often it was refused meanwhile
+    assert await limiter.hit(slow, 1) == 0
+    assert await limiter.hit(slow, 1) > 0
+
+
+async def test_local_steady_rate_and_bounded_map(monkeypatch):
+    import services.rate_limit as rate_limit
+
+    clock = [100.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    limiter = LocalRateLimiter(max_keys=3)
+    policy = RatePolicy("p", 2, 1, burst=2)
+
+    assert await limiter.hit(policy, 1) == 0
+    assert await limiter.hit(policy, 1) == 0
+    assert await limiter.hit(policy, 1) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert await limiter.hit(policy, 1) == 0  # steady rate: one per interval
+
+    for uid in range(2, 10):
+        await limiter.hit(policy, uid)
+    assert len(limiter) == 3  # the least recently hit users were forgotten
+    clock[0] += 10
+    await limiter.hit(policy, 100)
+    assert len(limiter) == 1  # entries in the past are worthless and dropped
+
+
+async def test_redis_keys_expire_once_they_stop_mattering(redis):
+    limiter = RedisRateLimiter(redis, prefix="rl:")
+    await limiter.hit(FAST, 1)
+    ttl = await redis.pttl("rl:fast:1")
+    assert 0 < ttl <= 50
+
+
+def message(text, uid=1):
+    return SimpleNamespace(text=text, from_user=SimpleNamespace(id=uid))
+
+
+def test_policy_for_commands():
+    assert policy_for(message("hello")).name == "message"
+    assert policy_for(message("/chat")).name == "chat"
+    assert policy_for(message("/Chat@SomeBot now")).name == "chat"
+    assert policy_for(message("/unknown")).name == "command"
+
+
+async def test_throttle_drops_over_the_limit_and_fails_open():
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.text)
+
+    throttle = Throttle(LocalRateLimiter())
+    for i in range(12):
+        await throttle(handler, message(f"m{i}"), {})
+    assert handled == [f"m{i}" for i in range(10)]  # the "message" burst
+
+    class Broken:
+        async def hit(self, policy, user_id):
+            raise ConnectionError("redis down")
+
+    handled.clear()
+    await Throttle(Broken())(handler, message("m"), {})
+    assert handled == ["m"]
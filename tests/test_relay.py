@@ -0,0 +1,142 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import Command
+from aiogram.types import Update
+
+from services.relay import RelayPipeline
+
+
+class FakeBot:
+    def __init__(self, fail=(), hold=None):
+        self.sent = []
+        self.fail = set(fail)
+        self.hold = hold  # an Event every copy waits on, like a send stuck in a flood wait
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        if self.hold is not None:
+            await self.hold.wait()
+        if message_id in self.fail:
+            raise RuntimeError("copy failed")
+        self.sent.append((from_chat_id, message_id, chat_id))
+
+
+async def drained(pipeline):
+    while pipeline._tasks:
+        await asyncio.gather(*pipeline._tasks.values())
+
+
+async def test_delivers_in_reserve_order_whatever_order_slots_fill():
+    pipeline, bot = RelayPipeline(max_queue=10), FakeBot()
+    s1, s2, s3, s4 = (pipeline.reserve(1) for _ in range(4))
+
+    # the later updates' handlers finish first; the first update turns out not to be a message
+    pipeline.fill(1, s4, bot, 1, 104, 2)
+    pipeline.fill(1, s2, bot, 1, 102, 2)
+    await asyncio.sleep(0)
+    assert bot.sent == []  # the head slot is still in its handler
+    pipeline.fill(1, s3, bot, 1, 103, 2)
+    pipeline.release(1, s1)
+    await drained(pipeline)
+
+    assert [m for _, m, _ in bot.sent] == [102, 103, 104]
+    assert pipeline._slots == {} and pipeline._queued == 0
+
+
+async def test_releasing_a_filled_slot_keeps_its_job():
+    # order_middleware always releases after the handler; a filled slot must still be sent
+    pipeline, bot = RelayPipeline(max_queue=10), FakeBot()
+    slot = pipeline.reserve(1)
+    pipeline.fill(1, slot, bot, 1, 101, 2)
+    pipeline.release(1, slot)
+    await drained(pipeline)
+    assert [m for _, m, _ in bot.sent] == [101]
+
+
+async def test_released_slots_alone_leave_nothing_behind():
+    pipeline = RelayPipeline(max_queue=10)
+    slots = [pipeline.reserve(1) for _ in range(3)]
+    for slot in slots:
+        pipeline.release(1, slot)
+    assert pipeline._slots == {} and pipeline._tasks == {}
+
+
+async def test_a_full_queue_refuses_new_slots():
+    pipeline = RelayPipeline(max_queue=2)
+    assert pipeline.reserve(1) is not None
+    assert pipeline.reserve(1) is not None
+    assert pipeline.reserve(1) is None
+    assert pipeline.reserve(2) is not None  # the limit is per sender
+
+
+async def test_a_failed_copy_does_not_stop_the_queue():
+    pipeline, bot = RelayPipeline(max_queue=10), FakeBot(fail={101})
+    for mid in (101, 102):
+        pipeline.fill(1, pipeline.reserve(1), bot, 1, mid, 2)
+    await drained(pipeline)
+    assert [m for _, m, _ in bot.sent] == [102]
+
+
+async def test_a_stuck_sender_only_delays_itself():
+    pipeline = RelayPipeline(max_queue=10)
+    stuck, free = FakeBot(hold=asyncio.Event()), FakeBot()
+    pipeline.fill(1, pipeline.reserve(1), stuck, 1, 101, 2)
+    pipeline.fill(3, pipeline.reserve(3), free, 3, 301, 4)
+    await asyncio.wait_for(pipeline._tasks[3], 1)
+
+    assert free.sent == [(3, 301, 4)] and stuck.sent == []
+    stuck.hold.set()
+    await drained(pipeline)
+    assert stuck.sent == [(1, 101, 2)]
+
+
+def build_dispatcher(pipeline, bot, hold):
+    router = Router()
+
+    @router.message(Command("slow"))
+    async def slow(message):
+        await hold.wait()  # e.g. a long download
+
+    @router.message(F.text == "profile")
+    async def profile(message):
+        await hold.wait()  # a plain-text message some other flow takes
+
+    @router.message(F.text, flags={"relay": True})
+    async def relay(message, relay_slot=None):
+        pipeline.fill(message.from_user.id, relay_slot, bot, message.chat.id, message.message_id, 2)
+
+    dp = Dispatcher()
+    dp.update.outer_middleware(pipeline.order_middleware)
+    dp.message.middleware(pipeline.handler_middleware)
+    parent = Router()
+    parent.include_router(router)  # the middleware must reach handlers in nested routers
+    dp.include_router(parent)
+    return dp
+
+
+def update(n, text):
+    return Update.model_validate({"update_id": n, "message": {
+        "message_id": n, "date": 0, "text": text,
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "a"},
+    }})
+
+
+async def test_a_slow_non_relay_handler_does_not_hold_back_chat_messages():
+    pipeline, fake, hold = RelayPipeline(max_queue=2), FakeBot(), asyncio.Event()
+    dp = build_dispatcher(pipeline, fake, hold)
+    bot = Bot("42:TEST")
+    slow = [asyncio.create_task(dp.feed_update(bot, update(1, "/slow"))),
+            asyncio.create_task(dp.feed_update(bot, update(2, "profile")))]
+    await asyncio.sleep(0.05)
+
+    # both are still running, yet the chat messages behind them go out (and fit the queue)
+    for n in (3, 4):
+        await dp.feed_update(bot, update(n, f"hi {n}"))
+    await asyncio.wait_for(drained(pipeline), 1)
+    assert [m for _, m, _ in fake.sent] == [3, 4]
+    assert not any(t.done() for t in slow)
+
+    hold.set()
+    await asyncio.gather(*slow)
+    assert pipeline._slots == {}
+    await bot.session.close()
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from services.send_scheduler import BROADCAST, RELAY, REPLY, SendScheduler, TokenBucket
+
+
+@pytest.fixture
+async def make_scheduler():
+    made = []
+
+    def make(**kwargs):
+        made.append(SendScheduler(**kwargs))
+        return made[-1]
+
+    yield make
+    for scheduler in made:
+        if scheduler._task is not None:
+            scheduler._task.cancel()
+
+
+def test_token_bucket_bursts_then_paces():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.stamp
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == pytest.approx(0)
+    assert not bucket.idle_full(now + 0.5)
+    assert bucket.idle_full(now + 1.5)  # refilled, capped at capacity
+
+
+def test_token_bucket_pause_holds_even_with_tokens():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.pause(5)
+    now = time.monotonic()
+    assert bucket.delay(now) == pytest.approx(5, abs=0.1)
+    assert not bucket.idle_full(now)
+    assert bucket.delay(now + 5.1) == 0
+
+
+async def test_chat_bucket_bursts_then_paces_in_fifo_order(make_scheduler):
+    scheduler = make_scheduler(global_rate=1000, chat_rate=10, chat_burst=3)
+    started = time.monotonic()
+    granted = []
+
+    async def send(i):
+        await scheduler.acquire(1)
+        granted.append((i, time.monotonic() - started))
+
+    await asyncio.gather(*(send(i) for i in range(5)))
+
+    assert [i for i, _ in granted] == [0, 1, 2, 3, 4]
+    times = [t for _, t in granted]
+    assert times[2] < 0.05  # the burst goes out at once
+    assert times[3] >= 0.08 and times[4] - times[3] >= 0.08  # then one per 1/chat_rate
+
+
+async def test_a_paced_chat_does_not_hold_up_others(make_scheduler):
+    scheduler = make_scheduler(global_rate=1000, chat_rate=1, chat_burst=1)
+    await scheduler.acquire(1)
+    waiting = asyncio.create_task(scheduler.acquire(1))  # next token in ~1s
+    await asyncio.wait_for(scheduler.acquire(2), 0.2)
+    assert not waiting.done()
+    waiting.cancel()
+
+
+async def test_priority_decides_who_gets_the_global_token(make_scheduler):
+    scheduler = make_scheduler(global_rate=20, chat_rate=100, chat_burst=10)
+    scheduler.global_bucket.tokens = 0  # the global bucket is dry: every send waits for it
+    order = []
+
+    async def send(chat_id, priority, name):
+        await scheduler.acquire(chat_id, priority)
+        order.append(name)
+
+    await asyncio.gather(
+        send(1, BROADCAST, "broadcast"), send(2, REPLY, "reply"), send(3, RELAY, "relay"),
+        send(4, BROADCAST, "broadcast2"),
+    )
+    assert order == ["relay", "reply", "broadcast", "broadcast2"]
+    assert scheduler._depths == [0, 0, 0]
+
+
+async def test_retry_after_pauses_the_chat_and_retries(make_scheduler):
+    scheduler = make_scheduler(global_rate=1000, chat_rate=100, chat_burst=10, max_retries=1)
+    method = SendMessage(chat_id=1, text="hi")
+    calls = []
+
+    async def make_request(bot, m):
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise TelegramRetryAfter(method=m, message="flood", retry_after=0)
+        return "ok"
+
+    with pytest.raises(TelegramRetryAfter):  # refused on the retry too
+        await scheduler(make_request, None, method)
+    assert len(calls) == 2
+    assert await scheduler(make_request, None, method) == "ok"
+
+
+async def test_non_sends_bypass_the_buckets(make_scheduler):
+    scheduler = make_scheduler(global_rate=1, chat_rate=1, chat_burst=1)
+    scheduler.global_bucket.tokens = 0
+
+    async def make_request(bot, m):
+        return "me"
+
+    assert await asyncio.wait_for(scheduler(make_request, None, GetMe()), 0.2) == "me"
+    assert scheduler._task is None
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+import services.session_activity as session_activity
+from services.session_activity import ActivityTracker
+
+
+async def start_chat(db, a, b):
+    for uid in (a, b):
+        await db.create_user_if_not_exists(uid)
+    await db.set_status(a, "chatting", b)
+    await db.set_status(b, "chatting", a)
+    return await db.create_chat_session(a, b)
+
+
+async def age(db, session_id, seconds):
+    cs = db.ChatSession.__table__
+    async with db.write_session() as session:
+        await session.execute(
+            update(cs).where(cs.c.id == session_id)
+            .values(last_activity=datetime.now(timezone.utc) - timedelta(seconds=seconds))
+        )
+
+
+async def session_status(db, session_id):
+    async with db.AsyncSessionLocal() as session:
+        return (await session.execute(
+            select(db.ChatSession.status).where(db.ChatSession.id == session_id)
+        )).scalar_one()
+
+
+async def test_expire_ends_only_stale_sessions_and_releases_only_their_users(db):
+    stale = await start_chat(db, 1, 2)
+    fresh = await start_chat(db, 3, 4)
+    moved_on = await start_chat(db, 5, 6)
+    await age(db, stale, 7200)
+    await age(db, moved_on, 7200)
+    # user 6 has since started chatting with 7: ending the old session must not free them
+    await start_chat(db, 6, 7)
+
+    ended = await db.expire_sessions(max_seconds=3600, chunk=1)  # one session per chunk
+
+    assert sorted(ended) == [stale, moved_on]
+    assert [await session_status(db, s) for s in (stale, fresh, moved_on)] == ["ended", "active", "ended"]
+    # the state cache was invalidated, so these come from the rows
+    assert await db.get_status(1) == ("idle", None)
+    assert await db.get_status(2) == ("idle", None)
+    assert await db.get_status(3) == ("chatting", 4)
+    assert await db.get_status(5) == ("idle", None)
+    assert await db.get_status(6) == ("chatting", 7)
+    assert await db.expire_sessions(max_seconds=3600) == []
+
+
+async def test_a_flushed_touch_keeps_the_session_alive(db):
+    sid = await start_chat(db, 1, 2)
+    await age(db, sid, 7200)
+    tracker = ActivityTracker()
+    tracker.touch(2, 1)  # either user order
+
+    assert await tracker.flush() == 1
+    assert await db.expire_sessions(max_seconds=3600) == []
+    assert await session_status(db, sid) == "active"
+
+
+async def test_a_touch_after_expiry_does_not_revive_the_session(db):
+    sid = await start_chat(db, 1, 2)
+    await age(db, sid, 7200)
+    tracker = ActivityTracker()
+    tracker.touch(1, 2)  # seen in memory, not yet flushed when the cleaner runs
+
+    assert await db.expire_sessions(max_seconds=3600) == [sid]
+    await tracker.flush()
+    assert await session_status(db, sid) == "ended"
+    assert await db.get_status(1) == ("idle", None)
+
+
+async def test_a_failed_flush_keeps_the_newest_touch(db, monkeypatch):
+    tracker = ActivityTracker()
+    written = []
+
+    async def failing(entries):
+        tracker.touch(1, 2)  # newer activity arrives while the write is in flight
+        raise ConnectionError("db down")
+
+    async def recording(entries):
+        written.extend(entries)
+
+    tracker.touch(1, 2)
+    tracker.touch(3, 4)
+    first = dict(tracker._pending)
+    monkeypatch.setattr(session_activity, "touch_sessions", failing)
+    with pytest.raises(ConnectionError):
+        await tracker.flush()
+    assert tracker._pending[(1, 2)] > first[(1, 2)]
+    assert tracker._pending[(3, 4)] == first[(3, 4)]
+
+    monkeypatch.setattr(session_activity, "touch_sessions", recording)
+    assert await tracker.flush() == 2
+    assert tracker._pending == {}
+    assert sorted((a, b) for a, b, _ in written) == [(1, 2), (3, 4)]
+
+
+async def test_max_pending_wakes_the_flusher_early(db):
+    sid = await start_chat(db, 1, 2)
+    await age(db, sid, 7200)
+    tracker = ActivityTracker(flush_seconds=3600, max_pending=1)
+    runner = asyncio.create_task(tracker.run())
+    await asyncio.sleep(0)
+    tracker.touch(1, 2)
+
+    async def last_activity():
+        async with db.AsyncSessionLocal() as session:
+            return (await session.execute(
+                select(db.ChatSession.last_activity).where(db.ChatSession.id == sid)
+            )).scalar_one()
+
+    try:
+        before = await last_activity()
+        for _ in range(100):  # long before flush_seconds: the full batch woke the flusher
+            if await last_activity() != before:
+                break
+            await asyncio.sleep(0.01)
+        else:
+            pytest.fail("activity was not flushed")
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from services.sqlite_writer import SQLiteWriter
+
+
+async def user_ids(db):
+    async with db.AsyncSessionLocal() as session:
+        return [r[0] for r in (await session.execute(select(db.User.id).order_by(db.User.id))).all()]
+
+
+async def insert(db, uid, fail=False):
+    async with db.write_session() as session:
+        session.add(db.User(id=uid))
+        await session.flush()
+        if fail:
+            raise RuntimeError("boom")
+
+
+async def test_writes_go_through_one_writer_in_batches(db):
+    writer = db.sqlite_writer
+    assert writer is not None  # conftest uses a SQLite file, so single-writer mode is on
+    batches, turns = writer.batches, writer.turns
+
+    await asyncio.gather(*(insert(db, uid) for uid in range(1, 51)))
+
+    assert await user_ids(db) == list(range(1, 51))
+    assert writer.turns - turns == 50
+    assert writer.batches - batches < 50  # group commit: queued turns share a transaction
+
+
+async def test_a_failing_turn_only_rolls_back_its_savepoint(db):
+    writer = db.sqlite_writer
+    batches = writer.batches
+
+    results = await asyncio.gather(
+        insert(db, 1), insert(db, 2, fail=True), insert(db, 3), return_exceptions=True,
+    )
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RuntimeError)
+    assert await user_ids(db) == [1, 3]
+    assert writer.batches - batches == 1  # all three turns ran in the same transaction
+
+
+async def test_constraint_errors_surface_in_the_caller(db):
+    await insert(db, 1)
+    results = await asyncio.gather(insert(db, 1), insert(db, 2), return_exceptions=True)
+    assert isinstance(results[0], IntegrityError)
+    assert results[1] is None
+    assert await user_ids(db) == [1, 2]
+
+
+async def test_a_cancelled_caller_does_not_stall_the_writer(db):
+    waiting = asyncio.create_task(insert(db, 1))
+    waiting.cancel()
+    await asyncio.wait_for(insert(db, 2), 5)
+    assert await user_ids(db) == [2]
+
+
+class _LockedSession:
+    """ A session whose BEGIN fails, like BEGIN IMMEDIATE hitting SQLITE_BUSY. """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def begin(self):
+        raise RuntimeError("database is locked")
+
+
+async def test_begin_failure_fails_the_turn_instead_of_hanging():
+    writer = SQLiteWriter(_LockedSession)
+    with pytest.raises(RuntimeError, match="locked"):
+        async with asyncio.timeout(5):
+            async with writer.turn():
+                pass
+    await writer.close()
+
+
+async def test_a_turn_does_not_see_objects_cached_by_an_earlier_one(db):
+    # turns in a batch share one session; a Core UPDATE in between doesn't touch the
+    # identity map, so without expiring it the last set_status sees "chatting" already
+    # set, writes nothing, and the row stays idle
+    from sqlalchemy import update
+
+    await db.create_user_if_not_exists(1)
+
+    async def release():
+        async with db.write_session() as session:
+            users = db.User.__table__
+            await session.execute(update(users).where(users.c.id == 1).values(status="idle", partner_id=None))
+
+    await asyncio.gather(db.set_status(1, "chatting", 2), release(), db.set_status(1, "chatting", 2))
+
+    async with db.AsyncSessionLocal() as session:
+        row = (await session.execute(select(db.User.status, db.User.partner_id).where(db.User.id == 1))).one()
+    assert tuple(row) == ("chatting", 2)
+
+
+async def test_objects_stay_readable_after_the_turn(db):
+    # like _commit_pair reading cs.id: later turns in the batch must not expire what an
+    # earlier caller holds, or the read after commit fails on a detached instance
+    async def add(uid):
+        async with db.write_session() as session:
+            user = db.User(id=uid)
+            session.add(user)
+        return user.id, user.status
+
+    assert await asyncio.gather(*(add(uid) for uid in range(1, 6))) == [(uid, "idle") for uid in range(1, 6)]
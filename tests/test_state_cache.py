@@ -0,0 +1,59 @@
+import pytest
+
+from services.state_cache import LocalStateCache, RedisStateCache
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request, redis):
+    if request.param == "memory":
+        return LocalStateCache(ttl=30, max_users=100)
+    return RedisStateCache(redis, ttl=30)
+
+
+async def test_put_and_get(cache):
+    assert await cache.get(1) is None
+    await cache.put(1, "chatting", 2)
+    await cache.put(2, "idle", None)
+    assert await cache.get(1) == ("chatting", 2)
+    assert await cache.get(2) == ("idle", None)
+
+
+async def test_fill_never_overwrites_a_write(cache):
+    # a reader that loaded "searching" before the write committed must not cache it over "chatting"
+    await cache.put(1, "chatting", 2)
+    await cache.fill(1, "searching", None)
+    assert await cache.get(1) == ("chatting", 2)
+
+
+async def test_fill_caches_a_miss(cache):
+    await cache.fill(1, "idle", None)
+    assert await cache.get(1) == ("idle", None)
+
+
+async def test_invalidate_leaves_a_tombstone_fill_cannot_replace(cache):
+    await cache.put(1, "chatting", 2)
+    await cache.invalidate(1)
+    assert await cache.get(1) is None
+    await cache.fill(1, "chatting", 2)  # a read from before the invalidating write
+    assert await cache.get(1) is None
+    await cache.put(1, "idle", None)  # writes still go through
+    assert await cache.get(1) == ("idle", None)
+
+
+async def test_local_entries_expire_and_stay_bounded(monkeypatch):
+    import services.state_cache as state_cache
+
+    clock = [100.0]
+    monkeypatch.setattr(state_cache.time, "monotonic", lambda: clock[0])
+    cache = LocalStateCache(ttl=30, max_users=2)
+    await cache.invalidate(1)
+    clock[0] += 31
+    await cache.fill(1, "idle", None)  # the tombstone has expired
+    assert await cache.get(1) == ("idle", None)
+
+    await cache.put(2, "idle", None)
+    await cache.put(3, "idle", None)
+    assert await cache.get(1) is None  # least recently used, evicted
+    assert len(cache._states) == 2
+    clock[0] += 31
+    assert await cache.get(3) is None
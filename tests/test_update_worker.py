@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from services.worker.update_worker import PartitionConsumer
+
+
+class FakeStream:
+    def __init__(self, pending=(), new=()):
+        self.pending = list(pending)
+        self.new = list(new)
+        self.acked = []
+
+    async def ensure_group(self, partition):
+        pass
+
+    async def read(self, partition, pending, count, block_ms):
+        source = self.pending if pending else self.new
+        batch, source[:count] = source[:count], []
+        if not batch and not pending:
+            await asyncio.sleep(0.01)
+        return batch
+
+    async def ack(self, partition, entry_id):
+        self.acked.append(entry_id)
+
+
+class FakeDispatcher:
+    def __init__(self, stuck=()):
+        self.handled = []
+        self.stuck = set(stuck)  # users whose handlers wait on `release`
+        self.release = asyncio.Event()
+
+    async def feed_raw_update(self, bot, update):
+        user = update["message"]["from"]["id"]
+        if user in self.stuck:
+            await self.release.wait()
+        await asyncio.sleep(0)
+        self.handled.append((user, update["update_id"]))
+
+
+def entry(n, user):
+    return (f"{int(time.time() * 1000)}-{n}", {"update_id": n, "message": {"from": {"id": user}}})
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run(consumer):
+    return asyncio.create_task(consumer.run(block_ms=10))
+
+
+async def test_a_stuck_user_does_not_hold_up_others():
+    # a flood from user 1, whose handler is stuck, read ahead of user 2's update
+    stream = FakeStream(new=[entry(n, 1) for n in range(20)] + [entry(100, 2)])
+    dp = FakeDispatcher(stuck={1})
+    consumer = PartitionConsumer(0, None, dp, stream, concurrency=2)
+    task = run(consumer)
+    try:
+        await wait_for(lambda: (2, 100) in dp.handled)
+        assert all(user == 2 for user, _ in dp.handled)
+        dp.release.set()
+        await wait_for(lambda: len(dp.handled) == 21)
+    finally:
+        task.cancel()
+
+    # user 1's updates stayed in stream order, and everything was acknowledged
+    assert [n for user, n in dp.handled if user == 1] == list(range(20))
+    assert len(stream.acked) == 21
+    assert consumer._queues == {} and consumer._drains == {}
+
+
+async def test_concurrency_bounds_handlers_running_at_once():
+    stream = FakeStream(new=[entry(n, n) for n in range(10)])
+    running, peak = [0], [0]
+    dp = FakeDispatcher()
+
+    async def feed(bot, update):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        dp.handled.append(update["update_id"])
+
+    dp.feed_raw_update = feed
+    task = run(PartitionConsumer(0, None, dp, stream, concurrency=3))
+    try:
+        await wait_for(lambda: len(dp.handled) == 10)
+    finally:
+        task.cancel()
+    assert peak[0] == 3
+
+
+async def test_backlog_caps_read_ahead():
+    stream = FakeStream(new=[entry(n, 1) for n in range(10)])
+    dp = FakeDispatcher(stuck={1})
+    consumer = PartitionConsumer(0, None, dp, stream, concurrency=2, max_backlog=4)
+    task = run(consumer)
+    try:
+        await asyncio.sleep(0.05)
+        assert len(consumer._queues[1]) == 4  # the reader waits for room instead of piling up
+        dp.release.set()
+        await wait_for(lambda: len(dp.handled) == 10)
+    finally:
+        task.cancel()
+
+
+async def test_pending_entries_are_finished_before_new_ones():
+    stream = FakeStream(pending=[entry(1, 1), entry(2, 2)], new=[entry(3, 1)])
+    dp = FakeDispatcher()
+    task = run(PartitionConsumer(0, None, dp, stream, concurrency=4))
+    try:
+        await wait_for(lambda: len(dp.handled) == 3)
+    finally:
+        task.cancel()
+    assert dp.handled[-1] == (1, 3)
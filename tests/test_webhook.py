@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from services.webhook import LocalUpdateDedup, RedisUpdateDedup, WebhookServer
+
+SECRET = "s3cret"
+HEADERS = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+
+class FakeDispatcher:
+    def __init__(self, hold=None):
+        self.fed = []
+        self.hold = hold  # an Event every update waits on, like a slow handler
+
+    async def feed_raw_update(self, bot, update):
+        if self.hold is not None:
+            await self.hold.wait()
+        self.fed.append(update["update_id"])
+
+
+@pytest.fixture
+async def serve():
+    clients = []
+
+    async def serve(server):
+        client = TestClient(TestServer(server.app()))
+        await client.start_server()
+        clients.append(client)
+        return client
+
+    yield serve
+    for client in clients:
+        await client.close()
+
+
+async def settled(server):
+    while server._tasks:
+        await asyncio.gather(*server._tasks)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def dedup(request, redis):
+    if request.param == "memory":
+        return LocalUpdateDedup(ttl=60)
+    return RedisUpdateDedup(redis, ttl=60)
+
+
+async def test_dedup_first_seen_and_forget(dedup):
+    assert await dedup.first_seen(1)
+    assert not await dedup.first_seen(1)
+    assert await dedup.first_seen(2)
+    await dedup.forget(1)
+    assert await dedup.first_seen(1)
+
+
+async def test_local_dedup_expires_and_stays_bounded(monkeypatch):
+    import services.webhook as webhook
+
+    clock = [100.0]
+    monkeypatch.setattr(webhook.time, "monotonic", lambda: clock[0])
+    dedup = LocalUpdateDedup(ttl=60, max_ids=3)
+    for update_id in range(1, 6):
+        assert await dedup.first_seen(update_id)
+    assert len(dedup._seen) == 3
+    assert await dedup.first_seen(1)  # evicted, so seen as new
+    clock[0] += 61
+    assert await dedup.first_seen(5)  # expired
+
+
+async def test_a_redelivered_update_is_processed_once(serve, dedup):
+    dp = FakeDispatcher()
+    server = WebhookServer(None, dp, path="/hook", secret=SECRET, dedup=dedup)
+    client = await serve(server)
+
+    for _ in range(3):
+        resp = await client.post("/hook", json={"update_id": 7}, headers=HEADERS)
+        assert resp.status == 200  # duplicates are acknowledged too, or Telegram keeps sending
+    await client.post("/hook", json={"update_id": 8}, headers=HEADERS)
+    await settled(server)
+    assert dp.fed == [7, 8]
+
+
+async def test_rejects_a_wrong_secret_and_bad_bodies(serve):
+    dp = FakeDispatcher()
+    client = await serve(WebhookServer(None, dp, path="/hook", secret=SECRET, dedup=LocalUpdateDedup()))
+
+    assert (await client.post("/hook", json={"update_id": 1})).status == 401
+    assert (await client.post("/hook", json={"update_id": 1}, headers={"X-Telegram-Bot-Api-Secret-Token": "x"})).status == 401
+    assert (await client.post("/hook", data=b"{not json", headers=HEADERS)).status == 400
+    assert (await client.post("/hook", json={"message": {}}, headers=HEADERS)).status == 400
+    # none of them was recorded: the real update still goes through
+    assert (await client.post("/hook", json={"update_id": 1}, headers=HEADERS)).status == 200
+
+
+async def test_busy_answers_503_without_recording_the_update(serve):
+    dp = FakeDispatcher(hold=asyncio.Event())
+    server = WebhookServer(None, dp, path="/hook", secret=SECRET, max_inflight=1, dedup=LocalUpdateDedup())
+    client = await serve(server)
+
+    assert (await client.post("/hook", json={"update_id": 1}, headers=HEADERS)).status == 200
+    resp = await client.post("/hook", json={"update_id": 2}, headers=HEADERS)
+    assert resp.status == 503 and resp.headers["Retry-After"] == "1"
+
+    dp.hold.set()
+    await settled(server)
+    assert (await client.post("/hook", json={"update_id": 2}, headers=HEADERS)).status == 200
+    await settled(server)
+    assert dp.fed == [1, 2]
+
+
+async def test_a_failed_hand_off_is_redelivered(serve):
+    handed = []
+
+    async def sink(update):
+        if not handed:
+            handed.append(None)
+            raise ConnectionError("stream down")
+        handed.append(update["update_id"])
+
+    dp = FakeDispatcher()
+    client = await serve(WebhookServer(None, dp, path="/hook", secret=SECRET, dedup=LocalUpdateDedup(), sink=sink))
+
+    assert (await client.post("/hook", json={"update_id": 1}, headers=HEADERS)).status == 500
+    assert (await client.post("/hook", json={"update_id": 1}, headers=HEADERS)).status == 200
+    assert handed == [None, 1]
+    assert dp.fed == []  # with a sink, updates are not processed here